@@ -1,5 +1,6 @@
 from dotenv import load_dotenv
 import os
+import tempfile
 
 load_dotenv()
 
@@ -19,10 +20,25 @@ if not REFRESH_SECRET_KEY:
 
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+# Verified access-token claims kept in memory until the token expires; 0 disables
+JWT_CLAIMS_CACHE_SIZE = int(os.getenv("JWT_CLAIMS_CACHE_SIZE", "10000"))
 
 # Password Security
 PASSWORD_PEPPER = os.getenv("PASSWORD_PEPPER", "")
 
+# Short-lived records (phone verification codes): Redis when several workers
+# serve the API, otherwise a swept in-memory store capped at TTL_STORE_MAX_ENTRIES
+TTL_STORE_REDIS_URL = os.getenv("TTL_STORE_REDIS_URL", "")
+TTL_STORE_MAX_ENTRIES = int(os.getenv("TTL_STORE_MAX_ENTRIES", "100000"))
+TTL_STORE_SWEEP_INTERVAL = int(os.getenv("TTL_STORE_SWEEP_INTERVAL", "60"))
+
+# Request rate limits (sliding window counters): Redis shares them across workers,
+# otherwise each worker keeps up to RATE_LIMIT_MAX_KEYS keys in memory
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Window of the per-plan limits (QuotaManager.PLANS['*']['rate_limits'])
+RATE_LIMIT_WINDOW_SECONDS = int(os.getenv("RATE_LIMIT_WINDOW_SECONDS", "60"))
+
 # CORS Configuration - CRITICAL: Must be restrictive in production
 ENV = os.getenv("ENV", "development")
 if ENV == "production":
@@ -41,6 +57,15 @@ AWS_REGION_AI_V3 = os.getenv("AWS_REGION_AI_V3", "eu-north-1")
 S3_BUCKET_V3 = os.getenv("S3_BUCKET_V3", "vitiscanpro-v3-eu-west-3")
 S3_BUCKET_V3_STAGING = os.getenv("S3_BUCKET_V3_STAGING", "vitiscanpro-v3-staging-eu-west-3")
 S3_BUCKET_AI_IMAGES_V3 = os.getenv("S3_BUCKET_AI_IMAGES_V3", "vitiscan-ai-images-v3-eu-north-1")
+# boto3 is synchronous: calls run on a dedicated bounded pool, sized with the HTTP pool
+S3_IO_WORKERS = int(os.getenv("S3_IO_WORKERS", "16"))
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "32"))
+S3_CONNECT_TIMEOUT = int(os.getenv("S3_CONNECT_TIMEOUT", "5"))
+S3_READ_TIMEOUT = int(os.getenv("S3_READ_TIMEOUT", "60"))
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", "3"))
+# Presigned URLs let clients transfer scan bytes directly with S3
+S3_PRESIGN_UPLOAD_EXPIRES = int(os.getenv("S3_PRESIGN_UPLOAD_EXPIRES", "900"))
+S3_PRESIGN_DOWNLOAD_EXPIRES = int(os.getenv("S3_PRESIGN_DOWNLOAD_EXPIRES", "300"))
 
 # Telegram Bot Configuration
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -71,9 +96,50 @@ EPHY_DATASET_API_URL = os.getenv(
 EPHY_STORAGE_PATH = os.getenv("EPHY_STORAGE_PATH", "data/ephy/ephy.sqlite")
 EPHY_VITICULTURE_ONLY = os.getenv("EPHY_VITICULTURE_ONLY", "true").lower() == "true"
 
+# ZNT (zones non traitées) reference layers, GeoJSON in WGS84
+ZNT_HYDRO_LAYER_PATH = os.getenv("ZNT_HYDRO_LAYER_PATH", "data/znt/hydrography.geojson")
+ZNT_HEDGE_LAYER_PATH = os.getenv("ZNT_HEDGE_LAYER_PATH", "data/znt/hedges.geojson")
+ZNT_CACHE_SIZE = int(os.getenv("ZNT_CACHE_SIZE", "512"))
+
 # File Upload Configuration - V5.1 Fix
 MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", "50"))
 MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
+# Uploads are streamed: read in chunks, sent to S3 as multipart parts (min 5 MB)
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(256 * 1024)))
+# Batch uploads (drone flights): files per request and concurrent S3 writes
+SCAN_BATCH_MAX_FILES = int(os.getenv("SCAN_BATCH_MAX_FILES", "500"))
+SCAN_BATCH_CONCURRENCY = int(os.getenv("SCAN_BATCH_CONCURRENCY", "8"))
+
+# Password hashing: bcrypt cost, dedicated threads and calls admitted before 503s
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+
+# Scan previews: thumbnails and tile pyramids rendered in a process pool
+IMAGING_WORKERS = int(os.getenv("IMAGING_WORKERS", "2"))
+IMAGING_TILE_SIZE = int(os.getenv("IMAGING_TILE_SIZE", "256"))
+IMAGING_THUMBNAIL_SIZE = int(os.getenv("IMAGING_THUMBNAIL_SIZE", "320"))
+# Vegetation indices (NDVI/NDRE): 1-based band indexes of multispectral GeoTIFFs,
+# processed in windows of IMAGING_BLOCK_SIZE pixels; 0 disables NDRE
+IMAGING_BAND_RED = int(os.getenv("IMAGING_BAND_RED", "3"))
+IMAGING_BAND_NIR = int(os.getenv("IMAGING_BAND_NIR", "4"))
+IMAGING_BAND_RED_EDGE = int(os.getenv("IMAGING_BAND_RED_EDGE", "5"))
+IMAGING_BLOCK_SIZE = int(os.getenv("IMAGING_BLOCK_SIZE", "1024"))
+IMAGING_TMP_DIR = os.getenv("IMAGING_TMP_DIR") or None
+# Metadata comes from ranged reads of the headers, grown once by at most this much
+IMAGING_HEADER_BYTES = int(os.getenv("IMAGING_HEADER_BYTES", str(256 * 1024)))
+# Local disk LRU in front of S3 for scan downloads; 0 disables it
+SCAN_CACHE_DIR = os.getenv("SCAN_CACHE_DIR") or os.path.join(IMAGING_TMP_DIR or tempfile.gettempdir(), "vitiscan-scan-cache")
+SCAN_CACHE_MAX_MB = int(os.getenv("SCAN_CACHE_MAX_MB", "2048"))
+SCAN_CACHE_MAX_OBJECT_MB = int(os.getenv("SCAN_CACHE_MAX_OBJECT_MB", "0"))
+S3_MULTIPART_PART_SIZE = max(int(os.getenv("S3_MULTIPART_PART_SIZE", str(5 * 1024 * 1024))), 5 * 1024 * 1024)
+# Resumable uploads: one chunk per S3 part; idle sessions expire and are swept
+UPLOAD_SESSION_CHUNK_SIZE = max(int(os.getenv("UPLOAD_SESSION_CHUNK_SIZE", str(S3_MULTIPART_PART_SIZE))), 5 * 1024 * 1024)
+UPLOAD_SESSION_TTL_HOURS = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+UPLOAD_SESSION_GC_INTERVAL = int(os.getenv("UPLOAD_SESSION_GC_INTERVAL", "900"))
+# A finalisation still "completing" after this long was interrupted (crash, restart) and is failed by the sweep
+UPLOAD_SESSION_COMPLETING_GRACE_MINUTES = int(os.getenv("UPLOAD_SESSION_COMPLETING_GRACE_MINUTES", "30"))
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads/")
 ALLOWED_FILE_EXTENSIONS = os.getenv("ALLOWED_FILE_EXTENSIONS", ".jpg,.jpeg,.png,.tiff,.geotiff,.pdf").split(",")
 ALLOWED_MIME_TYPES = os.getenv("ALLOWED_MIME_TYPES", "image/jpeg,image/png,image/tiff,application/pdf").split(",")
@@ -82,6 +148,13 @@ ALLOWED_MIME_TYPES = os.getenv("ALLOWED_MIME_TYPES", "image/jpeg,image/png,image
 VIRUS_SCAN_ENABLED = os.getenv("VIRUS_SCAN_ENABLED", "false").lower() == "true"
 CLAMAV_HOST = os.getenv("CLAMAV_HOST", "localhost")
 CLAMAV_PORT = int(os.getenv("CLAMAV_PORT", "3310"))
+# clamd's StreamMaxLength must be at least MAX_FILE_SIZE_MB, or large files come back as errors
+CLAMAV_TIMEOUT = float(os.getenv("CLAMAV_TIMEOUT", "30"))
+# Chunks buffered ahead of clamd before the upload waits for it
+CLAMAV_QUEUE_CHUNKS = int(os.getenv("CLAMAV_QUEUE_CHUNKS", "16"))
+# Reject uploads when clamd cannot be reached (default: accept and flag them)
+VIRUS_SCAN_FAIL_CLOSED = os.getenv("VIRUS_SCAN_FAIL_CLOSED", "false").lower() == "true"
+VIRUS_QUARANTINE_PREFIX = os.getenv("VIRUS_QUARANTINE_PREFIX", "quarantine/")
 
 # Treatments Configuration
 TREATMENT_PRODUCTS = os.getenv(
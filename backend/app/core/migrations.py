@@ -278,12 +278,89 @@ class Migration005AuditLogsAndTokens(Migration):
         await db.drop_collection("audit_logs")
         await db.drop_collection("capability_tokens")
 
+class Migration006TreatmentsEstablishment(Migration):
+    """Denormalize establishment_id onto treatments for season-wide queries"""
+    def __init__(self):
+        super().__init__("006", "Add establishment_id to treatments")
+    
+    async def up(self, db: AsyncIOMotorDatabase):
+        parcels = await db.parcels.find({}, {"establishment_id": 1}).to_list(length=None)
+        for parcel in parcels:
+            await db.treatments.update_many(
+                {"parcel_id": str(parcel["_id"]), "establishment_id": {"$exists": False}},
+                {"$set": {"establishment_id": parcel.get("establishment_id")}}
+            )
+        
+        await db.treatments.create_index([
+            ("establishment_id", 1),
+            ("data_tratament", 1)
+        ])
+    
+    async def down(self, db: AsyncIOMotorDatabase):
+        await db.treatments.update_many({}, {"$unset": {"establishment_id": ""}})
+        await db.treatments.drop_index("establishment_id_1_data_tratament_1")
+
+class Migration007IftRollups(Migration):
+    """Compute IFT on existing treatments and build the season rollups"""
+    def __init__(self):
+        super().__init__("007", "Backfill treatment IFT and ift_rollups")
+    
+    async def up(self, db: AsyncIOMotorDatabase):
+        from pathlib import Path
+        from pymongo import UpdateOne
+        from app.core.config import EPHY_STORAGE_PATH
+        from app.ephy.index import EphyIndex
+        from app.treatments.ift import reference_doses, rollup_operations, treatment_ift
+        
+        treatments = await db.treatments.find({}).to_list(length=None)
+        try:
+            usages = EphyIndex(Path(EPHY_STORAGE_PATH)).get_usages_for_amms(
+                t["amm"] for t in treatments if t.get("amm")
+            )
+            references = reference_doses(usages)
+        except Exception as e:
+            logger.warning(f"E-Phy index unavailable, IFT backfilled without reference doses: {e}")
+            references = {}
+        
+        parcels = await db.parcels.find({}, {"area_ha": 1}).to_list(length=None)
+        areas = {str(p["_id"]): p.get("area_ha") for p in parcels}
+        
+        await db.ift_rollups.delete_many({})
+        treatment_updates = []
+        rollup_updates = []
+        for t in treatments:
+            if not t.get("data_tratament") or not t.get("parcel_id"):
+                continue
+            reference = references.get(t.get("amm"))
+            area = areas.get(t["parcel_id"])
+            ift = treatment_ift(t.get("doza_aplicata") or 0, t.get("suprafata_tratata"), area, reference)
+            treatment_updates.append(UpdateOne(
+                {"_id": t["_id"]},
+                {"$set": {"ift": ift, "ift_reference_dose": reference.dose if reference else None}}
+            ))
+            rollup_updates.extend(rollup_operations(t, ift, area))
+        
+        if treatment_updates:
+            await db.treatments.bulk_write(treatment_updates, ordered=False)
+        if rollup_updates:
+            # Ordered: treatments of one parcel and season upsert the same rollup documents
+            await db.ift_rollups.bulk_write(rollup_updates)
+        
+        await db.ift_rollups.create_index([("scope", 1), ("scope_id", 1), ("season", 1)], unique=True)
+        await db.ift_rollups.create_index([("establishment_id", 1), ("user_id", 1)])
+    
+    async def down(self, db: AsyncIOMotorDatabase):
+        await db.treatments.update_many({}, {"$unset": {"ift": "", "ift_reference_dose": ""}})
+        await db.drop_collection("ift_rollups")
+
 # Register migrations
 migration_manager.register(Migration001AddPhoneToUsers())
 migration_manager.register(Migration002AddCoordinatesParcels())
 migration_manager.register(Migration003BetaRequests())
 migration_manager.register(Migration004Relationships())
 migration_manager.register(Migration005AuditLogsAndTokens())
+migration_manager.register(Migration006TreatmentsEstablishment())
+migration_manager.register(Migration007IftRollups())
 
 # Export
 __all__ = ["migration_manager", "Migration", "MigrationManager"]
@@ -0,0 +1,120 @@
+"""
+Password hashing off the event loop
+bcrypt costs 100-300 ms of CPU per call; run inline in an async handler it
+stalls every request of the worker. Calls go to a small dedicated thread pool
+(bcrypt releases the GIL while hashing) behind an admission limit: once
+PASSWORD_HASH_MAX_PENDING calls are queued or running, new ones get a 503
+instead of piling up behind a login burst.
+"""
+import asyncio
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import bcrypt
+from fastapi import HTTPException
+
+from app.core import config
+from app.core.logger import logger
+
+# $2b$12$... : scheme and cost of a bcrypt hash
+BCRYPT_HASH = re.compile(r"^\$(2[abxy])\$(\d{2})\$")
+CURRENT_SCHEME = "2b"
+
+
+class PasswordHasher:
+    def __init__(self, rounds: int = 12, workers: int = 2, max_pending: int = 32, retry_after: int = 1):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    def _timed(self, fn, *args):
+        # Runs on the pool threads
+        with self._lock:
+            self._running += 1
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._busy_seconds += time.perf_counter() - started
+                self._running -= 1
+
+    async def _submit(self, fn, *args):
+        # Counted on the loop thread only: no lock needed for the admission check
+        if self._pending >= self.max_pending:
+            self._rejected += 1
+            logger.warning(f"Password hashing saturated ({self._pending} pending), rejecting request")
+            raise HTTPException(
+                status_code=503,
+                detail="Service momentanément surchargé, réessayez",
+                headers={"Retry-After": str(self.retry_after)}
+            )
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), self._timed, fn, *args
+            )
+        finally:
+            self._pending -= 1
+            self._completed += 1
+
+    async def hash(self, password: str) -> str:
+        hashed = await self._submit(
+            lambda: bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=self.rounds))
+        )
+        return hashed.decode("utf-8")
+
+    async def verify(self, password: str, hashed: Optional[str]) -> bool:
+        if not password or not hashed or not BCRYPT_HASH.match(hashed):
+            return False
+        try:
+            return await self._submit(bcrypt.checkpw, password.encode("utf-8"), hashed.encode("utf-8"))
+        except ValueError:
+            # Malformed stored hash: same answer as a wrong password
+            return False
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """True for hashes made with an older scheme or a lower cost than configured"""
+        match = BCRYPT_HASH.match(hashed or "")
+        if not match:
+            return False
+        return match.group(1) != CURRENT_SCHEME or int(match.group(2)) < self.rounds
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "in_flight": self._running,
+            "queued": max(0, self._pending - self._running),
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "busy_seconds": round(self._busy_seconds, 3),
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    rounds=config.PASSWORD_HASH_ROUNDS,
+    workers=config.PASSWORD_HASH_WORKERS,
+    max_pending=config.PASSWORD_HASH_MAX_PENDING
+)
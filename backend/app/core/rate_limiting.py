@@ -2,13 +2,189 @@
 Rate limiting and quota management
 Prevents abuse and supports tiered pricing plans
 """
-from datetime import datetime, timedelta
+import math
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
 from typing import Optional
+from bson import ObjectId
+from bson.errors import InvalidId
 from fastapi import HTTPException, Request, status
-from app.core.database import get_db
+from fastapi.responses import JSONResponse
+from jose import JWTError
+from slowapi import Limiter
+from slowapi.util import get_remote_address
+from app.core import config
+from app.core.database import db, get_db
+from app.core.logger import logger
+from app.core.security import request_claims
+from app.core.ttl_store import MemoryTTLStore
+
+
+@dataclass(slots=True)
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    # Seconds until a request of the same cost would be accepted (0 when allowed)
+    retry_after: float
+    # Seconds until the current window closes
+    reset_after: float
+
+
+def _window_result(limit: int, window: float, cost: int, allowed: bool, estimate: float, prev: float, cur: float, frac: float) -> RateLimitResult:
+    """Shared arithmetic of the sliding window counter, for both backends
+
+    The count over the last `window` seconds is estimated as the previous
+    fixed window weighted by how much of it still overlaps, plus the current one.
+    """
+    reset_after = (1 - frac) * window
+    if allowed:
+        return RateLimitResult(True, limit, max(0, math.floor(limit - estimate)), 0.0, reset_after)
+    budget = limit - cost
+    if budget < 0:
+        retry_after = float("inf")
+    elif cur <= budget and prev > 0:
+        # Still in this window, once enough of the previous one has slid out
+        retry_after = ((1 - (budget - cur) / prev) - frac) * window
+    else:
+        # Next window: the current count becomes the weighted one
+        retry_after = reset_after + (max(0.0, 1 - budget / cur) * window if cur > 0 else 0.0)
+    return RateLimitResult(False, limit, 0, max(0.0, retry_after), reset_after)
+
+
+class SlidingWindowLimiter:
+    """Sliding window counter kept in process memory
+
+    Each key holds three numbers (window index, previous and current counts)
+    whatever its traffic. Keys idle for two windows carry no information and
+    are evicted as other keys are hit; at most `max_keys` are kept.
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        # key -> [window index, previous count, current count, idle deadline]
+        self._state: "OrderedDict[str, list]" = OrderedDict()
+        self._next_eviction = 0.0
+
+    def _evict(self, now: float) -> None:
+        # Least recently hit first: stops at the first key still in use
+        while self._state:
+            key, state = next(iter(self._state.items()))
+            if state[3] > now and len(self._state) <= self.max_keys:
+                break
+            del self._state[key]
+        self._next_eviction = now + 1
+
+    def hit_now(self, key: str, limit: int, window: float, cost: int = 1, now: Optional[float] = None) -> RateLimitResult:
+        """Count a request of `cost` if it fits in the limit (cost 0 only reads)"""
+        now = time.time() if now is None else now
+        index = now // window
+        state = self._state.get(key)
+        if state is None:
+            state = [index, 0, 0, 0.0]
+            self._state[key] = state
+        else:
+            self._state.move_to_end(key)
+        if index > state[0]:
+            state[1] = state[2] if index == state[0] + 1 else 0
+            state[2] = 0
+            state[0] = index
+        frac = now / window - index
+        estimate = state[1] * (1 - frac) + state[2]
+        allowed = estimate + cost <= limit
+        if allowed:
+            state[2] += cost
+            estimate += cost
+        state[3] = now + 2 * window
+        if now >= self._next_eviction or len(self._state) > self.max_keys:
+            self._evict(now)
+        return _window_result(limit, window, cost, allowed, estimate, state[1], state[2], frac)
+
+    async def hit(self, key: str, limit: int, window: float, cost: int = 1) -> RateLimitResult:
+        return self.hit_now(key, limit, window, cost)
+
+    def __len__(self) -> int:
+        return len(self._state)
+
+    async def close(self) -> None:
+        pass
+
+
+class RedisSlidingWindowLimiter:
+    """Same counter in Redis, updated by one script so workers share limits
+
+    Time comes from the Redis server, not from the workers' clocks.
+    """
+
+    SCRIPT = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local index = math.floor(now / window)
+local state = redis.call('HMGET', KEYS[1], 'w', 'p', 'c')
+local w = tonumber(state[1]) or index
+local prev = tonumber(state[2]) or 0
+local cur = tonumber(state[3]) or 0
+if index > w then
+    if index == w + 1 then prev = cur else prev = 0 end
+    cur = 0
+end
+local frac = now / window - index
+local estimate = prev * (1 - frac) + cur
+local allowed = 0
+if estimate + cost <= limit then
+    allowed = 1
+    cur = cur + cost
+    estimate = estimate + cost
+end
+redis.call('HSET', KEYS[1], 'w', index, 'p', prev, 'c', cur)
+redis.call('PEXPIRE', KEYS[1], math.ceil(window * 2000))
+return {allowed, tostring(estimate), tostring(prev), tostring(cur), tostring(frac)}
+"""
+
+    def __init__(self, url: str, prefix: str = "vitiscan:ratelimit:"):
+        import redis.asyncio as redis
+
+        self.prefix = prefix
+        self._client = redis.from_url(url, decode_responses=True)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    async def hit(self, key: str, limit: int, window: float, cost: int = 1) -> RateLimitResult:
+        allowed, estimate, prev, cur, frac = await self._script(
+            keys=[self.prefix + key], args=[limit, window, cost]
+        )
+        return _window_result(
+            limit, window, cost, bool(int(allowed)), float(estimate), float(prev), float(cur), float(frac)
+        )
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def build_rate_limiter(redis_url: Optional[str], max_keys: int = 100_000):
+    """Redis when a URL is configured (limits shared by workers), memory otherwise"""
+    if redis_url:
+        return RedisSlidingWindowLimiter(redis_url)
+    return SlidingWindowLimiter(max_keys=max_keys)
+
+
+rate_limiter = build_rate_limiter(config.RATE_LIMIT_REDIS_URL, config.RATE_LIMIT_MAX_KEYS)
+
+# Per-endpoint brute-force limits (@limiter.limit on auth routes), one instance for
+# the whole app. Its `enabled` flag also switches the plan policies below off.
+limiter = Limiter(
+    key_func=get_remote_address,
+    storage_uri=config.RATE_LIMIT_REDIS_URL if config.RATE_LIMIT_REDIS_URL and config.ENV == "production" else "memory://"
+)
+
+# Synchronous helpers, always process-local
+_local_limiter = SlidingWindowLimiter(max_keys=config.RATE_LIMIT_MAX_KEYS)
 
-# In-memory rate limiting (for production, use Redis)
-rate_limit_cache = {}
 
 class RateLimiter:
     """Rate limiting utility"""
@@ -23,42 +199,12 @@ class RateLimiter:
         Check if request is within rate limit
         Returns True if allowed, False if exceeded
         """
-        now = datetime.utcnow()
-        window_start = now - timedelta(seconds=window_seconds)
-        
-        if key not in rate_limit_cache:
-            rate_limit_cache[key] = []
-        
-        # Clean old requests
-        rate_limit_cache[key] = [
-            timestamp for timestamp in rate_limit_cache[key]
-            if timestamp > window_start
-        ]
-        
-        # Check limit
-        if len(rate_limit_cache[key]) >= max_requests:
-            return False
-        
-        # Add current request
-        rate_limit_cache[key].append(now)
-        return True
+        return _local_limiter.hit_now(key, max_requests, window_seconds).allowed
     
     @staticmethod
     def get_remaining(key: str, max_requests: int = 100, window_seconds: int = 60) -> int:
         """Get remaining requests in current window"""
-        now = datetime.utcnow()
-        window_start = now - timedelta(seconds=window_seconds)
-        
-        if key not in rate_limit_cache:
-            return max_requests
-        
-        # Clean old requests
-        rate_limit_cache[key] = [
-            timestamp for timestamp in rate_limit_cache[key]
-            if timestamp > window_start
-        ]
-        
-        return max(0, max_requests - len(rate_limit_cache[key]))
+        return _local_limiter.hit_now(key, max_requests, window_seconds, cost=0).remaining
 
 
 class QuotaManager:
@@ -70,21 +216,26 @@ class QuotaManager:
             'scans_per_month': 10,
             'storage_mb': 100,
             'team_members': 1,
-            'api_calls_per_day': 100
+            'api_calls_per_day': 100,
+            # Requests per RATE_LIMIT_WINDOW_SECONDS, by route class
+            'rate_limits': {'auth': 10, 'read': 120, 'write': 30, 'upload': 10, 'download': 60, 'export': 2}
         },
         'pro': {
             'parcels': 50,
             'scans_per_month': 500,
             'storage_mb': 5000,
             'team_members': 10,
-            'api_calls_per_day': 5000
+            'api_calls_per_day': 5000,
+            'rate_limits': {'auth': 10, 'read': 600, 'write': 120, 'upload': 60, 'download': 300, 'export': 10}
         },
         'enterprise': {
             'parcels': -1,  # unlimited
             'scans_per_month': -1,
             'storage_mb': -1,
             'team_members': -1,
-            'api_calls_per_day': -1
+            'api_calls_per_day': -1,
+            # Never unlimited: these protect the service, not the pricing
+            'rate_limits': {'auth': 10, 'read': 3000, 'write': 600, 'upload': 300, 'download': 1500, 'export': 60}
         }
     }
     
@@ -99,6 +250,11 @@ class QuotaManager:
         """Get limits for a plan"""
         return QuotaManager.PLANS.get(plan, QuotaManager.PLANS['free'])
     
+    @staticmethod
+    def get_rate_limit(plan: str, route_class: str) -> int:
+        """Requests per window allowed to one key of `plan` on `route_class` routes"""
+        return QuotaManager.get_plan_limits(plan)['rate_limits'][route_class]
+    
     @staticmethod
     def check_quota(
         user_id: str,
@@ -217,27 +373,132 @@ class QuotaManager:
         }
 
 
+# Route classes, first match wins; other GETs are reads and other methods writes
+ROUTE_CLASS_RULES = [
+    ("auth", None, re.compile(
+        r"^/(login|register|refresh|send-verification-code|verify-phone-code|password-reset/|beta-request/complete/)"
+    )),
+    ("upload", {"POST", "PUT"}, re.compile(
+        r"^/scans/([^/]+/upload(-batch|-sessions)?|upload-sessions/[^/]+/chunks/\d+)$|^/costs/import-csv$"
+    )),
+    # Bulk exports built server-side
+    ("export", {"GET"}, re.compile(r"^/scans/archive$|^/parcels/[^/]+/export$|^/costs/export-csv$")),
+    # Single files and their presigned URLs: viewers fetch them in many ranged requests
+    ("download", {"GET", "HEAD"}, re.compile(r"^/scans/(?!search$)[^/]+(/download-url|/indices/[^/]+)?$")),
+]
+EXEMPT_PATHS = re.compile(r"^/(health(/|$)|docs|redoc|openapi\.json)")
+READ_METHODS = {"GET", "HEAD"}
+
+# Plan and establishment of a caller, resolved once per minute rather than per request
+_subjects = MemoryTTLStore(max_entries=config.RATE_LIMIT_MAX_KEYS)
+SUBJECT_TTL_SECONDS = 60
+
+
+def classify_route(method: str, path: str) -> Optional[str]:
+    """Route class of a request, None for routes that are never limited"""
+    if method == "OPTIONS" or EXEMPT_PATHS.match(path):
+        return None
+    for route_class, methods, pattern in ROUTE_CLASS_RULES:
+        if (methods is None or method in methods) and pattern.match(path):
+            return route_class
+    return "read" if method in READ_METHODS else "write"
+
+
+async def _user_plan(user_id: Optional[str]) -> str:
+    try:
+        user = await db["users"].find_one({"_id": ObjectId(user_id)}, {"plan": 1})
+    except (InvalidId, TypeError):
+        return "free"
+    return (user or {}).get("plan") or "free"
+
+
+async def _resolve_subject(user_id: str, establishment_id: Optional[str]) -> dict:
+    """Key and plan of an authenticated caller: its establishment when it belongs to it"""
+    if establishment_id:
+        try:
+            establishment = await db["establishments"].find_one(
+                {"_id": ObjectId(establishment_id)}, {"user_id": 1, "plan": 1}
+            )
+        except InvalidId:
+            establishment = None
+        if establishment:
+            member = establishment.get("user_id") == user_id or await db["establishment_members"].find_one(
+                {"establishment_id": establishment_id, "user_id": user_id, "is_active": True}, {"_id": 1}
+            )
+            if member:
+                plan = establishment.get("plan") or await _user_plan(establishment.get("user_id"))
+                return {"key": f"est:{establishment_id}", "plan": plan}
+    # No (valid) establishment context: the user has its own budget, never a shared one
+    return {"key": f"user:{user_id}", "plan": await _user_plan(user_id)}
+
+
+async def request_subject(request: Request) -> dict:
+    """Rate limit key and plan of a request; anonymous callers are keyed by IP on the free plan"""
+    anonymous = {"key": f"ip:{get_remote_address(request)}", "plan": "free"}
+    authorization = request.headers.get("Authorization", "")
+    if not authorization.startswith("Bearer "):
+        return anonymous
+    try:
+        claims = request_claims(request, authorization[len("Bearer "):])
+    except JWTError:
+        return anonymous
+    user_id = claims.get("sub")
+    if not user_id:
+        return anonymous
+    tenant = claims.get("tenant_id") or request.headers.get("X-Tenant-Id") or ""
+    establishment_id = tenant.split(":", 1)[1] if tenant.startswith("est:") else tenant
+    cache_key = f"{user_id}|{establishment_id}"
+    subject = await _subjects.get(cache_key)
+    if subject is None:
+        subject = await _resolve_subject(user_id, establishment_id or None)
+        await _subjects.set(cache_key, subject, SUBJECT_TTL_SECONDS)
+    return subject
+
+
+def rate_limit_headers(result: RateLimitResult, route_class: str, window: int) -> dict:
+    """IETF RateLimit header fields (draft-ietf-httpapi-ratelimit-headers)"""
+    headers = {
+        "RateLimit-Limit": str(result.limit),
+        "RateLimit-Remaining": str(result.remaining),
+        "RateLimit-Reset": str(math.ceil(result.reset_after)),
+        "RateLimit-Policy": f'{result.limit};w={window};comment="{route_class}"',
+    }
+    if not result.allowed:
+        retry_after = result.retry_after if math.isfinite(result.retry_after) else window
+        headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return headers
+
+
 async def rate_limit_middleware(request: Request, call_next):
-    """Middleware for global rate limiting"""
-    
-    # Get user identifier (IP or user_id)
-    user_id = getattr(request.state, 'user_id', None)
-    ip = request.client.host if request.client else 'unknown'
-    key = f"rate_limit:{user_id or ip}"
-    
-    # Check rate limit (100 requests per minute)
-    if not RateLimiter.check_rate_limit(key, max_requests=100, window_seconds=60):
-        raise HTTPException(
+    """Middleware for rate limiting by plan, route class and establishment"""
+    route_class = classify_route(request.method, request.url.path)
+    if route_class is None or not limiter.enabled:
+        return await call_next(request)
+
+    window = config.RATE_LIMIT_WINDOW_SECONDS
+    try:
+        # Auth routes are hit before any token exists: always per IP
+        if route_class == "auth":
+            subject = {"key": f"ip:{get_remote_address(request)}", "plan": "free"}
+        else:
+            subject = await request_subject(request)
+        limit = QuotaManager.get_rate_limit(subject["plan"], route_class)
+        result = await rate_limiter.hit(f"{route_class}:{subject['key']}", limit, window)
+    except Exception as e:
+        # A limiter outage (Redis down) must not take the API with it
+        logger.error(f"Rate limiting skipped: {e}")
+        return await call_next(request)
+
+    headers = rate_limit_headers(result, route_class, window)
+    if not result.allowed:
+        return JSONResponse(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail="Rate limit exceeded. Please try again later."
+            content={"detail": "Rate limit exceeded. Please try again later."},
+            headers=headers
         )
-    
-    # Add rate limit headers
+
     response = await call_next(request)
-    remaining = RateLimiter.get_remaining(key, max_requests=100, window_seconds=60)
-    response.headers['X-RateLimit-Remaining'] = str(remaining)
-    response.headers['X-RateLimit-Limit'] = '100'
-    
+    response.headers.update(headers)
     return response
 
 
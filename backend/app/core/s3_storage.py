@@ -3,11 +3,17 @@ AWS S3 Storage Utilities for VitiScan v3
 
 This module provides functions for uploading and downloading files to/from AWS S3.
 Files are stored in S3 while metadata is kept in MongoDB.
+boto3 calls run on a bounded thread pool so transfers never block the event loop.
 """
 
+import asyncio
+import base64
 import boto3
-from botocore.exceptions import ClientError
-from typing import Optional, Tuple
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Optional, Tuple
 import logging
 from datetime import datetime
 import uuid
@@ -20,12 +26,25 @@ class S3Storage:
     
     def __init__(self):
         """Initialize S3 clients for different regions"""
+        # More HTTP connections than workers: multipart parts of one upload share a client
+        client_config = Config(
+            max_pool_connections=config.S3_MAX_POOL_CONNECTIONS,
+            connect_timeout=config.S3_CONNECT_TIMEOUT,
+            read_timeout=config.S3_READ_TIMEOUT,
+            retries={"max_attempts": config.S3_MAX_ATTEMPTS, "mode": "standard"}
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.S3_IO_WORKERS,
+            thread_name_prefix="s3-io"
+        )
+        
         # Client for main bucket (Paris - eu-west-3)
         self.s3_v3 = boto3.client(
             's3',
             aws_access_key_id=config.AWS_ACCESS_KEY_ID,
             aws_secret_access_key=config.AWS_SECRET_ACCESS_KEY,
-            region_name=config.AWS_REGION_V3
+            region_name=config.AWS_REGION_V3,
+            config=client_config
         )
         self.bucket_v3 = config.S3_BUCKET_V3
         
@@ -34,12 +53,27 @@ class S3Storage:
             's3',
             aws_access_key_id=config.AWS_ACCESS_KEY_ID,
             aws_secret_access_key=config.AWS_SECRET_ACCESS_KEY,
-            region_name=config.AWS_REGION_AI_V3
+            region_name=config.AWS_REGION_AI_V3,
+            config=client_config
         )
         self.bucket_ai_v3 = config.S3_BUCKET_AI_IMAGES_V3
         
         logger.info(f"S3Storage initialized with buckets: {self.bucket_v3}, {self.bucket_ai_v3}")
     
+    async def _run(self, fn, *args, **kwargs):
+        """Run a blocking boto3 call on the S3 I/O pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+    
+    def _select(self, bucket_type: str):
+        if bucket_type == "ai":
+            return self.s3_ai_v3, self.bucket_ai_v3
+        return self.s3_v3, self.bucket_v3
+    
+    def shutdown(self):
+        """Stop the I/O pool (in-flight transfers are allowed to finish)"""
+        self._executor.shutdown(wait=True)
+    
     def generate_s3_key(self, user_id: str, parcel_id: str, filename: str) -> str:
         """
         Generate a unique S3 key for a file
@@ -95,7 +129,8 @@ class S3Storage:
                 bucket = self.bucket_v3
             
             # Upload to S3
-            s3_client.put_object(
+            await self._run(
+                s3_client.put_object,
                 Bucket=bucket,
                 Key=s3_key,
                 Body=file_content,
@@ -119,6 +154,273 @@ class S3Storage:
             logger.error(error_msg)
             return False, None, error_msg
     
+    async def put_bytes(
+        self,
+        s3_key: str,
+        content: bytes,
+        content_type: str,
+        cache_control: Optional[str] = None,
+        bucket_type: str = "main"
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        Store content under an explicit key (derived files next to an original)
+        
+        Returns:
+            Tuple of (success, error_message)
+        """
+        try:
+            s3_client, bucket = self._select(bucket_type)
+            params = {"Bucket": bucket, "Key": s3_key, "Body": content, "ContentType": content_type}
+            if cache_control:
+                params["CacheControl"] = cache_control
+            await self._run(s3_client.put_object, **params)
+            return True, None
+        except ClientError as e:
+            error_msg = f"S3 upload error: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+        except Exception as e:
+            error_msg = f"Unexpected error during upload: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+    
+    async def upload_path(
+        self,
+        s3_key: str,
+        path: str,
+        content_type: str,
+        cache_control: Optional[str] = None,
+        bucket_type: str = "main"
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        Store a local file under an explicit key
+        
+        boto3's managed transfer reads the file part by part, so large
+        rasters never sit in memory.
+        
+        Returns:
+            Tuple of (success, error_message)
+        """
+        try:
+            s3_client, bucket = self._select(bucket_type)
+            extra_args = {"ContentType": content_type}
+            if cache_control:
+                extra_args["CacheControl"] = cache_control
+            await self._run(s3_client.upload_file, path, bucket, s3_key, ExtraArgs=extra_args)
+            return True, None
+        except (ClientError, BotoCoreError) as e:
+            error_msg = f"S3 upload error: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+        except Exception as e:
+            error_msg = f"Unexpected error during upload: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+    
+    async def upload_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        content_type: str,
+        user_id: str,
+        parcel_id: str,
+        bucket_type: str = "main"
+    ) -> Tuple[bool, Optional[str], int, Optional[str]]:
+        """
+        Stream a file to S3 as a multipart upload
+        
+        Chunks are grouped into parts of S3_MULTIPART_PART_SIZE, so memory per
+        upload stays bounded by one part whatever the file size. The multipart
+        upload is aborted on any failure; errors raised by the chunk source
+        itself (size limit, client disconnect) are re-raised to the caller.
+        
+        Args:
+            chunks: Async iterator of file content chunks
+            filename: Original filename
+            content_type: MIME type
+            user_id: User ID
+            parcel_id: Parcel ID
+            bucket_type: "main" or "ai" for different buckets
+            
+        Returns:
+            Tuple of (success, s3_key, size_in_bytes, error_message)
+        """
+        s3_key = self.generate_s3_key(user_id, parcel_id, filename)
+        if bucket_type == "ai":
+            s3_client = self.s3_ai_v3
+            bucket = self.bucket_ai_v3
+        else:
+            s3_client = self.s3_v3
+            bucket = self.bucket_v3
+        
+        upload_id = None
+        size = 0
+        try:
+            created = await self._run(
+                s3_client.create_multipart_upload,
+                Bucket=bucket,
+                Key=s3_key,
+                ContentType=content_type,
+                Metadata={
+                    'user_id': user_id,
+                    'parcel_id': parcel_id,
+                    'original_filename': filename
+                }
+            )
+            upload_id = created["UploadId"]
+            
+            parts = []
+            buffer = bytearray()
+            
+            async def flush():
+                part_number = len(parts) + 1
+                response = await self._run(
+                    s3_client.upload_part,
+                    Bucket=bucket,
+                    Key=s3_key,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=bytes(buffer)
+                )
+                parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+                buffer.clear()
+            
+            async for chunk in chunks:
+                size += len(chunk)
+                buffer.extend(chunk)
+                if len(buffer) >= config.S3_MULTIPART_PART_SIZE:
+                    await flush()
+            # The last part may be smaller than 5 MB (and is the only one for small files)
+            if buffer or not parts:
+                await flush()
+            
+            await self._run(
+                s3_client.complete_multipart_upload,
+                Bucket=bucket,
+                Key=s3_key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts}
+            )
+            
+            logger.info(f"File streamed to S3: {bucket}/{s3_key} ({size} bytes, {len(parts)} parts)")
+            return True, s3_key, size, None
+            
+        except (ClientError, BotoCoreError) as e:
+            await self._abort_multipart(s3_client, bucket, s3_key, upload_id)
+            error_msg = f"S3 upload error: {str(e)}"
+            logger.error(error_msg)
+            return False, None, size, error_msg
+        except BaseException:
+            await self._abort_multipart(s3_client, bucket, s3_key, upload_id)
+            raise
+    
+    async def _abort_multipart(self, s3_client, bucket: str, s3_key: str, upload_id: Optional[str]):
+        if not upload_id:
+            return
+        try:
+            await self._run(
+                s3_client.abort_multipart_upload,
+                Bucket=bucket,
+                Key=s3_key,
+                UploadId=upload_id
+            )
+            logger.info(f"Multipart upload aborted: {bucket}/{s3_key}")
+        except Exception as e:
+            # Left to the bucket's AbortIncompleteMultipartUpload lifecycle rule
+            logger.error(f"Failed to abort multipart upload {bucket}/{s3_key}: {str(e)}")
+    
+    async def start_multipart(
+        self,
+        s3_key: str,
+        content_type: str,
+        metadata: Optional[dict] = None,
+        bucket_type: str = "main"
+    ) -> Tuple[bool, Optional[str], Optional[str]]:
+        """
+        Open a multipart upload whose parts arrive in separate requests
+        
+        Returns:
+            Tuple of (success, upload_id, error_message)
+        """
+        try:
+            s3_client, bucket = self._select(bucket_type)
+            created = await self._run(
+                s3_client.create_multipart_upload,
+                Bucket=bucket,
+                Key=s3_key,
+                ContentType=content_type,
+                Metadata=metadata or {}
+            )
+            return True, created["UploadId"], None
+        except (ClientError, BotoCoreError) as e:
+            error_msg = f"S3 multipart error: {str(e)}"
+            logger.error(error_msg)
+            return False, None, error_msg
+    
+    async def upload_part(
+        self,
+        s3_key: str,
+        upload_id: str,
+        part_number: int,
+        data: bytes,
+        bucket_type: str = "main"
+    ) -> Tuple[bool, Optional[str], Optional[str]]:
+        """
+        Store one part of a multipart upload (re-sending a part replaces it)
+        
+        Returns:
+            Tuple of (success, part_etag, error_message)
+        """
+        try:
+            s3_client, bucket = self._select(bucket_type)
+            response = await self._run(
+                s3_client.upload_part,
+                Bucket=bucket,
+                Key=s3_key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=data
+            )
+            return True, response["ETag"], None
+        except (ClientError, BotoCoreError) as e:
+            error_msg = f"S3 part upload error: {str(e)}"
+            logger.error(error_msg)
+            return False, None, error_msg
+    
+    async def complete_multipart(
+        self,
+        s3_key: str,
+        upload_id: str,
+        parts: list,
+        bucket_type: str = "main"
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        Assemble the parts ([{"PartNumber", "ETag"}], ascending) into the object
+        
+        Returns:
+            Tuple of (success, error_message)
+        """
+        try:
+            s3_client, bucket = self._select(bucket_type)
+            await self._run(
+                s3_client.complete_multipart_upload,
+                Bucket=bucket,
+                Key=s3_key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts}
+            )
+            logger.info(f"Multipart upload completed: {bucket}/{s3_key} ({len(parts)} parts)")
+            return True, None
+        except (ClientError, BotoCoreError) as e:
+            error_msg = f"S3 multipart completion error: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+    
+    async def abort_multipart(self, s3_key: str, upload_id: str, bucket_type: str = "main"):
+        """Discard a multipart upload and the parts already stored"""
+        s3_client, bucket = self._select(bucket_type)
+        await self._abort_multipart(s3_client, bucket, s3_key, upload_id)
+    
     async def download_file(
         self,
         s3_key: str,
@@ -143,10 +445,8 @@ class S3Storage:
                 s3_client = self.s3_v3
                 bucket = self.bucket_v3
             
-            # Download from S3
-            response = s3_client.get_object(Bucket=bucket, Key=s3_key)
-            file_content = response['Body'].read()
-            content_type = response.get('ContentType', 'application/octet-stream')
+            # Download from S3; the body is read on the pool too
+            file_content, content_type = await self._run(self._get_object, s3_client, bucket, s3_key)
             
             logger.info(f"File downloaded from S3: {bucket}/{s3_key}")
             return True, file_content, content_type, None
@@ -163,6 +463,305 @@ class S3Storage:
             logger.error(error_msg)
             return False, None, None, error_msg
     
+    async def download_to_path(
+        self,
+        s3_key: str,
+        path: str,
+        bucket_type: str = "main"
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        Download an object to a local file (ranged parts, bounded memory)
+        
+        Returns:
+            Tuple of (success, error_message)
+        """
+        try:
+            s3_client, bucket = self._select(bucket_type)
+            await self._run(s3_client.download_file, bucket, s3_key, path)
+            logger.info(f"File downloaded from S3: {bucket}/{s3_key} -> {path}")
+            return True, None
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                error_msg = "File not found in S3"
+            else:
+                error_msg = f"S3 download error: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+        except Exception as e:
+            error_msg = f"Unexpected error during download: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+    
+    async def presigned_upload(
+        self,
+        s3_key: str,
+        content_type: str,
+        max_size: int,
+        expires_in: int,
+        metadata: Optional[dict] = None,
+        sha256: Optional[str] = None,
+        bucket_type: str = "main"
+    ) -> Tuple[bool, Optional[dict], Optional[str]]:
+        """
+        Presigned POST for a direct browser upload
+        
+        The policy pins the key and content type and caps the size, so S3
+        itself rejects anything the API would have refused. With `sha256`
+        (hex), it also pins the SHA-256 checksum: S3 verifies the body against
+        it and keeps it, so head_file(checksum=True) gives the content hash
+        without reading the object back.
+        
+        Returns:
+            Tuple of (success, {"url", "fields"}, error_message)
+        """
+        try:
+            s3_client, bucket = self._select(bucket_type)
+            fields = {"Content-Type": content_type}
+            conditions = [
+                {"Content-Type": content_type},
+                ["content-length-range", 1, max_size]
+            ]
+            for name, value in (metadata or {}).items():
+                fields[f"x-amz-meta-{name}"] = value
+                conditions.append({f"x-amz-meta-{name}": value})
+            if sha256:
+                checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+                fields["x-amz-checksum-algorithm"] = "SHA256"
+                fields["x-amz-checksum-sha256"] = checksum
+                conditions.append({"x-amz-checksum-algorithm": "SHA256"})
+                conditions.append({"x-amz-checksum-sha256": checksum})
+            
+            # Signing is local (no request to S3)
+            presigned = s3_client.generate_presigned_post(
+                Bucket=bucket,
+                Key=s3_key,
+                Fields=fields,
+                Conditions=conditions,
+                ExpiresIn=expires_in
+            )
+            return True, presigned, None
+        except Exception as e:
+            error_msg = f"S3 presign error: {str(e)}"
+            logger.error(error_msg)
+            return False, None, error_msg
+    
+    async def presigned_download(
+        self,
+        s3_key: str,
+        filename: str,
+        expires_in: int,
+        bucket_type: str = "main"
+    ) -> Tuple[bool, Optional[str], Optional[str]]:
+        """
+        Presigned GET URL that downloads the object under its original filename
+        
+        Returns:
+            Tuple of (success, url, error_message)
+        """
+        try:
+            s3_client, bucket = self._select(bucket_type)
+            url = s3_client.generate_presigned_url(
+                "get_object",
+                Params={
+                    "Bucket": bucket,
+                    "Key": s3_key,
+                    "ResponseContentDisposition": f'attachment; filename="{filename}"'
+                },
+                ExpiresIn=expires_in
+            )
+            return True, url, None
+        except Exception as e:
+            error_msg = f"S3 presign error: {str(e)}"
+            logger.error(error_msg)
+            return False, None, error_msg
+    
+    async def head_file(
+        self,
+        s3_key: str,
+        checksum: bool = False,
+        bucket_type: str = "main"
+    ) -> Tuple[bool, Optional[dict], Optional[str]]:
+        """
+        Object metadata without the body
+        
+        Args:
+            checksum: Also ask for the SHA-256 checksum S3 stored with the object
+        
+        Returns:
+            Tuple of (success, {"size", "content_type", "etag", "metadata", "sha256"}, error_message).
+            "sha256" is hex, None when not asked for, not stored or composite (multipart).
+        """
+        try:
+            s3_client, bucket = self._select(bucket_type)
+            params = {"Bucket": bucket, "Key": s3_key}
+            if checksum:
+                params["ChecksumMode"] = "ENABLED"
+            response = await self._run(s3_client.head_object, **params)
+            sha256 = None
+            stored = response.get("ChecksumSHA256")
+            if stored and "-" not in stored:
+                try:
+                    sha256 = base64.b64decode(stored, validate=True).hex()
+                except ValueError:
+                    pass
+            return True, {
+                "size": response.get("ContentLength", 0),
+                "content_type": response.get("ContentType", "application/octet-stream"),
+                "etag": response.get("ETag", "").strip('"'),
+                "metadata": response.get("Metadata", {}),
+                "sha256": sha256
+            }, None
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                error_msg = "File not found in S3"
+            else:
+                error_msg = f"S3 head error: {str(e)}"
+            logger.error(error_msg)
+            return False, None, error_msg
+        except Exception as e:
+            error_msg = f"Unexpected error during head: {str(e)}"
+            logger.error(error_msg)
+            return False, None, error_msg
+    
+    async def read_range(
+        self,
+        s3_key: str,
+        start: int,
+        end: int,
+        bucket_type: str = "main"
+    ) -> Tuple[bool, Optional[bytes], Optional[str]]:
+        """
+        Read bytes [start, end] (inclusive) of an object
+        
+        Returns:
+            Tuple of (success, content, error_message)
+        """
+        try:
+            s3_client, bucket = self._select(bucket_type)
+            content = await self._run(self._get_range, s3_client, bucket, s3_key, start, end)
+            return True, content, None
+        except ClientError as e:
+            error_msg = f"S3 range read error: {str(e)}"
+            logger.error(error_msg)
+            return False, None, error_msg
+        except Exception as e:
+            error_msg = f"Unexpected error during range read: {str(e)}"
+            logger.error(error_msg)
+            return False, None, error_msg
+    
+    async def open_stream(
+        self,
+        s3_key: str,
+        byte_range: Optional[str] = None,
+        if_none_match: Optional[str] = None,
+        chunk_size: int = 1024 * 1024,
+        bucket_type: str = "main"
+    ) -> Tuple[bool, Optional[dict], Optional[str]]:
+        """
+        Open an object for chunked streaming
+        
+        Args:
+            s3_key: S3 key (path) of the file
+            byte_range: HTTP Range header value, forwarded to S3 (single range only)
+            if_none_match: HTTP If-None-Match header value, forwarded to S3
+            chunk_size: Size of the chunks yielded by the body iterator
+            bucket_type: "main" or "ai" for different buckets
+            
+        Returns:
+            Tuple of (success, info, error_message). info has "status" (200, 206,
+            304 or 416), "etag", "content_type", "content_length", "content_range",
+            "total_size" and "body", an async iterator over the object bytes
+            (None for 304/416).
+        """
+        s3_client, bucket = self._select(bucket_type)
+        params = {"Bucket": bucket, "Key": s3_key}
+        if byte_range:
+            params["Range"] = byte_range
+        if if_none_match:
+            params["IfNoneMatch"] = if_none_match
+        try:
+            response = await self._run(s3_client.get_object, **params)
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            if code in ('304', 'NotModified'):
+                etag = e.response.get('ResponseMetadata', {}).get('HTTPHeaders', {}).get('etag')
+                return True, {"status": 304, "etag": etag, "body": None}, None
+            if code == 'InvalidRange':
+                total = None
+                head_ok, head, _ = await self.head_file(s3_key, bucket_type=bucket_type)
+                if head_ok:
+                    total = head["size"]
+                return True, {"status": 416, "total_size": total, "body": None}, None
+            error_msg = "File not found in S3" if code == 'NoSuchKey' else f"S3 download error: {str(e)}"
+            logger.error(error_msg)
+            return False, None, error_msg
+        except Exception as e:
+            error_msg = f"Unexpected error during download: {str(e)}"
+            logger.error(error_msg)
+            return False, None, error_msg
+        
+        content_range = response.get('ContentRange')
+        total_size = int(content_range.rsplit('/', 1)[1]) if content_range else response.get('ContentLength')
+        body = response['Body']
+        
+        async def iterate():
+            try:
+                while True:
+                    chunk = await self._run(body.read, chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                body.close()
+        
+        return True, {
+            "status": 206 if content_range else 200,
+            "etag": response.get('ETag'),
+            "content_type": response.get('ContentType', 'application/octet-stream'),
+            "content_length": response.get('ContentLength'),
+            "content_range": content_range,
+            "total_size": total_size,
+            "body": iterate()
+        }, None
+    
+    @staticmethod
+    def _get_range(s3_client, bucket: str, s3_key: str, start: int, end: int) -> bytes:
+        response = s3_client.get_object(Bucket=bucket, Key=s3_key, Range=f"bytes={start}-{end}")
+        return response['Body'].read()
+    
+    @staticmethod
+    def _get_object(s3_client, bucket: str, s3_key: str) -> Tuple[bytes, str]:
+        response = s3_client.get_object(Bucket=bucket, Key=s3_key)
+        return response['Body'].read(), response.get('ContentType', 'application/octet-stream')
+    
+    async def copy_file(
+        self,
+        source_key: str,
+        target_key: str,
+        bucket_type: str = "main"
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        Server-side copy inside a bucket (no bytes go through the API)
+        
+        Returns:
+            Tuple of (success, error_message)
+        """
+        try:
+            s3_client, bucket = self._select(bucket_type)
+            # Single-request copy: scans are far below the 5 GB limit
+            await self._run(
+                s3_client.copy_object,
+                Bucket=bucket,
+                Key=target_key,
+                CopySource={"Bucket": bucket, "Key": source_key}
+            )
+            logger.info(f"File copied in S3: {bucket}/{source_key} -> {target_key}")
+            return True, None
+        except (ClientError, BotoCoreError) as e:
+            error_msg = f"S3 copy error: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+    
     async def delete_file(
         self,
         s3_key: str,
@@ -188,7 +787,7 @@ class S3Storage:
                 bucket = self.bucket_v3
             
             # Delete from S3
-            s3_client.delete_object(Bucket=bucket, Key=s3_key)
+            await self._run(s3_client.delete_object, Bucket=bucket, Key=s3_key)
             
             logger.info(f"File deleted from S3: {bucket}/{s3_key}")
             return True, None
@@ -202,6 +801,49 @@ class S3Storage:
             logger.error(error_msg)
             return False, error_msg
 
+    
+    async def delete_prefix(
+        self,
+        prefix: str,
+        bucket_type: str = "main"
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        Delete every object under a prefix (derived files of a scan)
+        
+        Returns:
+            Tuple of (success, error_message)
+        """
+        try:
+            s3_client, bucket = self._select(bucket_type)
+            deleted = 0
+            token = None
+            while True:
+                params = {"Bucket": bucket, "Prefix": prefix}
+                if token:
+                    params["ContinuationToken"] = token
+                listing = await self._run(s3_client.list_objects_v2, **params)
+                keys = [{"Key": item["Key"]} for item in listing.get("Contents", [])]
+                if keys:
+                    # A listing page holds at most 1000 keys, the DeleteObjects limit
+                    await self._run(s3_client.delete_objects, Bucket=bucket, Delete={"Objects": keys, "Quiet": True})
+                    deleted += len(keys)
+                if not listing.get("IsTruncated"):
+                    break
+                token = listing.get("NextContinuationToken")
+            
+            if deleted:
+                logger.info(f"Deleted {deleted} objects from S3: {bucket}/{prefix}")
+            return True, None
+            
+        except ClientError as e:
+            error_msg = f"S3 delete error: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+        except Exception as e:
+            error_msg = f"Unexpected error during delete: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+
 
 # Global instance
 s3_storage = S3Storage()
@@ -0,0 +1,91 @@
+"""
+Content-addressed storage of scan files
+One S3 object per distinct SHA-256, shared by every scan with that content
+and reference-counted in `scan_blobs` ({_id: sha256, s3_key, ref_count, owners})
+"""
+from datetime import datetime
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.core.database import db
+from app.core.logger import logger
+from app.core.s3_storage import s3_storage
+
+BLOBS_COLLECTION = "scan_blobs"
+
+
+async def claim_blob(
+    sha256: str,
+    s3_key: str,
+    s3_bucket: str,
+    size: int,
+    content_type: str,
+    user_id: str
+) -> dict:
+    """
+    Take a reference on the blob of `sha256`, registering `s3_key` as its object if new
+
+    Returns the blob: when its s3_key differs from the one given, the content
+    was already stored and the caller's object is a duplicate to delete.
+    """
+    update = {
+        "$inc": {"ref_count": 1},
+        "$addToSet": {"owners": user_id},
+        "$setOnInsert": {
+            "s3_key": s3_key,
+            "s3_bucket": s3_bucket,
+            "size": size,
+            "content_type": content_type,
+            "created_at": datetime.utcnow()
+        }
+    }
+    try:
+        return await db[BLOBS_COLLECTION].find_one_and_update(
+            {"_id": sha256}, update, upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Two uploads of the same content raced on the upsert: the loser now matches
+        return await db[BLOBS_COLLECTION].find_one_and_update(
+            {"_id": sha256}, update, upsert=True, return_document=ReturnDocument.AFTER
+        )
+
+
+async def link_blob(sha256: str, user_id: str) -> Optional[dict]:
+    """
+    Take a reference on an existing blob without any upload
+
+    Only blobs the user already uploaded can be linked, so a known hash never
+    grants access to another customer's file.
+    """
+    return await db[BLOBS_COLLECTION].find_one_and_update(
+        {"_id": sha256, "owners": user_id, "ref_count": {"$gt": 0}},
+        {"$inc": {"ref_count": 1}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def release_blob(sha256: str) -> bool:
+    """
+    Drop one reference; the S3 object and its derived files go with the last one
+
+    Returns True when the object was deleted.
+    """
+    blob = await db[BLOBS_COLLECTION].find_one_and_update(
+        {"_id": sha256},
+        {"$inc": {"ref_count": -1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if blob is None or blob["ref_count"] > 0:
+        return False
+    # Conditional delete: a concurrent claim may have re-referenced the blob meanwhile
+    deleted = await db[BLOBS_COLLECTION].delete_one({"_id": sha256, "ref_count": {"$lte": 0}})
+    if deleted.deleted_count == 0:
+        return False
+
+    bucket_type = blob.get("s3_bucket", "main")
+    await s3_storage.delete_file(blob["s3_key"], bucket_type=bucket_type)
+    await s3_storage.delete_prefix(f"{blob['s3_key']}.derived/", bucket_type=bucket_type)
+    logger.info(f"Blob {sha256} released, object {blob['s3_key']} deleted")
+    return True
@@ -0,0 +1,254 @@
+"""
+Local disk cache of scan files in front of S3
+Size-bounded LRU keyed by bucket, s3_key and ETag: a replaced object gets a new
+key, so entries never need invalidating and simply age out. A miss is never
+waited for: the request streams from S3 (ranges included) while one background
+download per object fills the cache for the next ones.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Optional
+
+from app.core import config
+from app.core.logger import logger
+from app.core.s3_storage import s3_storage
+
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+class ScanCache:
+    """LRU of S3 objects stored as files under `directory`, at most `max_bytes` in total"""
+
+    def __init__(
+        self,
+        directory: Path,
+        max_bytes: int,
+        max_object_bytes: Optional[int] = None,
+        storage=None
+    ):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_object_bytes = max_object_bytes or max_bytes
+        self._storage = storage or s3_storage
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._size = 0
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.errors = 0
+        self.bytes_served = 0
+        self.bytes_filled = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def cache_key(s3_key: str, etag: str, bucket_type: str = "main") -> str:
+        return hashlib.sha256(f"{bucket_type}:{s3_key}:{etag}".encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.bin"
+
+    def _load(self):
+        # Rebuild the index from the files left by a previous process, oldest use first
+        if self._loaded:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        found = []
+        for path in self.directory.iterdir():
+            if path.suffix == ".part":
+                path.unlink(missing_ok=True)
+            elif path.suffix == ".bin":
+                stat = path.stat()
+                found.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._size += size
+        self._loaded = True
+        self._evict()
+
+    def _forget(self, key: str):
+        self._size -= self._entries.pop(key, 0)
+
+    def _evict(self):
+        # Unlinking a file a response is still reading is safe: the open handle keeps it
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            self._path(key).unlink(missing_ok=True)
+            self.evictions += 1
+
+    async def _fill(self, key: str, s3_key: str, bucket_type: str) -> bool:
+        part = self.directory / f"{key}.{uuid.uuid4().hex}.part"
+        success, error = await self._storage.download_to_path(s3_key, str(part), bucket_type=bucket_type)
+        if not success:
+            self.errors += 1
+            part.unlink(missing_ok=True)
+            logger.warning(f"Scan cache fill failed for {s3_key}: {error}")
+            return False
+        size = part.stat().st_size
+        if size > self.max_object_bytes:
+            self.bypassed += 1
+            part.unlink(missing_ok=True)
+            return False
+        os.replace(part, self._path(key))
+        self._entries[key] = size
+        self._size += size
+        self.bytes_filled += size
+        self._evict()
+        return True
+
+    def _open_entry(self, key: str) -> Optional[BinaryIO]:
+        # No await between the index lookup and the open: eviction cannot unlink the
+        # file in between, and once open the handle keeps it readable
+        if key not in self._entries:
+            return None
+        path = self._path(key)
+        try:
+            handle = open(path, "rb")
+        except FileNotFoundError:
+            self._forget(key)
+            return None
+        self._entries.move_to_end(key)
+        # Keeps the LRU order across restarts, see _load
+        os.utime(path)
+        return handle
+
+    def fill(self, s3_key: str, etag: str, bucket_type: str = "main") -> asyncio.Task:
+        """Background download of an object into the cache, one per object at a time"""
+        key = self.cache_key(s3_key, etag, bucket_type)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fill(key, s3_key, bucket_type))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    def fetch(
+        self,
+        s3_key: str,
+        etag: str,
+        bucket_type: str = "main",
+        size: Optional[int] = None
+    ) -> Optional[BinaryIO]:
+        """
+        Open handle on the local copy of an object
+
+        Returns None on a miss, after starting the download that fills the
+        cache (unless one is running already), and for objects that are not
+        cacheable: the caller then streams from S3.
+        """
+        if not self.enabled or not etag:
+            return None
+        if size is not None and size > self.max_object_bytes:
+            self.bypassed += 1
+            return None
+        self._load()
+
+        key = self.cache_key(s3_key, etag, bucket_type)
+        handle = self._open_entry(key)
+        if handle is not None:
+            self.hits += 1
+            return handle
+        if key in self._inflight:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            self.fill(s3_key, etag, bucket_type)
+        return None
+
+    async def open_stream(
+        self,
+        s3_key: str,
+        etag: str,
+        byte_range: Optional[str] = None,
+        chunk_size: int = 1024 * 1024,
+        bucket_type: str = "main",
+        size: Optional[int] = None
+    ) -> Optional[dict]:
+        """
+        Serve an object from the cache, same info as S3Storage.open_stream
+
+        Returns None on a miss and when the object is not cacheable.
+        """
+        handle = self.fetch(s3_key, etag, bucket_type=bucket_type, size=size)
+        if handle is None:
+            return None
+        total = os.fstat(handle.fileno()).st_size
+        start, end = 0, total - 1
+        status = 200
+        match = RANGE_PATTERN.fullmatch(byte_range.strip()) if byte_range else None
+        if match and (match.group(1) or match.group(2)):
+            first, last = match.groups()
+            if first:
+                start = int(first)
+                end = min(int(last), total - 1) if last else total - 1
+            else:
+                start = max(total - int(last), 0)
+            if start >= total or start > end or (not first and int(last) == 0):
+                handle.close()
+                return {"status": 416, "etag": f'"{etag}"', "total_size": total, "body": None}
+            status = 206
+
+        length = end - start + 1
+        self.bytes_served += length
+
+        async def iterate() -> AsyncIterator[bytes]:
+            try:
+                position = start
+                while position <= end:
+                    chunk = await asyncio.to_thread(
+                        os.pread, handle.fileno(), min(chunk_size, end - position + 1), position
+                    )
+                    if not chunk:
+                        break
+                    position += len(chunk)
+                    yield chunk
+            finally:
+                handle.close()
+
+        return {
+            "status": status,
+            "etag": f'"{etag}"',
+            "content_length": length,
+            "content_range": f"bytes {start}-{end}/{total}" if status == 206 else None,
+            "total_size": total,
+            "body": iterate()
+        }
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "size_bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "errors": self.errors,
+            "bytes_served": self.bytes_served,
+            "bytes_filled": self.bytes_filled,
+            "filling": len(self._inflight),
+            # Misses, including those arriving while the object is being filled, went to S3
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None
+        }
+
+
+scan_cache = ScanCache(
+    Path(config.SCAN_CACHE_DIR),
+    max_bytes=config.SCAN_CACHE_MAX_MB * 1024 * 1024,
+    max_object_bytes=config.SCAN_CACHE_MAX_OBJECT_MB * 1024 * 1024
+)
@@ -2,9 +2,12 @@
 Security utilities for VitiScan v3
 Password hashing, token generation, and validation
 """
+import hashlib
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
-from fastapi import HTTPException, Header, Depends
+from fastapi import HTTPException, Header, Depends, Request
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from . import config
@@ -41,15 +44,89 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
+class ClaimsCache:
+    """Verified JWT claims by token digest, LRU-bounded, each entry dropped at the token's exp
+
+    Only tokens that passed signature and expiry checks are stored, so a hit
+    skips the HMAC but never accepts anything jose would have rejected.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, tuple[float, dict]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        if self.max_entries <= 0:
+            return None
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, claims = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return claims
+
+    def put(self, token: str, claims: dict) -> None:
+        exp = claims.get("exp")
+        # Tokens without exp never expire on their own: not worth pinning in memory
+        if self.max_entries <= 0 or not isinstance(exp, (int, float)):
+            return
+        key = self._key(token)
+        self._entries[key] = (float(exp), claims)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+
+claims_cache = ClaimsCache(config.JWT_CLAIMS_CACHE_SIZE)
+
+
+def verify_access_token(token: str) -> dict:
+    """Claims of a valid token, verified once per token lifetime; raises JWTError"""
+    claims = claims_cache.get(token)
+    if claims is None:
+        claims = jwt.decode(token, config.JWT_SECRET_KEY, algorithms=[config.JWT_ALGORITHM])
+        claims_cache.put(token, claims)
+    # Callers may annotate the payload: never hand out the cached dict itself
+    return dict(claims)
+
+
+def request_claims(request: Request, token: str) -> dict:
+    """Claims of `token`, verified at most once per request; raises JWTError
+
+    The result is kept on request.state, shared by the tenancy middleware and
+    the auth dependencies of the same request.
+    """
+    cached = getattr(request.state, "jwt_claims", None)
+    if cached is not None and cached[0] == token:
+        return dict(cached[1])
+    claims = verify_access_token(token)
+    request.state.jwt_claims = (token, claims)
+    return dict(claims)
+
+
 def decode_access_token(token: str) -> Optional[dict]:
     """Decode and validate a JWT token"""
     try:
-        payload = jwt.decode(
-            token,
-            config.JWT_SECRET_KEY,
-            algorithms=[config.JWT_ALGORITHM]
-        )
-        return payload
+        return verify_access_token(token)
     except JWTError:
         return None
 
@@ -70,7 +147,7 @@ def verify_beta_token(token: str) -> Optional[str]:
     return None
 
 
-async def get_current_user(authorization: Optional[str] = Header(None)):
+async def get_current_user(request: Request, authorization: Optional[str] = Header(None)):
     """Extract current user from JWT token"""
     if not authorization:
         raise HTTPException(status_code=401, detail="En-tête d'autorisation manquant")
@@ -85,8 +162,7 @@ async def get_current_user(authorization: Optional[str] = Header(None)):
     
     # Decode JWT
     try:
-        payload = jwt.decode(token, config.JWT_SECRET_KEY, algorithms=[config.JWT_ALGORITHM])
-        return payload
+        return request_claims(request, token)
     except JWTError:
         raise HTTPException(status_code=401, detail="Jeton invalide ou expiré")
 
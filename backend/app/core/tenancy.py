@@ -5,7 +5,7 @@ Provides tenant isolation and context management
 from typing import Optional
 from contextvars import ContextVar
 from fastapi import Request, HTTPException, status
-from app.core.security import decode_access_token
+from app.core.security import request_claims
 
 # Context variable to store current tenant_id across async operations
 current_tenant: ContextVar[Optional[str]] = ContextVar('current_tenant', default=None)
@@ -62,8 +62,8 @@ async def tenant_middleware(request: Request, call_next):
             token = auth_header.split(' ')[1]
             
             try:
-                # Decode JWT and extract tenant_id
-                payload = decode_access_token(token)
+                # Decode JWT and extract tenant_id; the verified claims are reused by get_current_user
+                payload = request_claims(request, token)
                 tenant_id = payload.get('tenant_id')
                 user_id = payload.get('sub')
                 
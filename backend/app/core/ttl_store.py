@@ -0,0 +1,154 @@
+"""
+Short-lived key/value records (phone verification codes, ...)
+Records are small string hashes that disappear after their TTL. The memory
+backend serves a single worker: expiries are kept in a heap that writes and
+a background sweep pop from, so expired records go away without being read
+and the store is capped. The Redis backend is shared by every worker and
+host; counters are incremented server-side, so concurrent attempts are never
+lost.
+"""
+import asyncio
+import heapq
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from app.core.logger import logger
+
+
+class TTLStore(ABC):
+    """Interface of both backends; field values are strings, as in Redis hashes"""
+
+    @abstractmethod
+    async def set(self, key: str, fields: dict, ttl_seconds: float) -> None:
+        ...
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[dict]:
+        """Fields of a live record, None when missing or expired"""
+
+    @abstractmethod
+    async def incr(self, key: str, field: str, amount: int = 1) -> Optional[int]:
+        """Atomically add to a counter field of a live record; None when it is gone"""
+
+    @abstractmethod
+    async def delete(self, key: str) -> bool:
+        """Remove a record; only one of several concurrent callers gets True"""
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryTTLStore(TTLStore):
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._records: dict[str, tuple[float, dict]] = {}
+        # (expires_at, key); entries made stale by a later set are skipped when popped
+        self._expiries: list[tuple[float, str]] = []
+
+    def _purge(self, now: float) -> int:
+        removed = 0
+        while self._expiries and self._expiries[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiries)
+            record = self._records.get(key)
+            if record is not None and record[0] == expires_at:
+                del self._records[key]
+                removed += 1
+        return removed
+
+    def _live(self, key: str) -> Optional[dict]:
+        record = self._records.get(key)
+        if record is None:
+            return None
+        if record[0] <= time.monotonic():
+            del self._records[key]
+            return None
+        return record[1]
+
+    async def set(self, key: str, fields: dict, ttl_seconds: float) -> None:
+        now = time.monotonic()
+        self._purge(now)
+        # Full of live records: the ones closest to expiry make room
+        while len(self._records) >= self.max_entries and key not in self._records and self._expiries:
+            expires_at, oldest = heapq.heappop(self._expiries)
+            record = self._records.get(oldest)
+            if record is not None and record[0] == expires_at:
+                del self._records[oldest]
+        expires_at = now + ttl_seconds
+        self._records[key] = (expires_at, {name: str(value) for name, value in fields.items()})
+        heapq.heappush(self._expiries, (expires_at, key))
+        # Re-set keys leave stale heap entries behind: rebuild before they dominate
+        if len(self._expiries) > 2 * max(len(self._records), 1024):
+            self._expiries = [(record[0], name) for name, record in self._records.items()]
+            heapq.heapify(self._expiries)
+
+    async def get(self, key: str) -> Optional[dict]:
+        fields = self._live(key)
+        return dict(fields) if fields is not None else None
+
+    async def incr(self, key: str, field: str, amount: int = 1) -> Optional[int]:
+        fields = self._live(key)
+        if fields is None:
+            return None
+        value = int(fields.get(field, "0")) + amount
+        fields[field] = str(value)
+        return value
+
+    async def delete(self, key: str) -> bool:
+        return self._records.pop(key, None) is not None
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    async def run_sweeper(self, interval_seconds: float):
+        """Drop expired records forever; started with the application"""
+        while True:
+            removed = self._purge(time.monotonic())
+            if removed:
+                logger.debug(f"TTL store sweep removed {removed} record(s)")
+            await asyncio.sleep(interval_seconds)
+
+
+class RedisTTLStore(TTLStore):
+    # HINCRBY on a missing key would create it without a TTL: only touch live records
+    INCR_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+end
+return false
+"""
+
+    def __init__(self, url: str, prefix: str = "vitiscan:"):
+        import redis.asyncio as redis
+
+        self.prefix = prefix
+        self._client = redis.from_url(url, decode_responses=True)
+        self._incr = self._client.register_script(self.INCR_SCRIPT)
+
+    async def set(self, key: str, fields: dict, ttl_seconds: float) -> None:
+        name = self.prefix + key
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.delete(name)
+            pipe.hset(name, mapping={field: str(value) for field, value in fields.items()})
+            pipe.pexpire(name, max(1, int(ttl_seconds * 1000)))
+            await pipe.execute()
+
+    async def get(self, key: str) -> Optional[dict]:
+        return await self._client.hgetall(self.prefix + key) or None
+
+    async def incr(self, key: str, field: str, amount: int = 1) -> Optional[int]:
+        value = await self._incr(keys=[self.prefix + key], args=[field, amount])
+        return int(value) if value is not None else None
+
+    async def delete(self, key: str) -> bool:
+        return await self._client.delete(self.prefix + key) == 1
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def build_ttl_store(redis_url: Optional[str], prefix: str, max_entries: int = 100_000) -> TTLStore:
+    """Redis when a URL is configured (several workers), memory otherwise"""
+    if redis_url:
+        return RedisTTLStore(redis_url, prefix=prefix)
+    return MemoryTTLStore(max_entries=max_entries)
@@ -0,0 +1,154 @@
+"""
+Resumable scan uploads
+A session maps a file to an S3 multipart upload: the client PUTs numbered
+chunks (one S3 part each) in any order, retries the ones lost to a dropped
+connection and finalises once all are in. Sessions live in
+`scan_upload_sessions`; abandoned ones are aborted by a periodic sweep so their
+parts stop costing storage, and so are finalisations interrupted while
+"completing". The same sweep deletes the objects of presigned
+uploads (`scan_uploads`) that were never confirmed.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+
+from app.core.config import UPLOAD_SESSION_COMPLETING_GRACE_MINUTES
+from app.core.database import db
+from app.core.logger import logger
+from app.core.s3_storage import s3_storage
+from app.core.scan_blobs import BLOBS_COLLECTION
+
+SESSIONS_COLLECTION = "scan_upload_sessions"
+PRESIGNED_COLLECTION = "scan_uploads"
+
+
+def chunk_count(file_size: int, chunk_size: int) -> int:
+    return max(1, -(-file_size // chunk_size))
+
+
+def expected_chunk_size(session: dict, number: int) -> Optional[int]:
+    """Exact size of chunk `number` (1-based), None when out of range"""
+    total = session["total_chunks"]
+    if number < 1 or number > total:
+        return None
+    if number < total:
+        return session["chunk_size"]
+    return session["file_size"] - session["chunk_size"] * (total - 1)
+
+
+def received_chunks(session: dict) -> list[int]:
+    return sorted(int(number) for number in (session.get("parts") or {}))
+
+
+def session_progress(session: dict) -> dict:
+    received = set(received_chunks(session))
+    # Offset of the contiguous prefix: where a sequential client resumes
+    contiguous = 0
+    while contiguous + 1 in received:
+        contiguous += 1
+    offset = sum(part["size"] for number, part in (session.get("parts") or {}).items() if int(number) <= contiguous)
+    return {
+        "received_chunks": sorted(received),
+        "missing_chunks": [n for n in range(1, session["total_chunks"] + 1) if n not in received],
+        "received_bytes": sum(part["size"] for part in (session.get("parts") or {}).values()),
+        "offset": offset,
+    }
+
+
+async def expire_sessions(now: Optional[datetime] = None) -> int:
+    """Abort the multipart uploads of expired and stalled sessions; returns the count
+
+    Expired open sessions are dropped; sessions stuck "completing" past the
+    grace period are marked failed, and their object deleted unless a blob owns it.
+    """
+    now = now or datetime.utcnow()
+    expired = await db[SESSIONS_COLLECTION].find(
+        {"status": "open", "expires_at": {"$lt": now}},
+        {"s3_key": 1, "s3_bucket": 1, "s3_upload_id": 1}
+    ).to_list(length=None)
+    removed = 0
+    for session in expired:
+        # Claimed first: a finalise racing with the sweep keeps the session
+        deleted = await db[SESSIONS_COLLECTION].delete_one(
+            {"_id": session["_id"], "status": "open", "expires_at": {"$lt": now}}
+        )
+        if deleted.deleted_count == 0:
+            continue
+        await s3_storage.abort_multipart(
+            session["s3_key"], session["s3_upload_id"], bucket_type=session.get("s3_bucket", "main")
+        )
+        removed += 1
+    removed += await _fail_stalled_sessions(now)
+    if removed:
+        logger.info(f"Expired {removed} resumable upload session(s)")
+    return removed
+
+
+async def _fail_stalled_sessions(now: datetime) -> int:
+    # Sessions claimed before updated_at was recorded fall back on their expiry
+    stalled = {
+        "status": "completing",
+        "$or": [
+            {"updated_at": {"$lt": now - timedelta(minutes=UPLOAD_SESSION_COMPLETING_GRACE_MINUTES)}},
+            {"updated_at": {"$exists": False}, "expires_at": {"$lt": now}},
+        ],
+    }
+    sessions = await db[SESSIONS_COLLECTION].find(
+        stalled, {"s3_key": 1, "s3_bucket": 1, "s3_upload_id": 1}
+    ).to_list(length=None)
+    failed = 0
+    for session in sessions:
+        claimed = await db[SESSIONS_COLLECTION].update_one(
+            {"_id": session["_id"], **stalled},
+            {
+                "$set": {"status": "failed", "reason": "Upload finalisation interrupted", "failed_at": now},
+                "$unset": {"parts": "", "expires_at": ""}
+            }
+        )
+        if claimed.modified_count == 0:
+            continue
+        bucket_type = session.get("s3_bucket", "main")
+        # The crash may have come before or after S3 assembled the parts
+        await s3_storage.abort_multipart(session["s3_key"], session["s3_upload_id"], bucket_type=bucket_type)
+        if not await db[BLOBS_COLLECTION].find_one({"s3_key": session["s3_key"]}, {"_id": 1}):
+            await s3_storage.delete_file(session["s3_key"], bucket_type=bucket_type)
+        failed += 1
+    return failed
+
+
+async def expire_presigned_uploads(now: Optional[datetime] = None) -> int:
+    """Delete the objects of unconfirmed presigned uploads past their expiry, then their records"""
+    now = now or datetime.utcnow()
+    # "expired" rows are claimed uploads whose object delete failed on an earlier sweep
+    stale = {"$or": [{"status": "pending", "expires_at": {"$lt": now}}, {"status": "expired"}]}
+    expired = await db[PRESIGNED_COLLECTION].find(stale, {"s3_key": 1, "s3_bucket": 1}).to_list(length=None)
+    removed = 0
+    for upload in expired:
+        # Claimed first: a late confirm can no longer turn the object into a scan
+        claimed = await db[PRESIGNED_COLLECTION].update_one(
+            {"_id": upload["_id"], **stale},
+            {"$set": {"status": "expired"}}
+        )
+        if claimed.matched_count == 0:
+            continue
+        # The record is kept until the object is gone so a failed delete is retried
+        deleted, error = await s3_storage.delete_file(upload["s3_key"], bucket_type=upload.get("s3_bucket", "main"))
+        if not deleted:
+            logger.error(f"Could not delete expired upload {upload['s3_key']}: {error}")
+            continue
+        await db[PRESIGNED_COLLECTION].delete_one({"_id": upload["_id"]})
+        removed += 1
+    if removed:
+        logger.info(f"Expired {removed} unconfirmed presigned upload(s)")
+    return removed
+
+
+async def run_session_gc(interval_seconds: int):
+    """Sweep expired sessions and presigned uploads forever; started with the application"""
+    while True:
+        for sweep in (expire_sessions, expire_presigned_uploads):
+            try:
+                await sweep()
+            except Exception as e:
+                logger.error(f"Upload sweep {sweep.__name__} failed: {e}")
+        await asyncio.sleep(interval_seconds)
@@ -0,0 +1,193 @@
+"""
+Virus scanning of uploads with clamd
+Bytes are streamed to clamd over INSTREAM while they go to S3: the upload
+feeds a bounded queue and a background task forwards it, so the verdict is
+ready about when the upload completes. Infected objects are moved under the
+quarantine prefix and recorded in `scan_quarantine`.
+"""
+import asyncio
+import struct
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from app.core import config
+from app.core.database import db
+from app.core.logger import logger
+from app.core.s3_storage import s3_storage
+
+QUARANTINE_COLLECTION = "scan_quarantine"
+
+CLEAN = "clean"
+INFECTED = "infected"
+ERROR = "error"
+
+
+@dataclass
+class ScanVerdict:
+    status: str
+    signature: Optional[str] = None
+    detail: Optional[str] = None
+
+    @property
+    def infected(self) -> bool:
+        return self.status == INFECTED
+
+    def as_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "signature": self.signature,
+            "detail": self.detail,
+            "scanned_at": datetime.utcnow()
+        }
+
+
+def parse_reply(reply: bytes) -> ScanVerdict:
+    """clamd answers 'stream: OK', 'stream: <signature> FOUND' or '<message> ERROR'"""
+    text = reply.rstrip(b"\0\n").decode("utf-8", "replace").strip()
+    if text.endswith("FOUND"):
+        signature = text.rsplit(":", 1)[-1][: -len("FOUND")].strip()
+        return ScanVerdict(INFECTED, signature=signature)
+    if text.endswith("OK"):
+        return ScanVerdict(CLEAN)
+    return ScanVerdict(ERROR, detail=text or "empty reply")
+
+
+class StreamScan:
+    """One INSTREAM session, fed chunk by chunk while the upload runs"""
+
+    def __init__(self, host: str, port: int, timeout: float, queue_chunks: int):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_chunks)
+        self._closed = False
+        self._task = asyncio.create_task(self._run())
+
+    async def _put(self, item: Optional[bytes]):
+        # A failed or stalled session stops taking data: the upload is never held up by it
+        if self._closed or self._task.done():
+            return
+        try:
+            await asyncio.wait_for(self._queue.put(item), self.timeout)
+        except asyncio.TimeoutError:
+            self._closed = True
+
+    async def feed(self, chunk: bytes):
+        if chunk:
+            await self._put(chunk)
+
+    async def result(self) -> ScanVerdict:
+        await self._put(None)
+        try:
+            return await asyncio.wait_for(self._task, self.timeout)
+        except asyncio.TimeoutError:
+            return ScanVerdict(ERROR, detail="clamd timed out")
+
+    def cancel(self):
+        self._closed = True
+        self._task.cancel()
+
+    async def _run(self) -> ScanVerdict:
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout
+            )
+            writer.write(b"zINSTREAM\0")
+            try:
+                while True:
+                    chunk = await self._queue.get()
+                    if chunk is None:
+                        break
+                    writer.write(struct.pack("!I", len(chunk)))
+                    writer.write(chunk)
+                    # clamd may stop reading: never wait on a full socket buffer forever
+                    await asyncio.wait_for(writer.drain(), self.timeout)
+                writer.write(struct.pack("!I", 0))
+                await asyncio.wait_for(writer.drain(), self.timeout)
+            except ConnectionError:
+                # clamd hangs up early on a size limit: its reply says why
+                pass
+            reply = await asyncio.wait_for(reader.readuntil(b"\0"), self.timeout)
+            return parse_reply(reply)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            logger.error(f"clamd scan failed: {e!r}")
+            if writer is not None:
+                # Unsent bytes would keep the socket open on a daemon that stopped reading
+                writer.transport.abort()
+            return ScanVerdict(ERROR, detail=str(e) or type(e).__name__)
+        finally:
+            # Release a producer blocked on a full queue; later feeds are dropped
+            self._closed = True
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            if writer is not None:
+                writer.close()
+
+
+class VirusScanner:
+    def __init__(
+        self,
+        enabled: bool,
+        host: str,
+        port: int,
+        timeout: float = 30,
+        queue_chunks: int = 16,
+        fail_closed: bool = False
+    ):
+        self.enabled = enabled
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.queue_chunks = queue_chunks
+        self.fail_closed = fail_closed
+
+    def start(self) -> Optional[StreamScan]:
+        """New scan session, None when scanning is disabled"""
+        if not self.enabled:
+            return None
+        return StreamScan(self.host, self.port, self.timeout, self.queue_chunks)
+
+    def rejects(self, verdict: ScanVerdict) -> bool:
+        return verdict.infected or (verdict.status == ERROR and self.fail_closed)
+
+
+async def quarantine_object(
+    s3_key: str,
+    bucket_type: str,
+    verdict: ScanVerdict,
+    user_id: str,
+    parcel_id: str,
+    filename: str
+) -> Optional[str]:
+    """Move an infected object under the quarantine prefix; returns its new key"""
+    quarantine_key = f"{config.VIRUS_QUARANTINE_PREFIX}{s3_key}"
+    copied, error = await s3_storage.copy_file(s3_key, quarantine_key, bucket_type=bucket_type)
+    if not copied:
+        # Never leave infected content where it can be downloaded
+        logger.error(f"Quarantine copy of {s3_key} failed, deleting it: {error}")
+        quarantine_key = None
+    await s3_storage.delete_file(s3_key, bucket_type=bucket_type)
+    await db[QUARANTINE_COLLECTION].insert_one({
+        "s3_key": s3_key,
+        "quarantine_key": quarantine_key,
+        "s3_bucket": bucket_type,
+        "signature": verdict.signature,
+        "user_id": user_id,
+        "parcel_id": parcel_id,
+        "filename": filename,
+        "detected_at": datetime.utcnow()
+    })
+    logger.warning(f"Infected upload quarantined: {s3_key} ({verdict.signature})")
+    return quarantine_key
+
+
+virus_scanner = VirusScanner(
+    config.VIRUS_SCAN_ENABLED,
+    config.CLAMAV_HOST,
+    config.CLAMAV_PORT,
+    timeout=config.CLAMAV_TIMEOUT,
+    queue_chunks=config.CLAMAV_QUEUE_CHUNKS,
+    fail_closed=config.VIRUS_SCAN_FAIL_CLOSED
+)
@@ -0,0 +1,63 @@
+"""
+ZIP archives streamed while they are built
+The archive is written to a non-seekable sink, so zipfile puts each member's
+CRC and sizes in a data descriptor after its bytes instead of seeking back:
+every chunk read from a member is passed on at once, the first bytes leave
+before the second member is even opened and memory stays at one chunk.
+"""
+import zipfile
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+
+@dataclass
+class ZipMember:
+    name: str
+    modified: datetime
+    chunks: AsyncIterator[bytes]
+    size: Optional[int] = None
+    # Scans are JPEG/TIFF/PDF, already compressed: storing them costs no CPU
+    compress_type: int = zipfile.ZIP_STORED
+
+
+class _Sink:
+    """Write-only buffer; no tell(), so zipfile treats it as a stream"""
+
+    def __init__(self):
+        self._data = bytearray()
+
+    def write(self, data) -> int:
+        self._data.extend(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self._data)
+        self._data.clear()
+        return data
+
+
+async def zip_stream(members: AsyncIterator[ZipMember]) -> AsyncIterator[bytes]:
+    """Bytes of a ZIP archive of `members`, produced as the members are read"""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, mode="w", allowZip64=True) as archive:
+        async for member in members:
+            info = zipfile.ZipInfo(member.name, date_time=member.modified.timetuple()[:6])
+            info.compress_type = member.compress_type
+            if member.size is not None:
+                # Lets zipfile decide on ZIP64 headers before the bytes are known
+                info.file_size = member.size
+            with archive.open(info, mode="w", force_zip64=member.size is None) as target:
+                async for chunk in member.chunks:
+                    target.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    # Central directory, written on close
+    yield sink.drain()
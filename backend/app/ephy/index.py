@@ -249,6 +249,20 @@ class EphyIndex:
                 "SELECT * FROM usages WHERE amm = ? LIMIT ?", (amm, limit)
             ).fetchall()
 
+    def get_usages_for_amms(self, amms: Iterable[str]) -> dict[str, list[sqlite3.Row]]:
+        unique = sorted({amm for amm in amms if amm})
+        if not unique:
+            return {}
+        placeholders = ", ".join("?" for _ in unique)
+        grouped: dict[str, list[sqlite3.Row]] = {amm: [] for amm in unique}
+        with self.connect() as conn:
+            rows = conn.execute(
+                f"SELECT * FROM usages WHERE amm IN ({placeholders})", unique
+            ).fetchall()
+        for row in rows:
+            grouped[row["amm"]].append(row)
+        return grouped
+
     @staticmethod
     def _fts_query(raw: str) -> str:
         tokens = []
@@ -0,0 +1 @@
+"""Scan image derivatives (thumbnails, tile pyramids, vegetation indices)."""
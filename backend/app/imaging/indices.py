@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import math
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+
+NDVI = "ndvi"
+NDRE = "ndre"
+
+# GDAL block cache in MB: windows are read once, a large cache only costs memory
+GDAL_CACHE_MB = 64
+
+
+@dataclass(frozen=True)
+class BandMap:
+    """1-based band indexes of the sensor (MicaSense RedEdge order by default)."""
+
+    red: int = 3
+    nir: int = 4
+    red_edge: Optional[int] = 5
+
+    def pairs(self) -> dict[str, tuple[int, int]]:
+        """(NIR, other band) pair of every normalized difference index."""
+        pairs = {NDVI: (self.nir, self.red)}
+        if self.red_edge:
+            pairs[NDRE] = (self.nir, self.red_edge)
+        return pairs
+
+
+@dataclass
+class IndexStats:
+    valid_pixels: int = 0
+    total: float = 0.0
+    minimum: float = math.inf
+    maximum: float = -math.inf
+
+    def update(self, values: np.ndarray) -> None:
+        if not values.size:
+            return
+        self.valid_pixels += int(values.size)
+        self.total += float(values.sum(dtype=np.float64))
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+
+    def as_dict(self) -> dict:
+        if not self.valid_pixels:
+            return {"valid_pixels": 0, "min": None, "max": None, "mean": None}
+        return {
+            "valid_pixels": self.valid_pixels,
+            "min": round(self.minimum, 4),
+            "max": round(self.maximum, 4),
+            "mean": round(self.total / self.valid_pixels, 4),
+        }
+
+
+@dataclass
+class IndexResult:
+    width: int
+    height: int
+    band_count: int
+    crs: Optional[str]
+    outputs: dict[str, str] = field(default_factory=dict)
+    stats: dict[str, dict] = field(default_factory=dict)
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def available_indices(band_count: int, bands: BandMap) -> dict[str, tuple[int, int]]:
+    return {name: pair for name, pair in bands.pairs().items() if max(pair) <= band_count}
+
+
+def iter_windows(width: int, height: int, block_size: int) -> Iterator[Window]:
+    for row in range(0, height, block_size):
+        for col in range(0, width, block_size):
+            yield Window(col, row, min(block_size, width - col), min(block_size, height - row))
+
+
+def normalized_difference(
+    a: np.ndarray,
+    b: np.ndarray,
+    nodata: Optional[float] = None,
+) -> np.ndarray:
+    """(a - b) / (a + b) in float32, NaN where a band is nodata or both are zero."""
+    a = a.astype(np.float32, copy=False)
+    b = b.astype(np.float32, copy=False)
+    denominator = a + b
+    valid = denominator != 0
+    if nodata is not None and not math.isnan(nodata):
+        valid &= (a != nodata) & (b != nodata)
+    else:
+        valid &= ~(np.isnan(a) | np.isnan(b))
+    out = np.full(a.shape, np.nan, dtype=np.float32)
+    np.divide(a - b, denominator, out=out, where=valid)
+    return out
+
+
+def _overview_factors(width: int, height: int, tile_size: int) -> list[int]:
+    factors = []
+    factor = 2
+    while max(width, height) / factor >= tile_size:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+def compute_indices(
+    source: str | Path,
+    output_dir: str | Path,
+    bands: BandMap = BandMap(),
+    block_size: int = 1024,
+    tile_size: int = 256,
+) -> IndexResult:
+    """Write one tiled float32 GeoTIFF per vegetation index of a multispectral raster.
+
+    The raster is processed window by window: only the bands an index needs
+    are read, and memory stays bounded by a few `block_size`² float32 arrays
+    whatever the raster size. Windows are aligned on the output tiles so each
+    write fills whole tiles.
+    """
+    output_dir = Path(output_dir)
+    block_size = max(tile_size, block_size - block_size % tile_size)
+
+    with rasterio.Env(GDAL_CACHEMAX=GDAL_CACHE_MB), rasterio.open(source) as src:
+        result = IndexResult(
+            width=src.width,
+            height=src.height,
+            band_count=src.count,
+            crs=src.crs.to_string() if src.crs else None,
+        )
+        pairs = available_indices(src.count, bands)
+        if not pairs:
+            return result
+
+        profile = {
+            "driver": "GTiff",
+            "width": src.width,
+            "height": src.height,
+            "count": 1,
+            "dtype": "float32",
+            "crs": src.crs,
+            "transform": src.transform,
+            "nodata": float("nan"),
+            "tiled": True,
+            "blockxsize": tile_size,
+            "blockysize": tile_size,
+            "compress": "deflate",
+            "predictor": 3,
+            "BIGTIFF": "IF_SAFER",
+        }
+        needed = sorted({band for pair in pairs.values() for band in pair})
+        position = {band: i for i, band in enumerate(needed)}
+        stats = {name: IndexStats() for name in pairs}
+        paths = {name: output_dir / f"{name}.tif" for name in pairs}
+        destinations = {name: rasterio.open(paths[name], "w", **profile) for name in pairs}
+        try:
+            for window in iter_windows(src.width, src.height, block_size):
+                block = src.read(needed, window=window, out_dtype="float32")
+                for name, (first, second) in pairs.items():
+                    values = normalized_difference(
+                        block[position[first]], block[position[second]], src.nodata
+                    )
+                    stats[name].update(values[~np.isnan(values)])
+                    destinations[name].write(values, 1, window=window)
+                del block
+
+            factors = _overview_factors(src.width, src.height, tile_size)
+            for dst in destinations.values():
+                if factors:
+                    dst.build_overviews(factors, Resampling.average)
+        finally:
+            for dst in destinations.values():
+                dst.close()
+
+    result.outputs = {name: str(path) for name, path in paths.items()}
+    result.stats = {name: item.as_dict() for name, item in stats.items()}
+    return result
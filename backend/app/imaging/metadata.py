@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import struct
+import warnings
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Any, Optional
+
+import rasterio
+from PIL import Image, UnidentifiedImageError
+from rasterio.errors import NotGeoreferencedWarning, RasterioIOError
+from rasterio.warp import transform_geom
+
+from app.imaging.indices import GDAL_CACHE_MB
+
+# EXIF tags and IFDs (TIFF 6.0 / EXIF 2.3)
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_DATETIME = 0x0132
+IFD_EXIF = 0x8769
+IFD_GPS = 0x8825
+TAG_DATETIME_ORIGINAL = 0x9003
+GPS_LAT_REF, GPS_LAT, GPS_LON_REF, GPS_LON, GPS_ALT_REF, GPS_ALT = 1, 2, 3, 4, 5, 6
+
+# Byte size of each TIFF field type, for values stored out of line
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+JPEG_SOS = 0xDA
+
+EXIF_DATE_FORMAT = "%Y:%m:%d %H:%M:%S"
+COORDINATE_DIGITS = 7
+
+
+@dataclass
+class ScanMetadata:
+    captured_at: Optional[datetime] = None
+    make: Optional[str] = None
+    model: Optional[str] = None
+    sensor: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    band_count: Optional[int] = None
+    crs: Optional[str] = None
+    # GeoJSON in EPSG:4326, ready for 2dsphere indexes
+    location: Optional[dict] = None
+    altitude_m: Optional[float] = None
+    footprint: Optional[dict] = None
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def _text(value: Any) -> Optional[str]:
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "replace")
+    if value is None:
+        return None
+    value = str(value).replace("\x00", "").strip()
+    return value or None
+
+
+def parse_exif_datetime(value: Any) -> Optional[datetime]:
+    text = _text(value)
+    if not text:
+        return None
+    try:
+        return datetime.strptime(text[:19], EXIF_DATE_FORMAT)
+    except ValueError:
+        return None
+
+
+def _degrees(value: Any, ref: Any) -> Optional[float]:
+    try:
+        degrees, minutes, seconds = (float(part) for part in value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    result = degrees + minutes / 60 + seconds / 3600
+    return -result if _text(ref) in ("S", "W") else result
+
+
+def gps_point(gps: dict) -> tuple[Optional[dict], Optional[float]]:
+    """GeoJSON point and altitude of an EXIF GPS IFD."""
+    latitude = _degrees(gps.get(GPS_LAT), gps.get(GPS_LAT_REF))
+    longitude = _degrees(gps.get(GPS_LON), gps.get(GPS_LON_REF))
+    point = None
+    if latitude is not None and longitude is not None and -90 <= latitude <= 90 and -180 <= longitude <= 180:
+        point = {"type": "Point", "coordinates": [round(longitude, COORDINATE_DIGITS), round(latitude, COORDINATE_DIGITS)]}
+    altitude = None
+    if gps.get(GPS_ALT) is not None:
+        try:
+            altitude = round(float(gps[GPS_ALT]), 2)
+            if gps.get(GPS_ALT_REF) in (1, b"\x01"):
+                altitude = -altitude
+        except (TypeError, ValueError, ZeroDivisionError):
+            altitude = None
+    return point, altitude
+
+
+def _jpeg_header_range(data: bytes, window: int) -> Optional[tuple[int, int]]:
+    # Segments up to the start of scan: APP1 (EXIF), APPn and the frame header
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        if data[pos + 1] == 0xFF:
+            pos += 1
+            continue
+        end = pos + 2 + struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        if data[pos + 1] == JPEG_SOS:
+            return None if end <= len(data) else (len(data), end)
+        pos = end
+    return (len(data), pos + window)
+
+
+def _tiff_header_range(data: bytes, window: int) -> Optional[tuple[int, int]]:
+    order = "<" if data[:2] == b"II" else ">"
+    if len(data) < 8 or struct.unpack(order + "H", data[2:4])[0] != 42:
+        # BigTIFF is not walked: GDAL reads whatever the leading bytes hold
+        return None
+    missing = []
+    pending, seen = [struct.unpack(order + "I", data[4:8])[0]], set()
+    while pending:
+        offset = pending.pop()
+        if offset in seen:
+            continue
+        seen.add(offset)
+        if offset + 2 > len(data):
+            # Entry count unknown: the IFD and the values written around it
+            missing.append((offset, offset + window))
+            continue
+        count = struct.unpack(order + "H", data[offset:offset + 2])[0]
+        if offset + 2 + 12 * count > len(data):
+            missing.append((offset, offset + 2 + 12 * count))
+            continue
+        for i in range(count):
+            entry = offset + 2 + 12 * i
+            tag, kind, n, value = struct.unpack(order + "HHII", data[entry:entry + 12])
+            size = TIFF_TYPE_SIZES.get(kind, 1) * n
+            if tag in (IFD_EXIF, IFD_GPS):
+                pending.append(value)
+            elif size > 4 and value + size > len(data):
+                missing.append((value, value + size))
+    if not missing:
+        return None
+    start = max(len(data), min(begin for begin, _ in missing))
+    return start, min(max(end for _, end in missing), start + window)
+
+
+def header_range(data: bytes, window: int) -> Optional[tuple[int, int]]:
+    """Byte range [start, end) past `data`, the leading bytes of a file, its headers still need.
+
+    None when `data` holds them (or the format is not walked). The range is
+    at most `window` bytes long, so callers grow their read once.
+    """
+    if data[:2] == b"\xff\xd8":
+        return _jpeg_header_range(data, window)
+    if data[:2] in (b"II", b"MM"):
+        return _tiff_header_range(data, window)
+    return None
+
+
+def _read_exif(path: str, metadata: ScanMetadata) -> None:
+    try:
+        with Image.open(path) as image:
+            metadata.width, metadata.height = image.size
+            metadata.band_count = len(image.getbands())
+            exif = image.getexif()
+    except (UnidentifiedImageError, OSError, ValueError):
+        # Multispectral TIFFs Pillow cannot decode: rasterio covers them
+        return
+    metadata.make = _text(exif.get(TAG_MAKE))
+    metadata.model = _text(exif.get(TAG_MODEL))
+    metadata.captured_at = (
+        parse_exif_datetime(exif.get_ifd(IFD_EXIF).get(TAG_DATETIME_ORIGINAL))
+        or parse_exif_datetime(exif.get(TAG_DATETIME))
+    )
+    metadata.location, metadata.altitude_m = gps_point(exif.get_ifd(IFD_GPS))
+
+
+def _read_raster(path: str, metadata: ScanMetadata) -> None:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        try:
+            with rasterio.Env(GDAL_CACHEMAX=GDAL_CACHE_MB), rasterio.open(path) as src:
+                metadata.width, metadata.height = src.width, src.height
+                metadata.band_count = src.count
+                tags = src.tags()
+                metadata.captured_at = metadata.captured_at or parse_exif_datetime(tags.get("TIFFTAG_DATETIME"))
+                if src.crs is None:
+                    return
+                metadata.crs = src.crs.to_string()
+                left, bottom, right, top = src.bounds
+                ring = [[left, bottom], [right, bottom], [right, top], [left, top], [left, bottom]]
+                footprint = transform_geom(src.crs, "EPSG:4326", {"type": "Polygon", "coordinates": [ring]})
+        except RasterioIOError:
+            return
+    metadata.footprint = {
+        "type": "Polygon",
+        "coordinates": [
+            [[round(x, COORDINATE_DIGITS), round(y, COORDINATE_DIGITS)] for x, y in part]
+            for part in footprint["coordinates"]
+        ],
+    }
+    if metadata.location is None:
+        # Georeferenced rasters seldom carry GPS tags: their centre stands for the position
+        xs = [x for x, _ in metadata.footprint["coordinates"][0][:-1]]
+        ys = [y for _, y in metadata.footprint["coordinates"][0][:-1]]
+        metadata.location = {
+            "type": "Point",
+            "coordinates": [round(sum(xs) / len(xs), COORDINATE_DIGITS), round(sum(ys) / len(ys), COORDINATE_DIGITS)],
+        }
+
+
+def extract_metadata(path: str, content_type: str) -> ScanMetadata:
+    """Capture time, position, sensor and raster geometry of a scan file.
+
+    Only headers are read (EXIF through Pillow, georeferencing through GDAL),
+    never the pixels, so this stays fast on large orthomosaics.
+    """
+    metadata = ScanMetadata()
+    _read_exif(path, metadata)
+    if content_type == "image/tiff":
+        _read_raster(path, metadata)
+    metadata.sensor = " ".join(part for part in (metadata.make, metadata.model) if part) or None
+    return metadata
@@ -0,0 +1,397 @@
+"""
+Post-upload pipeline extracting scan metadata, rendering previews and vegetation indices
+
+The original is fetched from S3 to a temporary file, processed in a process
+pool (Pillow and the index computation are CPU bound) and the derivatives are
+written to disk and uploaded next to it under `{s3_key}.derived/`.
+"""
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from shapely.geometry import mapping
+
+from app.core import config
+from app.core.database import db
+from app.core.logger import logger
+from app.core.s3_storage import s3_storage
+from app.imaging.indices import BandMap, compute_indices
+from app.imaging.metadata import extract_metadata, header_range
+from app.imaging.pyramid import THUMBNAIL_NAME, render_derivatives, tile_key
+from app.imaging.vigour import MAX_POINTS, summarize, vigour_point
+from app.imaging.zonal import zonal_stats
+from app.treatments.znt import parcel_geometry, parcel_version
+
+IMAGE_CONTENT_TYPES = {"image/jpeg", "image/png", "image/tiff"}
+RASTER_CONTENT_TYPES = {"image/tiff"}
+DERIVED_CACHE_CONTROL = "private, max-age=31536000, immutable"
+UPLOAD_CONCURRENCY = 8
+ZONAL_COLLECTION = "scan_zonal_stats"
+SERIES_COLLECTION = "vigour_series"
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: the API process runs threads (S3 pool, Motor) that must not be forked
+        _pool = ProcessPoolExecutor(
+            max_workers=config.IMAGING_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def derived_prefix(s3_key: str) -> str:
+    return f"{s3_key}.derived/"
+
+
+def thumbnail_s3_key(scan: dict) -> str:
+    return derived_prefix(scan["s3_key"]) + THUMBNAIL_NAME
+
+
+def tile_s3_key(scan: dict, z: int, x: int, y: int) -> str:
+    return derived_prefix(scan["s3_key"]) + tile_key(z, x, y)
+
+
+def index_s3_key(scan: dict, index: str) -> str:
+    return derived_prefix(scan["s3_key"]) + f"{index}.tif"
+
+
+def band_map() -> BandMap:
+    return BandMap(
+        red=config.IMAGING_BAND_RED,
+        nir=config.IMAGING_BAND_NIR,
+        red_edge=config.IMAGING_BAND_RED_EDGE or None,
+    )
+
+
+async def _set_status(scan_oid: ObjectId, field: str, value: dict) -> None:
+    value["updated_at"] = datetime.utcnow()
+    await db["scans"].update_one({"_id": scan_oid}, {"$set": {field: value}})
+
+
+async def generate_scan_derivatives(scan_id: str) -> None:
+    """Render and store the thumbnail and tile pyramid of one scan (BackgroundTasks entry point)."""
+    scan_oid = ObjectId(scan_id)
+    scan = await db["scans"].find_one({"_id": scan_oid}, {"s3_key": 1, "s3_bucket": 1, "content_type": 1})
+    if not scan or not scan.get("s3_key"):
+        return
+    if scan.get("content_type") not in IMAGE_CONTENT_TYPES:
+        await _set_status(scan_oid, "derivatives", {"status": "skipped"})
+        return
+
+    bucket_type = scan.get("s3_bucket", "main")
+    await _set_status(scan_oid, "derivatives", {"status": "pending"})
+    try:
+        with tempfile.TemporaryDirectory(prefix="scan-derivatives-", dir=config.IMAGING_TMP_DIR) as workdir:
+            source = os.path.join(workdir, "source")
+            success, error = await s3_storage.download_to_path(scan["s3_key"], source, bucket_type=bucket_type)
+            if not success:
+                raise RuntimeError(error)
+
+            output_dir = os.path.join(workdir, "derived")
+            loop = asyncio.get_running_loop()
+            info, outputs = await loop.run_in_executor(
+                _get_pool(),
+                render_derivatives,
+                source,
+                output_dir,
+                config.IMAGING_TILE_SIZE,
+                config.IMAGING_THUMBNAIL_SIZE
+            )
+
+            prefix = derived_prefix(scan["s3_key"])
+            semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+            async def store(name: str):
+                async with semaphore:
+                    ok, store_error = await s3_storage.upload_path(
+                        prefix + name, os.path.join(output_dir, name), "image/jpeg",
+                        cache_control=DERIVED_CACHE_CONTROL,
+                        bucket_type=bucket_type
+                    )
+                    if not ok:
+                        raise RuntimeError(store_error)
+
+            await asyncio.gather(*(store(name) for name in outputs))
+
+        await _set_status(scan_oid, "derivatives", {"status": "ready", "prefix": prefix, "tiles": len(outputs) - 1, **info})
+        logger.info(f"Scan {scan_id} derivatives ready: {len(outputs) - 1} tiles, zoom 0-{info['max_zoom']}")
+    except Exception as e:
+        logger.error(f"Derivative generation failed for scan {scan_id}: {e}")
+        await _set_status(scan_oid, "derivatives", {"status": "failed", "error": str(e)[:500]})
+
+
+async def _fetch_headers(scan: dict, path: str) -> None:
+    """Sparse local copy of a scan holding only its header bytes.
+
+    The leading IMAGING_HEADER_BYTES are read, plus one more range when a JPEG
+    segment or a TIFF IFD points past them. The file keeps the object's size
+    so offsets stay valid; the pixels are never fetched.
+    """
+    bucket_type = scan.get("s3_bucket", "main")
+    size = scan.get("file_size")
+    if size is None:
+        success, head, error = await s3_storage.head_file(scan["s3_key"], bucket_type=bucket_type)
+        if not success:
+            raise RuntimeError(error)
+        size = head["size"]
+    if not size:
+        raise RuntimeError("Empty object")
+
+    window = config.IMAGING_HEADER_BYTES
+    success, data, error = await s3_storage.read_range(scan["s3_key"], 0, min(size, window) - 1, bucket_type=bucket_type)
+    if not success:
+        raise RuntimeError(error)
+    ranges = [(0, data)]
+    missing = header_range(data, window)
+    if missing and missing[0] < size:
+        start, end = missing[0], min(missing[1], size)
+        success, extra, error = await s3_storage.read_range(scan["s3_key"], start, end - 1, bucket_type=bucket_type)
+        if not success:
+            raise RuntimeError(error)
+        ranges.append((start, extra))
+
+    with open(path, "wb") as sparse:
+        sparse.truncate(size)
+        for offset, chunk in ranges:
+            sparse.seek(offset)
+            sparse.write(chunk)
+
+
+async def extract_scan_metadata(scan_id: str) -> None:
+    """Read capture time, GPS, sensor and raster footprint of one scan (BackgroundTasks entry point).
+
+    Searchable fields are stored at the top level of the scan document where
+    the search indexes (capture date, sensor, 2dsphere location and footprint)
+    cover them; the rest goes under `metadata`.
+    """
+    scan_oid = ObjectId(scan_id)
+    scan = await db["scans"].find_one(
+        {"_id": scan_oid}, {"s3_key": 1, "s3_bucket": 1, "content_type": 1, "file_size": 1}
+    )
+    if not scan or not scan.get("s3_key"):
+        return
+    if scan.get("content_type") not in IMAGE_CONTENT_TYPES:
+        await _set_status(scan_oid, "metadata", {"status": "skipped"})
+        return
+
+    try:
+        with tempfile.TemporaryDirectory(prefix="scan-metadata-", dir=config.IMAGING_TMP_DIR) as workdir:
+            source = os.path.join(workdir, "source")
+            await _fetch_headers(scan, source)
+            loop = asyncio.get_running_loop()
+            metadata = await loop.run_in_executor(_get_pool(), extract_metadata, source, scan["content_type"])
+
+        fields = metadata.as_dict()
+        indexed = {key: fields.pop(key) for key in ("captured_at", "sensor", "location", "footprint")}
+        # Absent rather than null: 2dsphere indexes reject null geometries
+        update = {
+            "$set": {
+                **{key: value for key, value in indexed.items() if value is not None},
+                "metadata": {"status": "ready", **fields, "updated_at": datetime.utcnow()},
+            }
+        }
+        unset = {key: "" for key, value in indexed.items() if value is None}
+        if unset:
+            update["$unset"] = unset
+        await db["scans"].update_one({"_id": scan_oid}, update)
+        logger.info(f"Scan {scan_id} metadata extracted: captured {indexed['captured_at']}, sensor {indexed['sensor']}")
+    except Exception as e:
+        logger.error(f"Metadata extraction failed for scan {scan_id}: {e}")
+        await _set_status(scan_oid, "metadata", {"status": "failed", "error": str(e)[:500]})
+
+
+async def _scan_parcel(scan: dict) -> Optional[dict]:
+    if not ObjectId.is_valid(scan.get("parcel_id") or ""):
+        return None
+    parcel = await db["parcels"].find_one(
+        {"_id": ObjectId(scan["parcel_id"]), "user_id": scan.get("user_id")},
+        {"coordinates": 1, "establishment_id": 1}
+    )
+    return parcel if parcel and parcel.get("coordinates") else None
+
+
+async def _store_zonal_stats(scan: dict, parcel: dict, index: str, stats: dict) -> dict:
+    key = {
+        "scan_id": str(scan["_id"]),
+        "index": index,
+        "parcel_version": parcel_version(parcel["coordinates"]),
+    }
+    doc = {
+        **key,
+        "parcel_id": str(parcel["_id"]),
+        "user_id": scan.get("user_id"),
+        "uploaded_at": scan.get("uploaded_at"),
+        "computed_at": datetime.utcnow(),
+        **stats,
+    }
+    await db[ZONAL_COLLECTION].replace_one(key, doc, upsert=True)
+    if doc.get("mean") is not None:
+        await _record_vigour_point(scan, parcel, index, doc)
+    return doc
+
+
+async def _record_vigour_point(scan: dict, parcel: dict, index: str, stats: dict) -> None:
+    """Fold one scan's summary into its parcel's season series (replacing any earlier point of the scan)."""
+    taken_at = scan.get("captured_at") or scan.get("uploaded_at") or datetime.utcnow()
+    key = {"parcel_id": str(parcel["_id"]), "season": taken_at.year, "index": index}
+    series = db[SERIES_COLLECTION]
+    await series.update_one(key, {"$pull": {"points": {"scan_id": stats["scan_id"]}}})
+    updated = await series.find_one_and_update(
+        key,
+        {
+            "$push": {"points": {"$each": [vigour_point(stats, taken_at)], "$sort": {"date": 1}, "$slice": -MAX_POINTS}},
+            "$set": {
+                "establishment_id": parcel.get("establishment_id"),
+                "user_id": scan.get("user_id"),
+                "updated_at": datetime.utcnow(),
+            },
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    # Summary fields are stored so drop rankings are a plain indexed sort
+    await series.update_one({"_id": updated["_id"]}, {"$set": summarize(updated["points"])})
+
+
+async def _zonal_stats_for(scan: dict, parcel: dict, index: str, raster_path: str) -> dict:
+    loop = asyncio.get_running_loop()
+    stats = await loop.run_in_executor(
+        _get_pool(),
+        zonal_stats,
+        raster_path,
+        mapping(parcel_geometry(parcel["coordinates"])),
+        index,
+        config.IMAGING_BLOCK_SIZE
+    )
+    return await _store_zonal_stats(scan, parcel, index, stats.as_dict())
+
+
+async def compute_scan_zonal_stats(scan: dict, parcel: dict, index: str) -> dict:
+    """Zonal statistics of one index raster over the current parcel polygon, cached in scan_zonal_stats."""
+    with tempfile.TemporaryDirectory(prefix="scan-zonal-", dir=config.IMAGING_TMP_DIR) as workdir:
+        raster_path = os.path.join(workdir, f"{index}.tif")
+        success, error = await s3_storage.download_to_path(
+            index_s3_key(scan, index), raster_path, bucket_type=scan.get("s3_bucket", "main")
+        )
+        if not success:
+            raise RuntimeError(error)
+        return await _zonal_stats_for(scan, parcel, index, raster_path)
+
+
+async def generate_scan_indices(scan_id: str) -> None:
+    """Compute the NDVI/NDRE rasters of a multispectral GeoTIFF scan (BackgroundTasks entry point).
+
+    The original goes to a temporary file, never into memory: the worker reads
+    it window by window and writes tiled GeoTIFFs uploaded part by part.
+    """
+    scan_oid = ObjectId(scan_id)
+    scan = await db["scans"].find_one(
+        {"_id": scan_oid},
+        {"s3_key": 1, "s3_bucket": 1, "content_type": 1, "parcel_id": 1, "user_id": 1, "uploaded_at": 1, "captured_at": 1}
+    )
+    if not scan or not scan.get("s3_key") or scan.get("content_type") not in RASTER_CONTENT_TYPES:
+        return
+
+    bucket_type = scan.get("s3_bucket", "main")
+    bands = band_map()
+    await _set_status(scan_oid, "indices", {"status": "pending"})
+    try:
+        with tempfile.TemporaryDirectory(prefix="scan-indices-", dir=config.IMAGING_TMP_DIR) as workdir:
+            source = os.path.join(workdir, "source.tif")
+            success, error = await s3_storage.download_to_path(scan["s3_key"], source, bucket_type=bucket_type)
+            if not success:
+                raise RuntimeError(error)
+
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                _get_pool(),
+                compute_indices,
+                source,
+                workdir,
+                bands,
+                config.IMAGING_BLOCK_SIZE,
+                config.IMAGING_TILE_SIZE
+            )
+            summary = {
+                "width": result.width,
+                "height": result.height,
+                "band_count": result.band_count,
+                "crs": result.crs,
+                "bands": {"red": bands.red, "nir": bands.nir, "red_edge": bands.red_edge},
+            }
+            if not result.outputs:
+                # RGB or single-band TIFF: nothing to compute
+                await _set_status(scan_oid, "indices", {"status": "skipped", **summary})
+                return
+
+            layers = {}
+            for name, path in result.outputs.items():
+                s3_key = index_s3_key(scan, name)
+                success, error = await s3_storage.upload_path(
+                    s3_key, path, "image/tiff",
+                    cache_control=DERIVED_CACHE_CONTROL,
+                    bucket_type=bucket_type
+                )
+                if not success:
+                    raise RuntimeError(error)
+                layers[name] = {"s3_key": s3_key, **result.stats[name]}
+
+            # Parcel statistics while the rasters are still on local disk
+            parcel = await _scan_parcel(scan)
+            if parcel:
+                for name, path in result.outputs.items():
+                    try:
+                        await _zonal_stats_for(scan, parcel, name, path)
+                    except Exception as e:
+                        logger.warning(f"Zonal statistics failed for scan {scan_id} ({name}): {e}")
+
+        await _set_status(scan_oid, "indices", {"status": "ready", **summary, "layers": layers})
+        logger.info(f"Scan {scan_id} vegetation indices ready: {', '.join(layers)}")
+    except Exception as e:
+        logger.error(f"Vegetation index computation failed for scan {scan_id}: {e}")
+        await _set_status(scan_oid, "indices", {"status": "failed", "error": str(e)[:500]})
+
+
+async def refresh_scan_zonal_stats(scan_id: str) -> None:
+    """Zonal statistics of a scan that reuses the index rasters of identical content (BackgroundTasks entry point)."""
+    scan = await db["scans"].find_one({"_id": ObjectId(scan_id)})
+    if not scan or (scan.get("indices") or {}).get("status") != "ready":
+        return
+    parcel = await _scan_parcel(scan)
+    if not parcel:
+        return
+    for index in scan["indices"].get("layers") or {}:
+        try:
+            await compute_scan_zonal_stats(scan, parcel, index)
+        except Exception as e:
+            logger.warning(f"Zonal statistics failed for scan {scan_id} ({index}): {e}")
+
+
+async def forget_scan(scan_id: str) -> None:
+    """Drop the statistics of a deleted scan and its points from the vigour series."""
+    await db[ZONAL_COLLECTION].delete_many({"scan_id": scan_id})
+    async for series in db[SERIES_COLLECTION].find({"points.scan_id": scan_id}):
+        points = [point for point in series["points"] if point["scan_id"] != scan_id]
+        await db[SERIES_COLLECTION].update_one(
+            {"_id": series["_id"]},
+            {"$set": {"points": points, **summarize(points), "updated_at": datetime.utcnow()}}
+        )
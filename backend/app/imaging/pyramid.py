@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import math
+import os
+from dataclasses import asdict, dataclass
+
+from PIL import Image, ImageOps
+
+THUMBNAIL_NAME = "thumbnail.jpg"
+TILE_FORMAT = "jpg"
+JPEG_QUALITY = 80
+
+
+@dataclass(frozen=True)
+class PyramidInfo:
+    width: int
+    height: int
+    tile_size: int
+    max_zoom: int
+    format: str = TILE_FORMAT
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def tile_key(z: int, x: int, y: int) -> str:
+    return f"tiles/{z}/{x}/{y}.{TILE_FORMAT}"
+
+
+def max_zoom_for(width: int, height: int, tile_size: int) -> int:
+    """Level 0 fits in one tile; the deepest level is the full resolution."""
+    return max(0, math.ceil(math.log2(max(width, height) / tile_size)))
+
+
+def _to_rgb(image: Image.Image) -> Image.Image:
+    # Drone TIFFs are often 16-bit or float single-band: stretch to 8 bits for display
+    if image.mode in ("I;16", "I;16B", "I;16L", "I", "F"):
+        image = image.convert("F")
+        low, high = image.getextrema()
+        scale = 255.0 / (high - low) if high > low else 1.0
+        image = image.point(lambda v: (v - low) * scale).convert("L")
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def _save(image: Image.Image, output_dir: str, name: str) -> None:
+    path = os.path.join(output_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    image.save(path, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+
+
+def render_derivatives(
+    source_path: str,
+    output_dir: str,
+    tile_size: int = 256,
+    thumbnail_size: int = 320
+) -> tuple[dict, list[str]]:
+    """Thumbnail and tile pyramid of an image file, as (pyramid info, [relative key]).
+
+    CPU bound and self-contained so it can run in a process pool: only paths
+    cross the process boundary, the JPEGs are written under `output_dir`.
+    """
+    with Image.open(source_path) as opened:
+        image = _to_rgb(ImageOps.exif_transpose(opened))
+
+    width, height = image.size
+    max_zoom = max_zoom_for(width, height, tile_size)
+    outputs: list[str] = []
+
+    thumbnail = image.copy()
+    thumbnail.thumbnail((thumbnail_size, thumbnail_size), Image.Resampling.LANCZOS)
+    _save(thumbnail, output_dir, THUMBNAIL_NAME)
+    outputs.append(THUMBNAIL_NAME)
+
+    # Deepest level first, each level halves the previous one
+    level = image
+    for z in range(max_zoom, -1, -1):
+        level_width, level_height = level.size
+        for x in range(math.ceil(level_width / tile_size)):
+            for y in range(math.ceil(level_height / tile_size)):
+                box = (
+                    x * tile_size,
+                    y * tile_size,
+                    min((x + 1) * tile_size, level_width),
+                    min((y + 1) * tile_size, level_height),
+                )
+                name = tile_key(z, x, y)
+                _save(level.crop(box), output_dir, name)
+                outputs.append(name)
+        if z:
+            level = level.resize(
+                (max(1, math.ceil(level_width / 2)), max(1, math.ceil(level_height / 2))),
+                Image.Resampling.BILINEAR,
+            )
+
+    info = PyramidInfo(width=width, height=height, tile_size=tile_size, max_zoom=max_zoom)
+    return info.as_dict(), outputs
@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, Mapping, Optional
+
+# A season holds one point per scan; the cap only guards against runaway imports
+MAX_POINTS = 366
+LOW_VIGOUR_CLASSES = ("tres_faible", "faible")
+
+
+def vigour_point(stats: Mapping[str, Any], taken_at: datetime) -> dict:
+    """Compact time-series point of one scan's zonal statistics."""
+    percentiles = stats.get("percentiles") or {}
+    classes = stats.get("vigour_classes") or []
+    return {
+        "scan_id": stats["scan_id"],
+        "date": taken_at,
+        "mean": stats.get("mean"),
+        "median": stats.get("median"),
+        "p10": percentiles.get("p10"),
+        "p90": percentiles.get("p90"),
+        "pixel_count": stats.get("pixel_count", 0),
+        "low_vigour_fraction": round(
+            sum(item["fraction"] for item in classes if item["label"] in LOW_VIGOUR_CLASSES), 4
+        ),
+    }
+
+
+def summarize(points: list[Mapping[str, Any]]) -> dict[str, Optional[Any]]:
+    """Last two points of a date-sorted series and the change of mean between them."""
+    last = points[-1] if points else None
+    previous = points[-2] if len(points) > 1 else None
+    delta = None
+    if last and previous and last.get("mean") is not None and previous.get("mean") is not None:
+        delta = round(last["mean"] - previous["mean"], 4)
+    return {"last": last, "previous": previous, "delta": delta}
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import math
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+import numpy as np
+import rasterio
+from rasterio.errors import WindowError
+from rasterio.features import geometry_mask, geometry_window
+from rasterio.warp import transform_geom
+from rasterio.windows import Window
+
+from app.imaging.indices import GDAL_CACHE_MB, NDRE, NDVI
+
+# Normalized difference indices live in [-1, 1]: fixed bins make histograms of
+# successive windows (and successive scans) directly addressable and summable
+VALUE_RANGE = (-1.0, 1.0)
+FINE_BINS = 400
+HISTOGRAM_BINS = 40
+PERCENTILES = (10, 25, 50, 75, 90)
+
+VIGOUR_LABELS = ("tres_faible", "faible", "moyenne", "forte", "tres_forte")
+VIGOUR_THRESHOLDS = {
+    NDVI: (0.2, 0.4, 0.6, 0.8),
+    NDRE: (0.1, 0.2, 0.3, 0.4),
+}
+
+EARTH_RADIUS_M = 6_371_008.8
+
+
+@dataclass
+class ZonalStats:
+    pixel_count: int = 0
+    pixel_area_m2: float = 0.0
+    area_ha: float = 0.0
+    mean: Optional[float] = None
+    std: Optional[float] = None
+    min: Optional[float] = None
+    max: Optional[float] = None
+    median: Optional[float] = None
+    percentiles: dict[str, float] = field(default_factory=dict)
+    histogram: list[dict] = field(default_factory=list)
+    vigour_classes: list[dict] = field(default_factory=list)
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def _sub_windows(window: Window, block_size: int) -> Iterator[Window]:
+    col_off, row_off = int(window.col_off), int(window.row_off)
+    width, height = int(window.width), int(window.height)
+    for row in range(0, height, block_size):
+        for col in range(0, width, block_size):
+            yield Window(
+                col_off + col,
+                row_off + row,
+                min(block_size, width - col),
+                min(block_size, height - row),
+            )
+
+
+def _pixel_area_m2(src, latitude: float) -> float:
+    transform = src.transform
+    area = abs(transform.a * transform.e - transform.b * transform.d)
+    if src.crs and src.crs.is_geographic:
+        meters_per_degree = math.pi * EARTH_RADIUS_M / 180
+        area *= meters_per_degree ** 2 * math.cos(math.radians(latitude))
+    return area
+
+
+def histogram_percentile(counts: np.ndarray, edges: np.ndarray, q: float) -> float:
+    """Percentile read off a histogram, interpolated linearly inside the bin."""
+    total = counts.sum()
+    target = q / 100 * total
+    cumulative = np.cumsum(counts)
+    index = int(np.searchsorted(cumulative, target, side="left"))
+    index = min(index, len(counts) - 1)
+    before = cumulative[index - 1] if index else 0
+    inside = counts[index]
+    fraction = (target - before) / inside if inside else 0.0
+    return float(edges[index] + fraction * (edges[index + 1] - edges[index]))
+
+
+def _vigour_classes(counts: np.ndarray, thresholds: tuple, pixel_area_m2: float) -> list[dict]:
+    total = counts.sum()
+    bounds = (VALUE_RANGE[0], *thresholds, VALUE_RANGE[1])
+    # Thresholds fall on fine bin edges, so class counts are exact
+    width = (VALUE_RANGE[1] - VALUE_RANGE[0]) / len(counts)
+    positions = [int(round((bound - VALUE_RANGE[0]) / width)) for bound in bounds]
+    classes = []
+    for label, lower, upper, start, end in zip(VIGOUR_LABELS, bounds, bounds[1:], positions, positions[1:]):
+        pixels = int(counts[start:end].sum())
+        classes.append({
+            "label": label,
+            "lower": lower,
+            "upper": upper,
+            "pixels": pixels,
+            "fraction": round(pixels / total, 4) if total else 0.0,
+            "area_ha": round(pixels * pixel_area_m2 / 10_000, 4),
+        })
+    return classes
+
+
+def zonal_stats(
+    raster: str | Path,
+    geometry: dict[str, Any],
+    index: str = NDVI,
+    block_size: int = 1024,
+    geometry_crs: str = "EPSG:4326",
+) -> ZonalStats:
+    """Statistics of the index pixels whose centre lies inside the parcel.
+
+    Only the parcel's bounding window is read, in blocks: each block is masked
+    with the rasterised polygon and folded into a fixed-bin histogram plus
+    running sums, so percentiles and classes never need the pixels themselves.
+    """
+    edges = np.linspace(*VALUE_RANGE, FINE_BINS + 1)
+    counts = np.zeros(FINE_BINS, dtype=np.int64)
+    total = 0.0
+    total_sq = 0.0
+    minimum, maximum = math.inf, -math.inf
+
+    with rasterio.Env(GDAL_CACHEMAX=GDAL_CACHE_MB), rasterio.open(raster) as src:
+        if src.crs is None:
+            raise ValueError("Raster has no CRS: cannot place the parcel on it")
+        shape = transform_geom(geometry_crs, src.crs, geometry)
+        ring = geometry["coordinates"][0] if geometry["type"] == "Polygon" else geometry["coordinates"][0][0]
+        latitude = sum(point[1] for point in ring) / len(ring)
+        pixel_area = _pixel_area_m2(src, latitude)
+
+        try:
+            bounds = Window(0, 0, src.width, src.height)
+            window = geometry_window(src, [shape]).intersection(bounds)
+        except WindowError:
+            window = None
+
+        if window is not None:
+            for block in _sub_windows(window, block_size):
+                values = src.read(1, window=block, out_dtype="float32")
+                inside = geometry_mask(
+                    [shape],
+                    out_shape=values.shape,
+                    transform=src.window_transform(block),
+                    invert=True,
+                )
+                inside &= ~np.isnan(values)
+                if src.nodata is not None and not math.isnan(src.nodata):
+                    inside &= values != src.nodata
+                selected = np.clip(values[inside], *VALUE_RANGE)
+                if not selected.size:
+                    continue
+                counts += np.histogram(selected, bins=edges)[0]
+                total += float(selected.sum(dtype=np.float64))
+                total_sq += float(np.square(selected, dtype=np.float64).sum())
+                minimum = min(minimum, float(selected.min()))
+                maximum = max(maximum, float(selected.max()))
+
+    pixel_count = int(counts.sum())
+    stats = ZonalStats(
+        pixel_count=pixel_count,
+        pixel_area_m2=round(pixel_area, 6),
+        area_ha=round(pixel_count * pixel_area / 10_000, 4),
+    )
+    if not pixel_count:
+        return stats
+
+    mean = total / pixel_count
+    stats.mean = round(mean, 4)
+    stats.std = round(math.sqrt(max(total_sq / pixel_count - mean ** 2, 0.0)), 4)
+    stats.min = round(minimum, 4)
+    stats.max = round(maximum, 4)
+    stats.percentiles = {
+        f"p{q}": round(min(max(histogram_percentile(counts, edges, q), minimum), maximum), 4)
+        for q in PERCENTILES
+    }
+    stats.median = stats.percentiles["p50"]
+
+    coarse = counts.reshape(HISTOGRAM_BINS, -1).sum(axis=1)
+    coarse_edges = edges[:: FINE_BINS // HISTOGRAM_BINS]
+    stats.histogram = [
+        {"lower": round(float(lower), 4), "upper": round(float(upper), 4), "count": int(count)}
+        for lower, upper, count in zip(coarse_edges, coarse_edges[1:], coarse)
+    ]
+    stats.vigour_classes = _vigour_classes(
+        counts, VIGOUR_THRESHOLDS.get(index, VIGOUR_THRESHOLDS[NDVI]), pixel_area
+    )
+    return stats
@@ -1,10 +1,10 @@
+import asyncio
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.httpsredirect import HTTPSRedirectMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from slowapi import Limiter, _rate_limit_exceeded_handler
+from slowapi import _rate_limit_exceeded_handler
 from app.core import config
-from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from app.routes.auth import router as auth_router
 from app.routes.establishments import router as establishments_router
@@ -23,12 +23,11 @@ from app.routes.invitations import router as invitations_router
 from app.routes.trash import router as trash_router
 from app.routes.costs import router as costs_router
 from app.routes.onboarding import router as onboarding_router
+from app.routes.treatments import router as treatments_router
 from app.core.logger import logger
 from app.core.middleware import LoggingMiddleware
 from app.core.tenancy import tenant_middleware
-
-limiter_storage_uri = config.RATE_LIMIT_REDIS_URL if getattr(config, 'RATE_LIMIT_REDIS_URL', None) and config.ENV == "production" else "memory://"
-limiter = Limiter(key_func=get_remote_address, storage_uri=limiter_storage_uri)
+from app.core.rate_limiting import limiter, rate_limit_middleware
 
 app = FastAPI(
     title="VitiScan PRO V3",
@@ -43,6 +42,8 @@ app.state.limiter = limiter
 # app.add_middleware(LoggingMiddleware)
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 # app.middleware("http")(tenant_middleware)
+# Plan x route-class limits; registered first so CORS and security headers wrap its 429s
+app.middleware("http")(rate_limit_middleware)
 
 # V3.1 Fix: HTTPS Enforcement in production
 if config.ENV == "production" and config.FORCE_HTTPS:
@@ -72,7 +73,8 @@ app.add_middleware(
     allow_origins=config.CORS_ORIGINS,  # Now uses env var, not "*"
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization", "Accept"],
+    allow_headers=["Content-Type", "Authorization", "Accept", "X-Tenant-Id"],
+    expose_headers=["RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset", "RateLimit-Policy", "Retry-After"],
 )
 
 app.include_router(auth_router, tags=["Authentication"])
@@ -91,6 +93,7 @@ app.include_router(ephy_router)
 app.include_router(invitations_router)
 app.include_router(trash_router)
 app.include_router(costs_router)
+app.include_router(treatments_router)
 app.include_router(onboarding_router, prefix="/onboarding", tags=["Onboarding"])
 from app.routes.establishment_logo import router as establishment_logo_router
 app.include_router(establishment_logo_router, tags=["Establishment Logo"])
@@ -109,9 +112,66 @@ async def startup_event():
         await db["parcels"].create_index([("user_id", 1), ("establishment_id", 1)])
         await db["crops"].create_index([("user_id", 1), ("parcel_id", 1)])
         await db["scans"].create_index([("user_id", 1), ("parcel_id", 1)])
+        await db["crops"].create_index([("parcel_id", 1), ("user_id", 1), ("created_at", -1)])
+        await db["scans"].create_index([("parcel_id", 1), ("user_id", 1), ("uploaded_at", -1)])
+        await db["scans"].create_index([("sha256", 1)], sparse=True)
+        # Scan search: capture date and sensor per user, position and raster footprint
+        await db["scans"].create_index([("user_id", 1), ("captured_at", -1)])
+        await db["scans"].create_index([("user_id", 1), ("sensor", 1), ("captured_at", -1)])
+        await db["scans"].create_index([("footprint", "2dsphere")])
+        await db["scans"].create_index([("location", "2dsphere")])
+        await db["scan_upload_sessions"].create_index([("status", 1), ("expires_at", 1)])
+        await db["scan_upload_sessions"].create_index([("user_id", 1), ("status", 1)])
         await db["establishments"].create_index([("user_id", 1)])
         await db["cost_entries"].create_index([("establishment_id", 1), ("crop_type", 1), ("date", 1)])
+        await db["treatments"].create_index([("establishment_id", 1), ("data_tratament", 1)])
+        await db["treatments"].create_index([("parcel_id", 1), ("user_id", 1), ("data_tratament", -1)])
+        await db["ift_rollups"].create_index([("scope", 1), ("scope_id", 1), ("season", 1)], unique=True)
+        await db["ift_rollups"].create_index([("establishment_id", 1), ("user_id", 1)])
+        # Unconfirmed presigned uploads are swept with their S3 object by run_session_gc
+        await db["scan_uploads"].create_index([("status", 1), ("expires_at", 1)])
+        await db["scan_zonal_stats"].create_index(
+            [("scan_id", 1), ("index", 1), ("parcel_version", 1)], unique=True
+        )
+        await db["vigour_series"].create_index([("parcel_id", 1), ("season", 1), ("index", 1)], unique=True)
+        await db["vigour_series"].create_index(
+            [("establishment_id", 1), ("user_id", 1), ("season", 1), ("index", 1), ("delta", 1)]
+        )
         logger.info("MongoDB indexes created successfully")
     except Exception as e:
         logger.error(f"Error creating indexes: {e}")
+    try:
+        # The former TTL index dropped pending records and left their objects in S3
+        await db["scan_uploads"].drop_index("expires_at_1")
+    except Exception:
+        pass
+
+    # Abandoned uploads: abort their S3 multipart uploads and delete unconfirmed objects periodically
+    from app.core.upload_sessions import run_session_gc
+    app.state.upload_session_gc = asyncio.create_task(run_session_gc(config.UPLOAD_SESSION_GC_INTERVAL))
+
+    # In-memory verification codes are swept; Redis expires them itself
+    from app.core.ttl_store import MemoryTTLStore
+    from app.routes.auth import verification_store
+    if isinstance(verification_store, MemoryTTLStore):
+        app.state.ttl_store_sweeper = asyncio.create_task(
+            verification_store.run_sweeper(config.TTL_STORE_SWEEP_INTERVAL)
+        )
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    from app.core.s3_storage import s3_storage
+    from app.imaging import pipeline as imaging_pipeline
+    from app.core.password_hashing import password_hasher
+    from app.routes.auth import verification_store
+    for name in ("upload_session_gc", "ttl_store_sweeper"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+    from app.core.rate_limiting import rate_limiter
+    await verification_store.close()
+    await rate_limiter.close()
+    imaging_pipeline.shutdown()
+    password_hasher.shutdown()
+    s3_storage.shutdown()
+    logger.info("VitiScan v3 API shut down")
@@ -4,23 +4,21 @@ from app.core.database import db
 from app.core.config import JWT_SECRET_KEY, JWT_ALGORITHM, ENV, ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS, REFRESH_SECRET_KEY
 from app.core.security import get_current_user, get_current_admin_user
 from app.core.notifications import sms_notifier
+from app.core.password_hashing import password_hasher
+from app.core.ttl_store import build_ttl_store
 from jose import jwt, JWTError
 import datetime
 from datetime import timedelta
-import bcrypt
 import re
 import random
 import string
 from typing import Optional
 from bson import ObjectId
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+from app.core.rate_limiting import limiter
 import logging
 
 router = APIRouter()
 from app.core import config
-limiter_storage_uri = config.RATE_LIMIT_REDIS_URL if getattr(config, 'RATE_LIMIT_REDIS_URL', None) and config.ENV == "production" else "memory://"
-limiter = Limiter(key_func=get_remote_address, storage_uri=limiter_storage_uri)
 logger = logging.getLogger(__name__)
 
 SECRET_KEY = JWT_SECRET_KEY
@@ -88,41 +86,48 @@ class VerifyPhoneCodeResponse(BaseModel):
     message: str
     verified: bool
 
-# In-memory storage for verification codes (use Redis in production)
-verification_codes = {}
+VERIFICATION_CODE_TTL_SECONDS = 600
+VERIFICATION_MAX_ATTEMPTS = 3
+
+# Verification codes by phone: shared by all workers when TTL_STORE_REDIS_URL is set
+verification_store = build_ttl_store(config.TTL_STORE_REDIS_URL, "vitiscan:verify:", config.TTL_STORE_MAX_ENTRIES)
 
 def generate_verification_code() -> str:
     """Generate a 6-digit verification code"""
     return ''.join(random.choices(string.digits, k=6))
 
-def store_verification_code(phone: str, code: str, expires_in_seconds: int = 600):
+async def store_verification_code(phone: str, code: str, expires_in_seconds: int = VERIFICATION_CODE_TTL_SECONDS):
     """Store verification code with expiration"""
-    verification_codes[phone] = {
+    now = datetime.datetime.utcnow()
+    await verification_store.set(phone, {
         'code': code,
-        'expires_at': datetime.datetime.utcnow() + timedelta(seconds=expires_in_seconds),
+        'sent_at': now.timestamp(),
+        'expires_at': (now + timedelta(seconds=expires_in_seconds)).timestamp(),
         'attempts': 0
-    }
+    }, expires_in_seconds)
 
-def get_verification_code(phone: str) -> Optional[dict]:
+async def get_verification_code(phone: str) -> Optional[dict]:
     """Get verification code data if valid"""
-    data = verification_codes.get(phone)
+    data = await verification_store.get(phone)
     if not data:
         return None
-    
-    if datetime.datetime.utcnow() > data['expires_at']:
-        del verification_codes[phone]
-        return None
-    
-    return data
+    return {
+        'code': data['code'],
+        'sent_at': datetime.datetime.utcfromtimestamp(float(data['sent_at'])),
+        'expires_at': datetime.datetime.utcfromtimestamp(float(data['expires_at'])),
+        'attempts': int(data.get('attempts', 0))
+    }
 
-def increment_verification_attempts(phone: str) -> bool:
+async def increment_verification_attempts(phone: str) -> bool:
     """Increment attempts and return True if should block"""
-    data = verification_codes.get(phone)
-    if not data:
+    attempts = await verification_store.incr(phone, 'attempts')
+    if attempts is None:
         return False
-    
-    data['attempts'] += 1
-    return data['attempts'] >= 3  # Block after 3 attempts
+    return attempts >= VERIFICATION_MAX_ATTEMPTS
+
+async def consume_verification_code(phone: str) -> bool:
+    """Remove a code once used; False when another request consumed it first"""
+    return await verification_store.delete(phone)
 
 # Route POST /register
 @router.post(
@@ -182,8 +187,8 @@ async def register(request: Request, data: RegisterData):
         logger.warning("Registration failed: user already exists")
         raise HTTPException(status_code=400, detail="User already exists")
 
-    # Hash password with bcrypt
-    hashed_password = bcrypt.hashpw(data.password.encode('utf-8'), bcrypt.gensalt())
+    # Hash password with bcrypt (off the event loop)
+    hashed_password = await password_hasher.hash(data.password)
     
     # Create new user
     user = {
@@ -191,7 +196,7 @@ async def register(request: Request, data: RegisterData):
         "phone": phone,
         "email": data.email.lower() if data.email else None,
         "full_name": data.full_name,
-        "password": hashed_password.decode('utf-8'),
+        "password": hashed_password,
         "role": data.role,
         "language": data.language,
         "created_at": datetime.datetime.utcnow()
@@ -239,15 +244,15 @@ async def send_verification_code(request: Request, data: SendVerificationCodeReq
         raise HTTPException(status_code=400, detail="Invalid phone format")
     
     # Check if we already sent a code recently (rate limiting)
-    existing_code = get_verification_code(phone)
+    existing_code = await get_verification_code(phone)
     if existing_code:
-        time_since_sent = (datetime.datetime.utcnow() - (existing_code['expires_at'] - timedelta(seconds=600))).seconds
+        time_since_sent = (datetime.datetime.utcnow() - existing_code['sent_at']).total_seconds()
         if time_since_sent < 60:  # Don't allow sending again within 1 minute
             raise HTTPException(status_code=429, detail="Please wait before requesting another code")
     
     # Generate and store verification code
     code = generate_verification_code()
-    store_verification_code(phone, code)
+    await store_verification_code(phone, code)
     
     # Send SMS
     success = sms_notifier.send_verification_code(phone, code)
@@ -256,13 +261,13 @@ async def send_verification_code(request: Request, data: SendVerificationCodeReq
         # In non-production environments, do not fail the request; allow tests/dev to proceed
         if ENV != "production":
             logger.warning("Continuing despite SMS send failure because ENV != production")
-            return {"message": "Verification code generated (not sent in dev)", "expires_in": 600}
+            return {"message": "Verification code generated (not sent in dev)", "expires_in": VERIFICATION_CODE_TTL_SECONDS}
         raise HTTPException(status_code=500, detail="Failed to send verification code")
     
     logger.info(f"Verification code sent to {phone}")
     return {
         "message": "Verification code sent successfully",
-        "expires_in": 600  # 10 minutes
+        "expires_in": VERIFICATION_CODE_TTL_SECONDS
     }
 
 # Route POST /verify-phone-code
@@ -284,34 +289,24 @@ async def verify_phone_code(request: Request, data: VerifyPhoneCodeRequest):
         raise HTTPException(status_code=400, detail="Invalid phone format")
     
     # Get stored verification data
-    stored_data = get_verification_code(phone)
+    stored_data = await get_verification_code(phone)
     if not stored_data:
         raise HTTPException(status_code=400, detail="No verification code found or expired")
     
     # Check attempts
-    if increment_verification_attempts(phone):
+    if await increment_verification_attempts(phone):
         logger.warning(f"Too many verification attempts for {phone}")
         raise HTTPException(status_code=429, detail="Too many failed attempts. Please request a new code.")
     
     # Verify code
     if stored_data['code'] != data.code:
         raise HTTPException(status_code=400, detail="Invalid verification code")
-
-# Development helper: retrieve the verification code (only allowed in non-production)
-@router.get("/dev/verification-code")
-async def get_dev_verification_code(phone: str):
-    from app.core import config
-    if config.ENV == "production":
-        raise HTTPException(status_code=404, detail="Not available in production")
-    code_data = get_verification_code(phone)
-    if not code_data:
-        raise HTTPException(status_code=404, detail="Code not found")
-    return {"phone": phone, "code": code_data["code"]}    
-    # Code is valid - remove it from storage
-    del verification_codes[phone]
+    
+    # Code is valid - remove it from storage; a concurrent request may have used it already
+    if not await consume_verification_code(phone):
+        raise HTTPException(status_code=400, detail="No verification code found or expired")
 
     # Update user document - set phone_verified flag
-    from app.core.database import db
     user = await db["users"].find_one({"$or": [{"phone": phone}, {"username": phone}]})
     if user:
         await db["users"].update_one({"_id": user["_id"]}, {"$set": {"phone_verified": True}})
@@ -322,6 +317,16 @@ async def get_dev_verification_code(phone: str):
         "verified": True
     }
 
+# Development helper: retrieve the verification code (only allowed in non-production)
+@router.get("/dev/verification-code")
+async def get_dev_verification_code(phone: str):
+    if config.ENV == "production":
+        raise HTTPException(status_code=404, detail="Not available in production")
+    code_data = await get_verification_code(phone)
+    if not code_data:
+        raise HTTPException(status_code=404, detail="Code not found")
+    return {"phone": phone, "code": code_data["code"]}
+
 @router.get("/test-simple")
 async def test_simple():
     return {"message": "Simple test works"}
@@ -358,8 +363,18 @@ async def login(request: Request, phone: str = Form(None), username: str = Form(
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     # Compare password with hash from DB
-    if not bcrypt.checkpw(password.encode('utf-8'), user["password"].encode('utf-8')):
+    if not await password_hasher.verify(password, user.get("password")):
         raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    # Upgrade hashes made with an older scheme or cost while the plain password is at hand
+    if password_hasher.needs_rehash(user["password"]):
+        try:
+            await db["users"].update_one(
+                {"_id": user["_id"], "password": user["password"]},
+                {"$set": {"password": await password_hasher.hash(password)}}
+            )
+        except Exception as e:
+            logger.warning(f"Password rehash skipped for user {user['_id']}: {e}")
     
     # Generate JWT tokens
     access_token_expires = datetime.datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -3,13 +3,13 @@ from pydantic import BaseModel, EmailStr
 from bson import ObjectId
 from datetime import datetime, timedelta
 from app.core.database import db
-from app.routes.auth import get_current_admin_user, sms_notifier, normalize_phone, is_valid_phone, generate_verification_code, store_verification_code, get_verification_code
+from app.routes.auth import get_current_admin_user, sms_notifier, normalize_phone, is_valid_phone, generate_verification_code, store_verification_code, get_verification_code, consume_verification_code
 from app.core.notifications import telegram_notifier, email_notifier
+from app.core.password_hashing import password_hasher
 from app.core import config
 from app.core.utils import validate_object_id, sanitize_error_message
 import secrets
 import logging
-import bcrypt
 
 logger = logging.getLogger(__name__)
 
@@ -310,7 +310,7 @@ async def complete_beta_registration(token: str, data: BetaRegistrationComplete)
         # Step 1: If no verification code provided, send one
         if not data.verification_code:
             # Check if we already sent a code recently
-            existing_code = get_verification_code(normalized_phone)
+            existing_code = await get_verification_code(normalized_phone)
             if existing_code:
                 # Return success but indicate code was already sent
                 return {
@@ -321,7 +321,7 @@ async def complete_beta_registration(token: str, data: BetaRegistrationComplete)
 
             # Generate and send verification code
             code = generate_verification_code()
-            store_verification_code(normalized_phone, code)
+            await store_verification_code(normalized_phone, code)
 
             success = sms_notifier.send_verification_code(normalized_phone, code)
             if not success:
@@ -336,20 +336,21 @@ async def complete_beta_registration(token: str, data: BetaRegistrationComplete)
             }
 
         # Step 2: Verify the code
-        stored_data = get_verification_code(normalized_phone)
+        stored_data = await get_verification_code(normalized_phone)
         if not stored_data or stored_data['code'] != data.verification_code:
             raise HTTPException(status_code=400, detail="Cod de verificare invalid sau expirat")
 
-        # Code is valid - remove it from storage
-        from app.routes.auth import verification_codes
-        if normalized_phone in verification_codes:
-            del verification_codes[normalized_phone]
+        # Hashed before the code is consumed: a saturated hasher (503) leaves it usable for a retry
+        hashed_password = await password_hasher.hash(data.password)
+
+        # Code is valid - remove it from storage; only one concurrent completion gets it
+        if not await consume_verification_code(normalized_phone):
+            raise HTTPException(status_code=400, detail="Cod de verificare invalid sau expirat")
 
         # Create user
-        hashed_password = bcrypt.hashpw(data.password.encode("utf-8"), bcrypt.gensalt())
         user = {
             "username": beta_request.get("email"),
-            "password": hashed_password.decode("utf-8"),
+            "password": hashed_password,
             "role": "user",
             "language": "ro",
             "full_name": beta_request.get("name"),
@@ -9,6 +9,9 @@ from app.core.logger import logger
 import boto3
 from botocore.exceptions import ClientError
 from app.core import config
+from app.core.scan_cache import scan_cache
+from app.core.password_hashing import password_hasher
+from app.core.security import claims_cache
 
 router = APIRouter(prefix="/health", tags=["Monitoring"])
 
@@ -122,7 +125,10 @@ async def get_metrics():
                 "pending": await db.beta_requests.count_documents({"status": "pending"}),
                 "approved": await db.beta_requests.count_documents({"status": "approved"}),
                 "rejected": await db.beta_requests.count_documents({"status": "rejected"})
-            }
+            },
+            "scan_cache": scan_cache.stats(),
+            "password_hashing": password_hasher.stats(),
+            "jwt_claims_cache": claims_cache.stats()
         }
         return metrics
     except Exception as e:
@@ -7,6 +7,7 @@ from app.core.rbac import require_capability
 from app.core.utils import validate_object_id, sanitize_error_message
 from app.routes.audit import log_audit_event
 from bson import ObjectId
+from pymongo import UpdateOne
 from typing import List, Dict, Any, Union, Optional
 from datetime import date, datetime, time
 from io import BytesIO
@@ -16,15 +17,25 @@ from reportlab.lib.units import mm
 from reportlab.lib.utils import ImageReader
 from reportlab.pdfgen import canvas
 from reportlab.platypus import Table, TableStyle
+import asyncio
 import os
 from app.core.logger import logger
 from pathlib import Path
 from app.ephy.index import EphyIndex
+from app.treatments.compliance import limits_from_usages
+from app.treatments.ift import SCOPE_PARCEL, ReferenceDose, reference_doses, rollup_operations, treatment_ift
+from app.treatments.znt import ZntDistances, ZntEngine, distances_from_usages
 from app.core.config import EPHY_STORAGE_PATH
 from app.core import config
 
 router = APIRouter(tags=["Parcels"])
 
+znt_engine = ZntEngine(
+    Path(config.ZNT_HYDRO_LAYER_PATH),
+    Path(config.ZNT_HEDGE_LAYER_PATH),
+    cache_size=config.ZNT_CACHE_SIZE
+)
+
 # Pydantic model for creating a parcel
 GeoJsonOrCoords = Union[Dict[str, Any], List[List[List[float]]]]
 
@@ -51,6 +62,7 @@ class TreatmentCreate(BaseModel):
     znt_plantes: Optional[int] = None
     dar_jour: Optional[int] = None
     max_applications: Optional[int] = None
+    intervalle_min: Optional[int] = None
 
 class ParcelOut(BaseModel):
     id: str
@@ -80,8 +92,83 @@ class TreatmentOut(BaseModel):
     znt_plantes: Optional[int] = None
     dar_jour: Optional[int] = None
     max_applications: Optional[int] = None
+    intervalle_min: Optional[int] = None
+    ift: Optional[float] = None
+    created_at: Optional[str] = None
+
+class OverviewCropOut(BaseModel):
+    id: str
+    name: Optional[str] = None
+    variety: Optional[str] = None
+    year: Optional[int] = None
     created_at: Optional[str] = None
 
+class OverviewScanOut(BaseModel):
+    scan_id: str
+    filename: Optional[str] = None
+    content_type: Optional[str] = None
+    file_size: Optional[int] = None
+    uploaded_at: Optional[datetime] = None
+
+class OverviewCountsOut(BaseModel):
+    treatments: int
+    scans: int
+    crops: int
+
+class ParcelOverviewOut(BaseModel):
+    parcel: ParcelOut
+    current_crop: Optional[OverviewCropOut] = None
+    treatments: List[TreatmentOut]
+    scans: List[OverviewScanOut]
+    counts: OverviewCountsOut
+
+class ZntOut(BaseModel):
+    parcel_id: str
+    amm: Optional[str] = None
+    znt_aquatique: int
+    znt_plantes: int
+    znt_arthropodes: int
+    parcel_area_ha: float
+    treatable_area_ha: float
+    excluded_area_ha: float
+    excluded_hydro_ha: float
+    excluded_hedge_ha: float
+    hydro_features: int
+    hedge_features: int
+    excluded_geometry: Optional[Dict[str, Any]] = None
+
+class VigourPointOut(BaseModel):
+    scan_id: str
+    date: datetime
+    mean: Optional[float] = None
+    median: Optional[float] = None
+    p10: Optional[float] = None
+    p90: Optional[float] = None
+    pixel_count: int = 0
+    low_vigour_fraction: float = 0.0
+
+class VigourSeriesOut(BaseModel):
+    parcel_id: str
+    season: int
+    index: str
+    points: List[VigourPointOut] = []
+    last: Optional[VigourPointOut] = None
+    previous: Optional[VigourPointOut] = None
+    delta: Optional[float] = None
+
+class VigourDropOut(BaseModel):
+    parcel_id: str
+    name: Optional[str] = None
+    last: VigourPointOut
+    previous: VigourPointOut
+    delta: float
+
+class VigourDropsOut(BaseModel):
+    establishment_id: str
+    season: int
+    index: str
+    parcels: List[VigourDropOut]
+
 # Route POST /parcels - create a new parcel
 @router.post(
     "/parcels",
@@ -320,6 +407,121 @@ async def get_parcel(
         logger.exception(f"Error fetching parcel: {str(e)}")
         raise HTTPException(status_code=500, detail=sanitize_error_message(e))
 
+def _latest_lookup(collection: str, alias: str, sort_field: str, limit: int, project: Optional[dict] = None) -> dict:
+    pipeline = [
+        {"$match": {"$expr": {"$and": [
+            {"$eq": ["$parcel_id", "$$pid"]},
+            {"$eq": ["$user_id", "$$uid"]}
+        ]}}},
+        {"$sort": {sort_field: -1}},
+        {"$limit": limit},
+    ]
+    if project:
+        pipeline.append({"$project": project})
+    return {"$lookup": {
+        "from": collection,
+        "let": {"pid": "$pid", "uid": "$user_id"},
+        "pipeline": pipeline,
+        "as": alias
+    }}
+
+def _count_lookup(collection: str, alias: str) -> dict:
+    return {"$lookup": {
+        "from": collection,
+        "let": {"pid": "$pid", "uid": "$user_id"},
+        "pipeline": [
+            {"$match": {"$expr": {"$and": [
+                {"$eq": ["$parcel_id", "$$pid"]},
+                {"$eq": ["$user_id", "$$uid"]}
+            ]}}},
+            {"$count": "n"}
+        ],
+        "as": alias
+    }}
+
+@router.get(
+    "/parcels/{parcel_id}/overview",
+    summary="Pagina parcelei: detalii, cultură, tratamente, scanări",
+    response_model=ParcelOverviewOut
+)
+async def get_parcel_overview(
+    parcel_id: str,
+    treatments_limit: int = 10,
+    scans_limit: int = 5,
+    user: dict = Depends(require_capability("parcel:view"))
+):
+    try:
+        user_id = user.get("sub")
+        parcel_oid = validate_object_id(parcel_id, "parcel_id")
+        treatments_limit = max(1, min(treatments_limit, 50))
+        scans_limit = max(1, min(scans_limit, 50))
+
+        # One aggregation: ownership match plus every related collection.
+        # Children store parcel_id as a string, hence the $toString join key.
+        pipeline = [
+            {"$match": {"_id": parcel_oid, "user_id": user_id}},
+            {"$addFields": {"pid": {"$toString": "$_id"}}},
+            _latest_lookup("crops", "crops", "created_at", 1),
+            _latest_lookup("treatments", "treatments", "data_tratament", treatments_limit),
+            _latest_lookup(
+                "scans", "scans", "uploaded_at", scans_limit,
+                {"filename": 1, "content_type": 1, "file_size": 1, "uploaded_at": 1}
+            ),
+            _count_lookup("treatments", "treatments_count"),
+            _count_lookup("scans", "scans_count"),
+            _count_lookup("crops", "crops_count"),
+        ]
+        results = await db["parcels"].aggregate(pipeline).to_list(length=1)
+        if not results:
+            raise HTTPException(status_code=404, detail="Parcel not found")
+        parcel = results[0]
+
+        def count(alias: str) -> int:
+            return parcel[alias][0]["n"] if parcel.get(alias) else 0
+
+        crop = parcel["crops"][0] if parcel.get("crops") else None
+        return {
+            "parcel": {
+                "id": str(parcel["_id"]),
+                "name": parcel.get("name"),
+                "crop_type": parcel.get("crop_type"),
+                "area_ha": parcel.get("area_ha"),
+                "establishment_id": parcel.get("establishment_id"),
+                "user_id": parcel.get("user_id"),
+                "coordinates": parcel.get("coordinates"),
+                "planting_year": parcel.get("planting_year"),
+                "created_at": parcel.get("created_at").isoformat() if parcel.get("created_at") else None
+            },
+            "current_crop": {
+                "id": str(crop["_id"]),
+                "name": crop.get("name"),
+                "variety": crop.get("variety"),
+                "year": crop.get("year"),
+                "created_at": crop.get("created_at").isoformat() if crop.get("created_at") else None
+            } if crop else None,
+            "treatments": [treatment_out(t, t["_id"]) for t in parcel.get("treatments", [])],
+            "scans": [
+                {
+                    "scan_id": str(scan["_id"]),
+                    "filename": scan.get("filename"),
+                    "content_type": scan.get("content_type"),
+                    "file_size": scan.get("file_size"),
+                    "uploaded_at": scan.get("uploaded_at")
+                }
+                for scan in parcel.get("scans", [])
+            ],
+            "counts": {
+                "treatments": count("treatments_count"),
+                "scans": count("scans_count"),
+                "crops": count("crops_count"),
+            },
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"Error building parcel overview: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
 def _validate_treatment_input(data: TreatmentCreate):
     if data.data_tratament > date.today():
         raise HTTPException(status_code=400, detail="La date du traitement ne peut pas être dans le futur")
@@ -338,6 +540,88 @@ async def _get_parcel_or_404(parcel_id: str, user_id: str):
         raise HTTPException(status_code=404, detail="Parcel not found or access denied")
     return parcel
 
+def resolve_ephy_autofill(amm: Optional[str]):
+    """E-Phy fields copied onto a treatment and the IFT reference dose of the product"""
+    ephy_data = {}
+    reference = None
+    if not amm:
+        return ephy_data, reference
+    try:
+        index = EphyIndex(Path(EPHY_STORAGE_PATH))
+        product = index.get_product(amm)
+        if product:
+            usages = index.get_usages(amm)
+            reference = reference_doses({amm: usages}).get(amm)
+            # The target pest is not recorded: the strictest vine usage applies, as in the compliance check
+            if usages:
+                distances = distances_from_usages(usages)
+                limits = limits_from_usages({amm: usages})[amm]
+                ephy_data = {
+                    "amm": amm,
+                    "znt_aquatique": distances.aquatique or None,
+                    "znt_arthropodes": distances.arthropodes or None,
+                    "znt_plantes": distances.plantes or None,
+                    "dar_jour": limits.dar_days,
+                    "max_applications": limits.max_applications,
+                    "intervalle_min": limits.min_interval_days
+                }
+    except Exception as e:
+        logger.warning(f"Failed to fetch e-Phy data for AMM {amm}: {e}")
+    return ephy_data, reference
+
+def build_treatment_doc(data: TreatmentCreate, parcel: dict, user_id: str, ephy_data: dict, reference) -> dict:
+    # Calculate quantity used
+    area_treated = data.suprafata_tratata or parcel.get("area_ha", 0)
+    quantity_used = data.doza_aplicata * area_treated if area_treated else 0
+
+    treatment = {
+        "parcel_id": str(parcel["_id"]),
+        "establishment_id": parcel.get("establishment_id"),
+        "user_id": user_id,
+        "data_tratament": datetime.combine(data.data_tratament, time.min),
+        "tip_tratament": data.tip_tratament,
+        "produs_utilizat": data.produs_utilizat,
+        "amm": data.amm,
+        "doza_aplicata": data.doza_aplicata,
+        "suprafata_tratata": area_treated,
+        "cantitate_utilizata": quantity_used,
+        "operator": data.operator,
+        "note_optionale": data.note_optionale,
+        "znt_aquatique": ephy_data.get("znt_aquatique") or data.znt_aquatique,
+        "znt_arthropodes": ephy_data.get("znt_arthropodes") or data.znt_arthropodes,
+        "znt_plantes": ephy_data.get("znt_plantes") or data.znt_plantes,
+        "dar_jour": ephy_data.get("dar_jour") or data.dar_jour,
+        "max_applications": ephy_data.get("max_applications") or data.max_applications,
+        "intervalle_min": ephy_data.get("intervalle_min") or data.intervalle_min,
+        "created_at": datetime.utcnow()
+    }
+    treatment["ift"] = treatment_ift(data.doza_aplicata, area_treated, parcel.get("area_ha"), reference)
+    treatment["ift_reference_dose"] = reference.dose if reference else None
+    return treatment
+
+def treatment_out(treatment: dict, treatment_id) -> dict:
+    return {
+        "id": str(treatment_id),
+        "parcel_id": treatment.get("parcel_id"),
+        "data_tratament": treatment.get("data_tratament").date().isoformat() if treatment.get("data_tratament") else None,
+        "tip_tratament": treatment.get("tip_tratament"),
+        "produs_utilizat": treatment.get("produs_utilizat"),
+        "amm": treatment.get("amm"),
+        "doza_aplicata": treatment.get("doza_aplicata"),
+        "suprafata_tratata": treatment.get("suprafata_tratata"),
+        "cantitate_utilizata": treatment.get("cantitate_utilizata"),
+        "operator": treatment.get("operator"),
+        "note_optionale": treatment.get("note_optionale"),
+        "znt_aquatique": treatment.get("znt_aquatique"),
+        "znt_arthropodes": treatment.get("znt_arthropodes"),
+        "znt_plantes": treatment.get("znt_plantes"),
+        "dar_jour": treatment.get("dar_jour"),
+        "max_applications": treatment.get("max_applications"),
+        "intervalle_min": treatment.get("intervalle_min"),
+        "ift": treatment.get("ift"),
+        "created_at": treatment.get("created_at").isoformat() if treatment.get("created_at") else None
+    }
+
 @router.get(
     "/parcels/{parcel_id}/treatments",
     summary="Listează tratamentele unei parcele",
@@ -361,25 +645,7 @@ async def get_treatments(
             .skip(offset).limit(limit)
         treatments = []
         async for t in cursor:
-            treatments.append({
-                "id": str(t["_id"]),
-                "parcel_id": t.get("parcel_id"),
-                "data_tratament": t.get("data_tratament").date().isoformat() if t.get("data_tratament") else None,
-                "tip_tratament": t.get("tip_tratament"),
-                "produs_utilizat": t.get("produs_utilizat"),
-                "amm": t.get("amm"),
-                "doza_aplicata": t.get("doza_aplicata"),
-                "suprafata_tratata": t.get("suprafata_tratata"),
-                "cantitate_utilizata": t.get("cantitate_utilizata"),
-                "operator": t.get("operator"),
-                "note_optionale": t.get("note_optionale"),
-                "znt_aquatique": t.get("znt_aquatique"),
-                "znt_arthropodes": t.get("znt_arthropodes"),
-                "znt_plantes": t.get("znt_plantes"),
-                "dar_jour": t.get("dar_jour"),
-                "max_applications": t.get("max_applications"),
-                "created_at": t.get("created_at").isoformat() if t.get("created_at") else None,
-            })
+            treatments.append(treatment_out(t, t["_id"]))
         return treatments
     except HTTPException:
         raise
@@ -407,54 +673,20 @@ async def create_treatment(
         parcel = await _get_parcel_or_404(parcel_id, user_id)
         _validate_treatment_input(data)
 
-        # Calculate quantity used
-        area_treated = data.suprafata_tratata or parcel.get("area_ha", 0)
-        quantity_used = data.doza_aplicata * area_treated if area_treated else 0
-
-        # Auto-fill from e-Phy if AMM provided
-        ephy_data = {}
-        if data.amm:
-            try:
-                index = EphyIndex(Path(EPHY_STORAGE_PATH))
-                product = index.get_product(data.amm)
-                if product:
-                    # Get first usage for viticulture
-                    usages = index.get_usages(data.amm, limit=1)
-                    if usages:
-                        usage = usages[0]
-                        ephy_data = {
-                            "amm": data.amm,
-                            "znt_aquatique": usage.get("znt_aquatique"),
-                            "znt_arthropodes": usage.get("znt_arthropodes"),
-                            "znt_plantes": usage.get("znt_plantes"),
-                            "dar_jour": usage.get("dar_jour"),
-                            "max_applications": usage.get("max_apps")
-                        }
-            except Exception as e:
-                logger.warning(f"Failed to fetch e-Phy data for AMM {data.amm}: {e}")
-
-        treatment = {
-            "parcel_id": parcel_id,
-            "user_id": user_id,
-            "data_tratament": datetime.combine(data.data_tratament, time.min),
-            "tip_tratament": data.tip_tratament,
-            "produs_utilizat": data.produs_utilizat,
-            "amm": data.amm,
-            "doza_aplicata": data.doza_aplicata,
-            "suprafata_tratata": area_treated,
-            "cantitate_utilizata": quantity_used,
-            "operator": data.operator,
-            "note_optionale": data.note_optionale,
-            "znt_aquatique": ephy_data.get("znt_aquatique") or data.znt_aquatique,
-            "znt_arthropodes": ephy_data.get("znt_arthropodes") or data.znt_arthropodes,
-            "znt_plantes": ephy_data.get("znt_plantes") or data.znt_plantes,
-            "dar_jour": ephy_data.get("dar_jour") or data.dar_jour,
-            "max_applications": ephy_data.get("max_applications") or data.max_applications,
-            "created_at": datetime.utcnow()
-        }
+        ephy_data, reference = await asyncio.to_thread(resolve_ephy_autofill, data.amm)
+        treatment = build_treatment_doc(data, parcel, user_id, ephy_data, reference)
 
         result = await db["treatments"].insert_one(treatment)
 
+        # Fold into the season IFT rollups instead of recomputing the register
+        try:
+            await db["ift_rollups"].bulk_write(
+                rollup_operations(treatment, treatment["ift"], parcel.get("area_ha")),
+                ordered=False
+            )
+        except Exception as e:
+            logger.error(f"Failed to update IFT rollups for treatment {result.inserted_id}: {e}")
+
         await log_audit_event(
             user_id=user_id,
             action="treatment.create",
@@ -463,25 +695,7 @@ async def create_treatment(
             resource_id=str(result.inserted_id),
             details={"parcel_id": parcel_id}
         )
-        return {
-            "id": str(result.inserted_id),
-            "parcel_id": parcel_id,
-            "data_tratament": data.data_tratament.isoformat(),
-            "tip_tratament": data.tip_tratament,
-            "produs_utilizat": data.produs_utilizat,
-            "amm": data.amm,
-            "doza_aplicata": data.doza_aplicata,
-            "suprafata_tratata": area_treated,
-            "cantitate_utilizata": quantity_used,
-            "operator": data.operator,
-            "note_optionale": data.note_optionale,
-            "znt_aquatique": treatment.get("znt_aquatique"),
-            "znt_arthropodes": treatment.get("znt_arthropodes"),
-            "znt_plantes": treatment.get("znt_plantes"),
-            "dar_jour": treatment.get("dar_jour"),
-            "max_applications": treatment.get("max_applications"),
-            "created_at": treatment["created_at"].isoformat()
-        }
+        return treatment_out(treatment, result.inserted_id)
     except HTTPException:
         raise
     except Exception as e:
@@ -609,6 +823,196 @@ async def export_parcel_draaf(
         logger.exception(f"Error exporting DRAAF PDF: {str(e)}")
         raise HTTPException(status_code=500, detail=sanitize_error_message(e))
 
+@router.get(
+    "/parcels/{parcel_id}/znt",
+    summary="Suprafață tratabilă după ZNT (ape, garduri vii)",
+    response_model=ZntOut
+)
+async def get_parcel_znt(
+    parcel_id: str,
+    amm: Optional[str] = None,
+    znt_aquatique: Optional[int] = None,
+    znt_plantes: Optional[int] = None,
+    znt_arthropodes: Optional[int] = None,
+    user: dict = Depends(require_capability("parcel:view"))
+):
+    try:
+        user_id = user.get("sub")
+        parcel = await _get_parcel_or_404(parcel_id, user_id)
+        if not parcel.get("coordinates"):
+            raise HTTPException(status_code=400, detail="La parcelle n'a pas de géométrie")
+
+        # Explicit distances win over the product's E-Phy authorisation
+        ephy_data = {}
+        if amm:
+            ephy_data, _ = await asyncio.to_thread(resolve_ephy_autofill, amm)
+        distances = ZntDistances(
+            aquatique=znt_aquatique if znt_aquatique is not None else ephy_data.get("znt_aquatique") or 0,
+            plantes=znt_plantes if znt_plantes is not None else ephy_data.get("znt_plantes") or 0,
+            arthropodes=znt_arthropodes if znt_arthropodes is not None else ephy_data.get("znt_arthropodes") or 0,
+        )
+        if min(distances.aquatique, distances.plantes, distances.arthropodes) < 0:
+            raise HTTPException(status_code=400, detail="Les distances ZNT doivent être positives")
+
+        result = await asyncio.to_thread(znt_engine.compute, parcel["coordinates"], distances)
+        return {
+            "parcel_id": parcel_id,
+            "amm": amm,
+            "znt_aquatique": distances.aquatique,
+            "znt_plantes": distances.plantes,
+            "znt_arthropodes": distances.arthropodes,
+            **vars(result),
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"Error computing ZNT for parcel {parcel_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+@router.get(
+    "/parcels/{parcel_id}/vigour-series",
+    summary="Evoluția vigorii parcelei pe sezon (din scanări)",
+    response_model=VigourSeriesOut
+)
+async def get_parcel_vigour_series(
+    parcel_id: str,
+    season: Optional[int] = None,
+    index: str = "ndvi",
+    user: dict = Depends(require_capability("parcel:view"))
+):
+    try:
+        user_id = user.get("sub")
+        await _get_parcel_or_404(parcel_id, user_id)
+        season = season or datetime.utcnow().year
+
+        # Precomputed by the scan pipeline: no raster is read here
+        series = await db["vigour_series"].find_one(
+            {"parcel_id": parcel_id, "season": season, "index": index, "user_id": user_id}
+        ) or {}
+        return {
+            "parcel_id": parcel_id,
+            "season": season,
+            "index": index,
+            "points": series.get("points", []),
+            "last": series.get("last"),
+            "previous": series.get("previous"),
+            "delta": series.get("delta"),
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"Error retrieving vigour series for parcel {parcel_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+@router.get(
+    "/parcels/by-establishment/{establishment_id}/vigour-drops",
+    summary="Parcelele cu cea mai mare scădere de vigoare de la ultima scanare",
+    response_model=VigourDropsOut
+)
+async def get_establishment_vigour_drops(
+    establishment_id: str,
+    season: Optional[int] = None,
+    index: str = "ndvi",
+    limit: int = 20,
+    user: dict = Depends(require_capability("parcel:view"))
+):
+    try:
+        user_id = user.get("sub")
+        establishment_oid = validate_object_id(establishment_id, "establishment_id")
+        establishment = await db["establishments"].find_one({"_id": establishment_oid, "user_id": user_id})
+        if not establishment:
+            raise HTTPException(status_code=403, detail="Establishment not found or access denied")
+        season = season or datetime.utcnow().year
+        limit = max(1, min(limit, 200))
+
+        # Served by the (establishment_id, user_id, season, index, delta) index
+        drops = await db["vigour_series"].find(
+            {
+                "establishment_id": establishment_id,
+                "user_id": user_id,
+                "season": season,
+                "index": index,
+                "delta": {"$lt": 0}
+            },
+            {"parcel_id": 1, "last": 1, "previous": 1, "delta": 1}
+        ).sort("delta", 1).limit(limit).to_list(length=limit)
+
+        names = {}
+        if drops:
+            parcels = await db["parcels"].find(
+                {"_id": {"$in": [ObjectId(d["parcel_id"]) for d in drops]}, "user_id": user_id},
+                {"name": 1}
+            ).to_list(length=None)
+            names = {str(p["_id"]): p.get("name") for p in parcels}
+
+        return {
+            "establishment_id": establishment_id,
+            "season": season,
+            "index": index,
+            "parcels": [
+                {
+                    "parcel_id": d["parcel_id"],
+                    "name": names.get(d["parcel_id"]),
+                    "last": d["last"],
+                    "previous": d["previous"],
+                    "delta": d["delta"],
+                }
+                for d in drops
+            ],
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"Error ranking vigour drops: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+async def refold_parcel_ift(
+    parcel: dict,
+    new_area_ha: Optional[float] = None,
+    deleted: bool = False,
+    establishment_id: Optional[str] = None
+):
+    """Take a parcel's treatments out of the IFT rollups and, unless it was deleted, fold them back at its new area
+
+    With `establishment_id`, the parcel moved: its treatments follow it and
+    are folded into the new establishment's rollups.
+    """
+    parcel_id = str(parcel["_id"])
+    establishment_id = establishment_id or parcel.get("establishment_id")
+    if not deleted and establishment_id != parcel.get("establishment_id"):
+        # Undated treatments are in no rollup but still belong to the establishment
+        await db["treatments"].update_many(
+            {"parcel_id": parcel_id}, {"$set": {"establishment_id": establishment_id}}
+        )
+    treatments = await db["treatments"].find(
+        {"parcel_id": parcel_id, "data_tratament": {"$ne": None}}
+    ).to_list(length=None)
+    rollups = []
+    treatment_updates = []
+    for treatment in treatments:
+        # Taken out where it was folded in: the old area and the old establishment
+        folded = {**treatment, "establishment_id": parcel.get("establishment_id")}
+        rollups.extend(rollup_operations(folded, treatment.get("ift") or 0, parcel.get("area_ha"), sign=-1))
+        if deleted:
+            continue
+        stored_dose = treatment.get("ift_reference_dose")
+        reference = ReferenceDose(dose=stored_dose, unit="") if stored_dose else None
+        ift = treatment_ift(treatment.get("doza_aplicata") or 0, treatment.get("suprafata_tratata"), new_area_ha, reference)
+        treatment_updates.append(UpdateOne({"_id": treatment["_id"]}, {"$set": {"ift": ift}}))
+        rollups.extend(rollup_operations({**treatment, "establishment_id": establishment_id}, ift, new_area_ha))
+
+    if treatment_updates:
+        await db["treatments"].bulk_write(treatment_updates, ordered=False)
+    if rollups:
+        await db["ift_rollups"].bulk_write(rollups, ordered=False)
+    if not deleted and establishment_id != parcel.get("establishment_id"):
+        # Unordered writes may apply the $set of the take-out last: settle the parcel rows here
+        await db["ift_rollups"].update_many(
+            {"scope": SCOPE_PARCEL, "scope_id": parcel_id}, {"$set": {"establishment_id": establishment_id}}
+        )
+    if deleted:
+        await db["ift_rollups"].delete_many({"scope": SCOPE_PARCEL, "scope_id": parcel_id})
+
 # Route PUT /parcels/{parcel_id} - update a parcel
 @router.put("/parcels/{parcel_id}")
 async def update_parcel(
@@ -635,12 +1039,29 @@ async def update_parcel(
                 if "type" not in coords or "coordinates" not in coords:
                     raise HTTPException(status_code=400, detail="Invalid coordinates format")
 
+        moved = update_dict.get("establishment_id") != parcel.get("establishment_id")
+        if moved:
+            # Same check as on creation: a parcel only moves into one of the user's establishments
+            establishment_oid = validate_object_id(update_dict["establishment_id"], "establishment_id")
+            if not await db["establishments"].find_one({"_id": establishment_oid, "user_id": user_id}):
+                raise HTTPException(status_code=403, detail="Establishment not found or access denied")
+
         # Update the parcel
         await db["parcels"].update_one(
             {"_id": parcel_oid},
             {"$set": update_dict}
         )
 
+        # The IFT of a treatment and its weight in the establishment rollup depend on the area;
+        # a parcel moved to another establishment takes its treatments along
+        if update_dict.get("area_ha") != parcel.get("area_ha") or moved:
+            try:
+                await refold_parcel_ift(
+                    parcel, new_area_ha=update_dict.get("area_ha"), establishment_id=update_dict.get("establishment_id")
+                )
+            except Exception as e:
+                logger.error(f"Failed to refold IFT rollups of updated parcel {parcel_id}: {e}")
+
         await log_audit_event(
             user_id=user_id,
             action="parcel.update",
@@ -680,11 +1101,17 @@ async def delete_parcel(
         
         # Delete parcel only if it belongs to user
         parcel_oid = validate_object_id(parcel_id, "parcel_id")
-        result = await db["parcels"].delete_one({"_id": parcel_oid, "user_id": user_id})
+        parcel = await db["parcels"].find_one_and_delete({"_id": parcel_oid, "user_id": user_id})
         
-        if result.deleted_count == 0:
+        if parcel is None:
             raise HTTPException(status_code=404, detail="Parcel not found or access denied")
 
+        # Its treatments stay in the register but no longer count towards the establishment IFT
+        try:
+            await refold_parcel_ift(parcel, deleted=True)
+        except Exception as e:
+            logger.error(f"Failed to remove deleted parcel {parcel_id} from the IFT rollups: {e}")
+
         await log_audit_event(
             user_id=user_id,
             action="parcel.delete",
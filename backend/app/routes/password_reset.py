@@ -2,10 +2,10 @@ from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from app.core.database import db
 from app.core.notifications import email_notifier
+from app.core.password_hashing import password_hasher
 from app.core import config
 from datetime import datetime, timedelta
 import secrets
-import bcrypt
 import logging
 
 logger = logging.getLogger(__name__)
@@ -80,11 +80,11 @@ async def confirm_password_reset(data: PasswordResetConfirm):
     if datetime.utcnow() > token_doc.get("expires_at", datetime.utcnow()):
         raise HTTPException(status_code=400, detail="Jeton expiré")
 
-    hashed_password = bcrypt.hashpw(data.new_password.encode("utf-8"), bcrypt.gensalt())
+    hashed_password = await password_hasher.hash(data.new_password)
 
     await db["users"].update_one(
         {"_id": token_doc["user_id"]},
-        {"$set": {"password": hashed_password.decode("utf-8")}}
+        {"$set": {"password": hashed_password}}
     )
 
     await db["password_reset_tokens"].update_one(
@@ -1,18 +1,61 @@
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException
-from fastapi.responses import Response
+from fastapi import APIRouter, BackgroundTasks, UploadFile, File, Depends, HTTPException, Request
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from bson import ObjectId
-from datetime import datetime
+from pymongo import ReturnDocument
+from datetime import datetime, timedelta
 from app.core.database import db
 from app.routes.auth import get_current_user
 from app.core.rbac import require_capability
 from app.core.utils import validate_object_id, sanitize_error_message
 from app.routes.audit import log_audit_event
 from app.core.s3_storage import s3_storage
-from app.core.config import MAX_FILE_SIZE_BYTES, ALLOWED_FILE_EXTENSIONS, ALLOWED_MIME_TYPES
-from typing import List
+from app.core.scan_blobs import claim_blob, link_blob, release_blob
+from app.core.scan_cache import scan_cache
+from app.core.virus_scan import ScanVerdict, quarantine_object, virus_scanner
+from app.core.zip_stream import ZipMember, zip_stream
+from app.core.upload_sessions import (
+    SESSIONS_COLLECTION,
+    chunk_count,
+    expected_chunk_size,
+    session_progress,
+)
+from app.imaging.pipeline import (
+    ZONAL_COLLECTION,
+    compute_scan_zonal_stats,
+    extract_scan_metadata,
+    forget_scan,
+    generate_scan_derivatives,
+    generate_scan_indices,
+    index_s3_key,
+    refresh_scan_zonal_stats,
+    thumbnail_s3_key,
+    tile_s3_key,
+)
+from app.treatments.znt import parcel_geometry, parcel_version
+from shapely.geometry import mapping
+from app.core.config import (
+    MAX_FILE_SIZE_BYTES,
+    ALLOWED_FILE_EXTENSIONS,
+    ALLOWED_MIME_TYPES,
+    UPLOAD_CHUNK_SIZE,
+    DOWNLOAD_CHUNK_SIZE,
+    SCAN_BATCH_MAX_FILES,
+    SCAN_BATCH_CONCURRENCY,
+    UPLOAD_SESSION_CHUNK_SIZE,
+    UPLOAD_SESSION_TTL_HOURS,
+    S3_PRESIGN_UPLOAD_EXPIRES,
+    S3_PRESIGN_DOWNLOAD_EXPIRES,
+)
+from typing import AsyncIterator, List, Optional
+import asyncio
+import csv
+import hashlib
+import io
 import logging
 import os
+import re
+import zipfile
 
 logger = logging.getLogger(__name__)
 
@@ -22,11 +65,139 @@ class ScanInfo(BaseModel):
     scan_id: str
     filename: str
     uploaded_at: datetime
+    preview_status: str | None = None
 
 class ScanUploadResponse(BaseModel):
     message: str
     scan_id: str
     s3_key: str
+    sha256: str | None = None
+    deduplicated: bool = False
+
+class ScanBatchItem(BaseModel):
+    filename: str
+    status: str
+    scan_id: str | None = None
+    s3_key: str | None = None
+    sha256: str | None = None
+    deduplicated: bool = False
+    status_code: int | None = None
+    detail: str | None = None
+
+class ScanBatchUploadResponse(BaseModel):
+    message: str
+    parcel_id: str
+    uploaded: int
+    failed: int
+    results: List[ScanBatchItem]
+
+class ScanLinkRequest(BaseModel):
+    sha256: str
+    filename: str
+
+class PresignedUploadRequest(BaseModel):
+    filename: str
+    content_type: str
+    file_size: int | None = None
+    # Hex SHA-256 of the file: S3 verifies it, confirming then needs no read of the object
+    sha256: str | None = None
+
+class PresignedUploadResponse(BaseModel):
+    upload_id: str
+    url: str
+    fields: dict
+    s3_key: str
+    max_size: int
+    expires_at: datetime
+
+class UploadSessionCreate(BaseModel):
+    filename: str
+    content_type: str
+    file_size: int
+
+class UploadSessionOut(BaseModel):
+    session_id: str
+    status: str
+    filename: str
+    file_size: int
+    chunk_size: int
+    total_chunks: int
+    received_chunks: List[int] = []
+    missing_chunks: List[int] = []
+    received_bytes: int = 0
+    offset: int = 0
+    expires_at: datetime | None = None
+    scan_id: str | None = None
+
+class PresignedDownloadResponse(BaseModel):
+    url: str
+    expires_in: int
+
+class PyramidOut(BaseModel):
+    status: str
+    width: int | None = None
+    height: int | None = None
+    tile_size: int | None = None
+    max_zoom: int | None = None
+    format: str | None = None
+    tiles: int | None = None
+
+class IndexLayerOut(BaseModel):
+    valid_pixels: int
+    min: float | None = None
+    max: float | None = None
+    mean: float | None = None
+
+class VegetationIndicesOut(BaseModel):
+    status: str
+    width: int | None = None
+    height: int | None = None
+    band_count: int | None = None
+    crs: str | None = None
+    bands: dict | None = None
+    layers: dict[str, IndexLayerOut] = {}
+
+class HistogramBinOut(BaseModel):
+    lower: float
+    upper: float
+    count: int
+
+class VigourClassOut(BaseModel):
+    label: str
+    lower: float
+    upper: float
+    pixels: int
+    fraction: float
+    area_ha: float
+
+class ZonalStatsOut(BaseModel):
+    scan_id: str
+    parcel_id: str
+    index: str
+    parcel_version: str
+    computed_at: datetime
+    pixel_count: int
+    area_ha: float
+    mean: float | None = None
+    std: float | None = None
+    min: float | None = None
+    max: float | None = None
+    median: float | None = None
+    percentiles: dict[str, float] = {}
+    histogram: List[HistogramBinOut] = []
+    vigour_classes: List[VigourClassOut] = []
+
+class ScanSearchItem(BaseModel):
+    scan_id: str
+    filename: str
+    parcel_id: str
+    uploaded_at: datetime | None = None
+    captured_at: datetime | None = None
+    sensor: str | None = None
+    band_count: int | None = None
+    crs: str | None = None
+    location: dict | None = None
+    footprint: dict | None = None
 
 class ScanOut(BaseModel):
     id: str
@@ -39,6 +210,234 @@ class ScanOut(BaseModel):
     s3_key: str | None = None
     s3_bucket: str | None = None
 
+def _validate_file_type(filename: str, content_type: str | None) -> str:
+    # V5.1 FIX: Validate file extension
+    file_ext = os.path.splitext(filename)[1].lower()
+    if file_ext not in ALLOWED_FILE_EXTENSIONS:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Type de fichier {file_ext} non autorisé. Types autorisés : {', '.join(ALLOWED_FILE_EXTENSIONS)}"
+        )
+    
+    # V5.1 FIX: Validate MIME type
+    if content_type not in ALLOWED_MIME_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Type MIME {content_type} non autorisé. Types autorisés : {', '.join(ALLOWED_MIME_TYPES)}"
+        )
+    return file_ext
+
+async def _get_parcel_or_404(parcel_id: str, user_id: str) -> dict:
+    parcel_oid = validate_object_id(parcel_id, "parcel_id")
+    parcel = await db["parcels"].find_one({"_id": parcel_oid, "user_id": user_id})
+    if not parcel:
+        raise HTTPException(status_code=404, detail="Parcel not found or access denied")
+    return parcel
+
+def _too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Fichier trop volumineux. Taille maximale : {MAX_FILE_SIZE_BYTES / (1024 * 1024):.1f}MB"
+    )
+
+def _check_signature(file_ext: str, head: bytes):
+    # V5.1 FIX: Validate magic bytes (file signature)
+    if file_ext in [".jpg", ".jpeg"]:
+        if not head[:3] == b'\xff\xd8\xff':
+            raise HTTPException(status_code=400, detail="Signature de fichier JPEG invalide")
+    elif file_ext == ".png":
+        if not head[:4] == b'\x89PNG':
+            raise HTTPException(status_code=400, detail="Signature de fichier PNG invalide")
+    elif file_ext in [".tiff", ".tif"]:
+        if not (head[:2] == b'II' or head[:2] == b'MM'):
+            raise HTTPException(status_code=400, detail="Signature de fichier TIFF invalide")
+    elif file_ext == ".pdf":
+        if not head[:4] == b'%PDF':
+            raise HTTPException(status_code=400, detail="Signature de fichier PDF invalide")
+
+async def _iter_upload(file: UploadFile, first_chunk: bytes, digest=None, virus_scan=None) -> AsyncIterator[bytes]:
+    # V5.1 FIX: Validate file size, enforced while streaming
+    size = len(first_chunk)
+    if size > MAX_FILE_SIZE_BYTES:
+        raise _too_large()
+    if first_chunk:
+        if digest is not None:
+            digest.update(first_chunk)
+        if virus_scan is not None:
+            await virus_scan.feed(first_chunk)
+        yield first_chunk
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > MAX_FILE_SIZE_BYTES:
+            raise _too_large()
+        if digest is not None:
+            digest.update(chunk)
+        if virus_scan is not None:
+            await virus_scan.feed(chunk)
+        yield chunk
+
+async def _store_blob(sha256: str, s3_key: str, s3_bucket: str, size: int, content_type: str, user_id: str) -> tuple[dict, bool]:
+    """Reference the blob of the content; a freshly stored duplicate object is deleted"""
+    blob = await claim_blob(sha256, s3_key, s3_bucket, size, content_type, user_id)
+    deduplicated = blob["s3_key"] != s3_key
+    if deduplicated:
+        await s3_storage.delete_file(s3_key, bucket_type=s3_bucket)
+        logger.info(f"Duplicate upload of blob {sha256}: reusing {blob['s3_key']}")
+    return blob, deduplicated
+
+async def _insert_scan(scan: dict):
+    """Insert a scan whose blob reference is already taken, giving it back if the insert fails"""
+    try:
+        return await db["scans"].insert_one(scan)
+    except Exception:
+        await release_blob(scan["sha256"])
+        raise
+
+async def _store_upload(file: UploadFile, user_id: str, parcel_id: str) -> tuple[dict, bool, dict]:
+    """Validate and stream one uploaded file to S3; returns the scan document to insert"""
+    file_ext = _validate_file_type(file.filename, file.content_type)
+
+    # Reject early when the client announced the size
+    if file.size is not None and file.size > MAX_FILE_SIZE_BYTES:
+        raise _too_large()
+
+    # Stream to S3: only the current chunk and one multipart part are held in memory
+    first_chunk = await file.read(UPLOAD_CHUNK_SIZE)
+    _check_signature(file_ext, first_chunk)
+
+    # Hashed and virus-scanned on the way through: both are known when the upload completes
+    digest = hashlib.sha256()
+    virus_scan = virus_scanner.start()
+    content_type = file.content_type or "application/octet-stream"
+    try:
+        success, s3_key, file_size, error = await s3_storage.upload_stream(
+            _iter_upload(file, first_chunk, digest, virus_scan),
+            filename=file.filename,
+            content_type=content_type,
+            user_id=user_id,
+            parcel_id=parcel_id,
+            bucket_type="main"
+        )
+    except BaseException:
+        if virus_scan is not None:
+            virus_scan.cancel()
+        raise
+    
+    if not success:
+        if virus_scan is not None:
+            virus_scan.cancel()
+        logger.error(f"S3 upload failed: {error}")
+        raise HTTPException(status_code=500, detail="Error uploading file to storage")
+
+    verdict = await virus_scan.result() if virus_scan is not None else None
+    await _enforce_verdict(verdict, s3_key, "main", user_id, parcel_id, file.filename)
+
+    sha256 = digest.hexdigest()
+    blob, deduplicated = await _store_blob(sha256, s3_key, "main", file_size, content_type, user_id)
+    inherited = await _inherited_results(sha256) if deduplicated else {}
+
+    # Save metadata to MongoDB (without file_data)
+    scan = {
+        "filename": file.filename,
+        "content_type": content_type,
+        "s3_key": blob["s3_key"],  # Store S3 key instead of file data
+        "s3_bucket": blob["s3_bucket"],
+        "sha256": sha256,
+        "file_size": file_size,
+        "user_id": user_id,
+        "parcel_id": parcel_id,
+        "uploaded_at": datetime.utcnow(),
+        **inherited
+    }
+    if verdict is not None:
+        scan["virus_scan"] = verdict.as_dict()
+    return scan, deduplicated, inherited
+
+# Results computed from the content alone carry over to an identical upload, with
+# the top-level fields each one sets; a pending or failed result is computed again
+INHERITED_RESULTS = {
+    "derivatives": ("derivatives",),
+    "indices": ("indices",),
+    "metadata": ("metadata", "captured_at", "sensor", "location", "footprint"),
+}
+
+async def _inherited_results(sha256: str) -> dict:
+    # Derived files live next to the shared object: ready results of twin scans apply as is
+    inherited = {}
+    for name, fields in INHERITED_RESULTS.items():
+        twin = await db["scans"].find_one(
+            {"sha256": sha256, f"{name}.status": "ready"},
+            {key: 1 for key in (*fields, "etag")}
+        )
+        if twin:
+            inherited.update({key: twin[key] for key in fields if key in twin})
+            # The object's ETag, whatever the state of the twin's results
+            if twin.get("etag"):
+                inherited.setdefault("etag", twin["etag"])
+    return inherited
+
+def _schedule_processing(background_tasks: BackgroundTasks, scan_id: str, inherited: dict):
+    # First: the capture date it stores dates the vigour points of the index step
+    if "metadata" not in inherited:
+        background_tasks.add_task(extract_scan_metadata, scan_id)
+    if "derivatives" not in inherited:
+        background_tasks.add_task(generate_scan_derivatives, scan_id)
+    if "indices" in inherited:
+        # Index rasters are shared, statistics depend on this scan's parcel
+        background_tasks.add_task(refresh_scan_zonal_stats, scan_id)
+    else:
+        background_tasks.add_task(generate_scan_indices, scan_id)
+
+async def _hash_object(s3_key: str, bucket_type: str) -> tuple[str, ScanVerdict | None]:
+    # One read of the object serves both the content hash and the virus scan
+    success, stream, error = await s3_storage.open_stream(s3_key, chunk_size=UPLOAD_CHUNK_SIZE, bucket_type=bucket_type)
+    if not success:
+        raise RuntimeError(error)
+    digest = hashlib.sha256()
+    virus_scan = virus_scanner.start()
+    try:
+        async for chunk in stream["body"]:
+            digest.update(chunk)
+            if virus_scan is not None:
+                await virus_scan.feed(chunk)
+    except BaseException:
+        if virus_scan is not None:
+            virus_scan.cancel()
+        raise
+    verdict = await virus_scan.result() if virus_scan is not None else None
+    return digest.hexdigest(), verdict
+
+async def _enforce_verdict(
+    verdict: ScanVerdict | None,
+    s3_key: str,
+    bucket_type: str,
+    user_id: str,
+    parcel_id: str,
+    filename: str
+):
+    """Quarantine infected uploads; without a verdict, refuse only when configured to"""
+    if verdict is None or not virus_scanner.rejects(verdict):
+        if verdict is not None and verdict.status != "clean":
+            logger.warning(f"Upload {s3_key} accepted without virus scan: {verdict.detail}")
+        return
+    if not verdict.infected:
+        await s3_storage.delete_file(s3_key, bucket_type=bucket_type)
+        raise HTTPException(status_code=503, detail="Analyse antivirus indisponible, réessayez plus tard")
+
+    quarantine_key = await quarantine_object(s3_key, bucket_type, verdict, user_id, parcel_id, filename)
+    await log_audit_event(
+        user_id=user_id,
+        action="scan.quarantine",
+        outcome="failure",
+        resource_type="parcel",
+        resource_id=parcel_id,
+        details={"filename": filename, "signature": verdict.signature, "quarantine_key": quarantine_key}
+    )
+    raise HTTPException(status_code=422, detail=f"Fichier infecté ({verdict.signature}), mis en quarantaine")
+
 @router.post(
     "/scans/{parcel_id}/upload",
     summary="Încarcă o scanare pentru o parcelă",
@@ -52,99 +451,1054 @@ class ScanOut(BaseModel):
 )
 async def upload_scan(
     parcel_id: str,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     user: dict = Depends(require_capability("scan:upload"))
 ):
     try:
         # Validate parcel ownership
-        parcel_oid = validate_object_id(parcel_id, "parcel_id")
-        parcel = await db["parcels"].find_one({"_id": parcel_oid, "user_id": user.get("sub")})
-        if not parcel:
-            raise HTTPException(status_code=404, detail="Parcel not found or access denied")
+        await _get_parcel_or_404(parcel_id, user.get("sub"))
 
-        # V5.1 FIX: Validate file extension
-        file_ext = os.path.splitext(file.filename)[1].lower()
-        if file_ext not in ALLOWED_FILE_EXTENSIONS:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Type de fichier {file_ext} non autorisé. Types autorisés : {', '.join(ALLOWED_FILE_EXTENSIONS)}"
-            )
+        scan, deduplicated, inherited = await _store_upload(file, user.get("sub"), parcel_id)
+        result = await _insert_scan(scan)
+        logger.info(f"Scan metadata saved for user {user.get('sub')}, file: {file.filename}")
+
+        await log_audit_event(
+            user_id=user.get("sub"),
+            action="scan.upload",
+            outcome="success",
+            resource_type="scan",
+            resource_id=str(result.inserted_id),
+            details={"parcel_id": parcel_id, "filename": file.filename, "sha256": scan["sha256"], "deduplicated": deduplicated}
+        )
         
-        # V5.1 FIX: Validate MIME type
-        if file.content_type not in ALLOWED_MIME_TYPES:
+        _schedule_processing(background_tasks, str(result.inserted_id), inherited)
+        return {
+            "message": "Scan uploaded",
+            "scan_id": str(result.inserted_id),
+            "s3_key": scan["s3_key"],
+            "sha256": scan["sha256"],
+            "deduplicated": deduplicated
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error uploading scan: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+@router.post(
+    "/scans/{parcel_id}/upload-batch",
+    summary="Încarcă mai multe scanări pentru o parcelă (zbor de dronă)",
+    response_model=ScanBatchUploadResponse,
+    responses={
+        201: {"description": "Lot procesat, rezultat pe fișier"},
+        400: {"description": "Lot invalid"},
+        404: {"description": "Parcelă inexistentă"}
+    },
+    status_code=201
+)
+async def upload_scan_batch(
+    parcel_id: str,
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(...),
+    user: dict = Depends(require_capability("scan:upload"))
+):
+    try:
+        user_id = user.get("sub")
+        if len(files) > SCAN_BATCH_MAX_FILES:
             raise HTTPException(
                 status_code=400,
-                detail=f"Type MIME {file.content_type} non autorisé. Types autorisés : {', '.join(ALLOWED_MIME_TYPES)}"
+                detail=f"Trop de fichiers dans le lot. Maximum : {SCAN_BATCH_MAX_FILES}"
             )
+        # Ownership is checked once for the whole flight
+        await _get_parcel_or_404(parcel_id, user_id)
 
-        # Read file content
-        content = await file.read()
-        
-        # V5.1 FIX: Validate file size
-        if len(content) > MAX_FILE_SIZE_BYTES:
+        # One bad image must not sink the flight: each file gets its own outcome
+        semaphore = asyncio.Semaphore(SCAN_BATCH_CONCURRENCY)
+
+        async def store(file: UploadFile):
+            async with semaphore:
+                try:
+                    return await _store_upload(file, user_id, parcel_id)
+                except HTTPException as rejection:
+                    return rejection
+                except Exception as e:
+                    logger.error(f"Batch upload of {file.filename} failed: {str(e)}")
+                    return HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+        outcomes = await asyncio.gather(*(store(file) for file in files))
+
+        stored = [index for index, outcome in enumerate(outcomes) if not isinstance(outcome, HTTPException)]
+        if stored:
+            scans = [outcomes[index][0] for index in stored]
+            try:
+                await db["scans"].insert_many(scans, ordered=False)
+            except Exception as e:
+                # Unordered: the rows that made it stay, the others give their blob reference back
+                logger.error(f"Batch scan insert for parcel {parcel_id} failed: {str(e)}")
+                inserted = {
+                    row["_id"] for row in await db["scans"].find(
+                        {"_id": {"$in": [scan["_id"] for scan in scans if "_id" in scan]}}, {"_id": 1}
+                    ).to_list(length=None)
+                }
+                for index in stored:
+                    scan = outcomes[index][0]
+                    if scan.get("_id") not in inserted:
+                        await release_blob(scan["sha256"])
+                        outcomes[index] = HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+        results = []
+        for file, outcome in zip(files, outcomes):
+            if isinstance(outcome, HTTPException):
+                results.append({
+                    "filename": file.filename,
+                    "status": "rejected" if outcome.status_code < 500 else "failed",
+                    "status_code": outcome.status_code,
+                    "detail": str(outcome.detail)
+                })
+                continue
+            scan, deduplicated, inherited = outcome
+            scan_id = str(scan["_id"])
+            _schedule_processing(background_tasks, scan_id, inherited)
+            results.append({
+                "filename": file.filename,
+                "status": "uploaded",
+                "scan_id": scan_id,
+                "s3_key": scan["s3_key"],
+                "sha256": scan["sha256"],
+                "deduplicated": deduplicated
+            })
+
+        uploaded = sum(1 for item in results if item["status"] == "uploaded")
+        await log_audit_event(
+            user_id=user_id,
+            action="scan.batch_upload",
+            outcome="success" if uploaded == len(files) else ("partial" if uploaded else "failure"),
+            resource_type="parcel",
+            resource_id=parcel_id,
+            details={
+                "files": len(files),
+                "uploaded": uploaded,
+                "deduplicated": sum(1 for item in results if item.get("deduplicated")),
+                "scan_ids": [item["scan_id"] for item in results if item.get("scan_id")],
+                "rejected": [
+                    {"filename": item["filename"], "status_code": item["status_code"]}
+                    for item in results if item["status"] != "uploaded"
+                ]
+            }
+        )
+        logger.info(f"Batch upload for parcel {parcel_id}: {uploaded}/{len(files)} files stored")
+        return {
+            "message": "Batch processed",
+            "parcel_id": parcel_id,
+            "uploaded": uploaded,
+            "failed": len(files) - uploaded,
+            "results": results
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error uploading scan batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+@router.post(
+    "/scans/{parcel_id}/upload-url",
+    summary="URL pre-semnat pentru încărcare directă în S3",
+    response_model=PresignedUploadResponse,
+    responses={
+        400: {"description": "Fișier invalid"},
+        413: {"description": "Fișier prea mare"}
+    },
+    status_code=201
+)
+async def create_presigned_upload(
+    parcel_id: str,
+    data: PresignedUploadRequest,
+    user: dict = Depends(require_capability("scan:upload"))
+):
+    try:
+        user_id = user.get("sub")
+        await _get_parcel_or_404(parcel_id, user_id)
+        _validate_file_type(data.filename, data.content_type)
+        if data.file_size is not None and data.file_size > MAX_FILE_SIZE_BYTES:
+            raise _too_large()
+        sha256 = data.sha256.lower() if data.sha256 else None
+        if sha256 and not re.fullmatch(r"[0-9a-f]{64}", sha256):
+            raise HTTPException(status_code=400, detail="Hash SHA-256 invalide")
+
+        s3_key = s3_storage.generate_s3_key(user_id, parcel_id, data.filename)
+        success, presigned, error = await s3_storage.presigned_upload(
+            s3_key=s3_key,
+            content_type=data.content_type,
+            max_size=MAX_FILE_SIZE_BYTES,
+            expires_in=S3_PRESIGN_UPLOAD_EXPIRES,
+            metadata={"user_id": user_id, "parcel_id": parcel_id},
+            sha256=sha256
+        )
+        if not success:
+            logger.error(f"S3 presign failed: {error}")
+            raise HTTPException(status_code=500, detail="Error preparing upload")
+
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=S3_PRESIGN_UPLOAD_EXPIRES)
+        upload = {
+            "user_id": user_id,
+            "parcel_id": parcel_id,
+            "filename": data.filename,
+            "content_type": data.content_type,
+            "s3_key": s3_key,
+            "s3_bucket": "main",
+            "sha256": sha256,
+            "status": "pending",
+            "created_at": now,
+            "expires_at": expires_at
+        }
+        result = await db["scan_uploads"].insert_one(upload)
+
+        return {
+            "upload_id": str(result.inserted_id),
+            "url": presigned["url"],
+            "fields": presigned["fields"],
+            "s3_key": s3_key,
+            "max_size": MAX_FILE_SIZE_BYTES,
+            "expires_at": expires_at
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error preparing presigned upload: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+@router.post(
+    "/scans/uploads/{upload_id}/confirm",
+    summary="Confirmă o încărcare directă în S3",
+    response_model=ScanUploadResponse,
+    responses={
+        201: {"description": "Scanare înregistrată"},
+        400: {"description": "Fișier invalid"},
+        404: {"description": "Încărcare inexistentă"},
+        409: {"description": "Fișierul nu a fost găsit în S3"}
+    },
+    status_code=201
+)
+async def confirm_presigned_upload(
+    upload_id: str,
+    background_tasks: BackgroundTasks,
+    user: dict = Depends(require_capability("scan:upload"))
+):
+    try:
+        user_id = user.get("sub")
+        upload_oid = validate_object_id(upload_id, "upload_id")
+        upload = await db["scan_uploads"].find_one({"_id": upload_oid, "user_id": user_id})
+        if not upload:
+            raise HTTPException(status_code=404, detail="Upload not found or access denied")
+        if upload["status"] == "confirmed":
+            return {
+                "message": "Scan uploaded",
+                "scan_id": upload["scan_id"],
+                "s3_key": upload.get("blob_s3_key", upload["s3_key"]),
+                "sha256": upload.get("sha256"),
+                "deduplicated": upload.get("deduplicated", False)
+            }
+        if upload["status"] != "pending":
+            raise HTTPException(status_code=400, detail="Upload rejected")
+
+        s3_key = upload["s3_key"]
+        success, head, error = await s3_storage.head_file(
+            s3_key, checksum=bool(upload.get("sha256")), bucket_type=upload["s3_bucket"]
+        )
+        if not success:
+            raise HTTPException(status_code=409, detail="Le fichier n'a pas encore été envoyé")
+
+        # The POST policy already bounds type and size; the signature still has to be checked
+        try:
+            if head["size"] > MAX_FILE_SIZE_BYTES:
+                raise _too_large()
+            if head["content_type"] != upload["content_type"]:
+                raise HTTPException(status_code=400, detail="Type MIME différent de celui annoncé")
+            ok, first_bytes, error = await s3_storage.read_range(s3_key, 0, 15, bucket_type=upload["s3_bucket"])
+            if not ok:
+                raise HTTPException(status_code=500, detail="Error reading file from storage")
+            _check_signature(os.path.splitext(upload["filename"])[1].lower(), first_bytes)
+        except HTTPException as rejection:
+            await s3_storage.delete_file(s3_key, bucket_type=upload["s3_bucket"])
+            await db["scan_uploads"].update_one(
+                {"_id": upload_oid},
+                {"$set": {"status": "rejected", "reason": rejection.detail}}
+            )
+            raise
+
+        # The bytes went straight to S3. When the client announced their hash, S3 checked the
+        # body against it and the API never reads the object; clamd still has to see the bytes
+        # when scanning is on. Older clients without a hash cost one read (in-region, bounded
+        # memory) that serves both the hash and the scan.
+        sha256 = head["sha256"] if head["sha256"] and head["sha256"] == upload.get("sha256") else None
+        if sha256 is None or virus_scanner.enabled:
+            sha256, verdict = await _hash_object(s3_key, upload["s3_bucket"])
+        else:
+            verdict = None
+        try:
+            await _enforce_verdict(verdict, s3_key, upload["s3_bucket"], user_id, upload["parcel_id"], upload["filename"])
+        except HTTPException as rejection:
+            await db["scan_uploads"].update_one(
+                {"_id": upload_oid},
+                {"$set": {"status": "rejected", "reason": rejection.detail}}
+            )
+            raise
+
+        # Claim the pending upload first so a double confirm cannot insert two scans
+        claimed = await db["scan_uploads"].update_one(
+            {"_id": upload_oid, "status": "pending"},
+            {"$set": {"status": "confirmed"}, "$unset": {"expires_at": ""}}
+        )
+        if claimed.modified_count == 0:
+            raise HTTPException(status_code=409, detail="Upload already confirmed")
+
+        blob, deduplicated = await _store_blob(
+            sha256, s3_key, upload["s3_bucket"], head["size"], upload["content_type"], user_id
+        )
+        inherited = await _inherited_results(sha256) if deduplicated else {}
+
+        scan = {
+            "filename": upload["filename"],
+            "content_type": upload["content_type"],
+            "s3_key": blob["s3_key"],
+            "s3_bucket": blob["s3_bucket"],
+            "sha256": sha256,
+            "file_size": head["size"],
+            # A duplicate's own object is gone: the shared one is looked up on first download
+            "etag": None if deduplicated else head["etag"],
+            "user_id": user_id,
+            "parcel_id": upload["parcel_id"],
+            "uploaded_at": datetime.utcnow(),
+            **inherited
+        }
+        if verdict is not None:
+            scan["virus_scan"] = verdict.as_dict()
+        result = await _insert_scan(scan)
+        await db["scan_uploads"].update_one(
+            {"_id": upload_oid},
+            {"$set": {
+                "scan_id": str(result.inserted_id),
+                "sha256": sha256,
+                "blob_s3_key": blob["s3_key"],
+                "deduplicated": deduplicated
+            }}
+        )
+
+        await log_audit_event(
+            user_id=user_id,
+            action="scan.upload",
+            outcome="success",
+            resource_type="scan",
+            resource_id=str(result.inserted_id),
+            details={
+                "parcel_id": upload["parcel_id"],
+                "filename": upload["filename"],
+                "presigned": True,
+                "sha256": sha256,
+                "deduplicated": deduplicated
+            }
+        )
+        _schedule_processing(background_tasks, str(result.inserted_id), inherited)
+        return {
+            "message": "Scan uploaded",
+            "scan_id": str(result.inserted_id),
+            "s3_key": blob["s3_key"],
+            "sha256": sha256,
+            "deduplicated": deduplicated
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error confirming upload: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+def _session_out(session: dict) -> dict:
+    return {
+        "session_id": str(session["_id"]),
+        "status": session["status"],
+        "filename": session["filename"],
+        "file_size": session["file_size"],
+        "chunk_size": session["chunk_size"],
+        "total_chunks": session["total_chunks"],
+        "expires_at": session.get("expires_at"),
+        "scan_id": session.get("scan_id"),
+        **session_progress(session)
+    }
+
+async def _get_session_or_404(session_id: str, user_id: str) -> dict:
+    session_oid = validate_object_id(session_id, "session_id")
+    session = await db[SESSIONS_COLLECTION].find_one({"_id": session_oid, "user_id": user_id})
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found or access denied")
+    return session
+
+async def _read_chunk(request: Request, limit: int) -> bytes:
+    # Bounded read: a chunk never exceeds one S3 part
+    data = bytearray()
+    async for piece in request.stream():
+        data.extend(piece)
+        if len(data) > limit:
+            raise HTTPException(status_code=413, detail="Fragment trop volumineux")
+    return bytes(data)
+
+@router.post(
+    "/scans/{parcel_id}/upload-sessions",
+    summary="Deschide o sesiune de încărcare reluabilă (fragmente)",
+    response_model=UploadSessionOut,
+    responses={
+        201: {"description": "Sesiune creată"},
+        400: {"description": "Fișier invalid"},
+        404: {"description": "Parcelă inexistentă"},
+        413: {"description": "Fișier prea mare"}
+    },
+    status_code=201
+)
+async def create_upload_session(
+    parcel_id: str,
+    data: UploadSessionCreate,
+    user: dict = Depends(require_capability("scan:upload"))
+):
+    try:
+        user_id = user.get("sub")
+        await _get_parcel_or_404(parcel_id, user_id)
+        _validate_file_type(data.filename, data.content_type)
+        if data.file_size <= 0:
+            raise HTTPException(status_code=400, detail="Fichier vide")
+        if data.file_size > MAX_FILE_SIZE_BYTES:
+            raise _too_large()
+
+        s3_key = s3_storage.generate_s3_key(user_id, parcel_id, data.filename)
+        success, s3_upload_id, error = await s3_storage.start_multipart(
+            s3_key,
+            data.content_type,
+            metadata={"user_id": user_id, "parcel_id": parcel_id, "original_filename": data.filename}
+        )
+        if not success:
+            logger.error(f"S3 multipart start failed: {error}")
+            raise HTTPException(status_code=500, detail="Error preparing upload")
+
+        now = datetime.utcnow()
+        session = {
+            "user_id": user_id,
+            "parcel_id": parcel_id,
+            "filename": data.filename,
+            "content_type": data.content_type,
+            "file_size": data.file_size,
+            "chunk_size": UPLOAD_SESSION_CHUNK_SIZE,
+            "total_chunks": chunk_count(data.file_size, UPLOAD_SESSION_CHUNK_SIZE),
+            "s3_key": s3_key,
+            "s3_bucket": "main",
+            "s3_upload_id": s3_upload_id,
+            "parts": {},
+            "status": "open",
+            "created_at": now,
+            "expires_at": now + timedelta(hours=UPLOAD_SESSION_TTL_HOURS)
+        }
+        result = await db[SESSIONS_COLLECTION].insert_one(session)
+        session["_id"] = result.inserted_id
+        return _session_out(session)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error creating upload session: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+@router.get(
+    "/scans/upload-sessions/{session_id}",
+    summary="Starea unei sesiuni de încărcare (fragmente primite, offset)",
+    response_model=UploadSessionOut,
+    responses={404: {"description": "Sesiune inexistentă"}}
+)
+async def get_upload_session(
+    session_id: str,
+    user: dict = Depends(require_capability("scan:upload"))
+):
+    try:
+        return _session_out(await _get_session_or_404(session_id, user.get("sub")))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving upload session: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+@router.put(
+    "/scans/upload-sessions/{session_id}/chunks/{chunk_number}",
+    summary="Trimite un fragment numerotat (retrimiterea îl înlocuiește)",
+    response_model=UploadSessionOut,
+    responses={
+        400: {"description": "Fragment invalid"},
+        404: {"description": "Sesiune inexistentă"},
+        409: {"description": "Sesiune închisă"},
+        413: {"description": "Fragment prea mare"}
+    }
+)
+async def upload_session_chunk(
+    session_id: str,
+    chunk_number: int,
+    request: Request,
+    user: dict = Depends(require_capability("scan:upload"))
+):
+    try:
+        session = await _get_session_or_404(session_id, user.get("sub"))
+        if session["status"] != "open":
+            raise HTTPException(status_code=409, detail=f"Upload session is {session['status']}")
+        expected = expected_chunk_size(session, chunk_number)
+        if expected is None:
+            raise HTTPException(status_code=400, detail=f"Numéro de fragment hors limites (1-{session['total_chunks']})")
+
+        data = await _read_chunk(request, expected)
+        if len(data) != expected:
+            raise HTTPException(status_code=400, detail=f"Fragment incomplet : {len(data)} octets reçus, {expected} attendus")
+        if chunk_number == 1:
+            _check_signature(os.path.splitext(session["filename"])[1].lower(), data[:16])
+
+        success, etag, error = await s3_storage.upload_part(
+            session["s3_key"],
+            session["s3_upload_id"],
+            chunk_number,
+            data,
+            bucket_type=session["s3_bucket"]
+        )
+        if not success:
+            logger.error(f"S3 part upload failed: {error}")
+            raise HTTPException(status_code=502, detail="Error storing chunk, retry it")
+
+        # Each chunk received keeps an active session alive
+        session = await db[SESSIONS_COLLECTION].find_one_and_update(
+            {"_id": session["_id"], "status": "open"},
+            {"$set": {
+                f"parts.{chunk_number}": {"etag": etag, "size": len(data), "received_at": datetime.utcnow()},
+                "expires_at": datetime.utcnow() + timedelta(hours=UPLOAD_SESSION_TTL_HOURS)
+            }},
+            return_document=ReturnDocument.AFTER
+        )
+        if session is None:
+            raise HTTPException(status_code=409, detail="Upload session closed")
+        return _session_out(session)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error storing upload chunk: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+@router.post(
+    "/scans/upload-sessions/{session_id}/complete",
+    summary="Finalizează o sesiune de încărcare reluabilă",
+    response_model=ScanUploadResponse,
+    responses={
+        201: {"description": "Scanare înregistrată"},
+        404: {"description": "Sesiune inexistentă"},
+        409: {"description": "Fragmente lipsă sau sesiune închisă"}
+    },
+    status_code=201
+)
+async def complete_upload_session(
+    session_id: str,
+    background_tasks: BackgroundTasks,
+    user: dict = Depends(require_capability("scan:upload"))
+):
+    try:
+        user_id = user.get("sub")
+        session = await _get_session_or_404(session_id, user_id)
+        if session["status"] == "completed":
+            return {
+                "message": "Scan uploaded",
+                "scan_id": session["scan_id"],
+                "s3_key": session.get("blob_s3_key", session["s3_key"]),
+                "sha256": session.get("sha256"),
+                "deduplicated": session.get("deduplicated", False)
+            }
+        if session["status"] != "open":
+            raise HTTPException(status_code=409, detail=f"Upload session is {session['status']}")
+        progress = session_progress(session)
+        if progress["missing_chunks"]:
             raise HTTPException(
-                status_code=413,
-                detail=f"Fichier trop volumineux. Taille maximale : {MAX_FILE_SIZE_BYTES / (1024 * 1024):.1f}MB"
+                status_code=409,
+                detail=f"Missing chunks: {', '.join(str(n) for n in progress['missing_chunks'][:20])}"
             )
-        
-        # V5.1 FIX: Validate magic bytes (file signature)
-        if file_ext in [".jpg", ".jpeg"]:
-            if not content[:3] == b'\xff\xd8\xff':
-                raise HTTPException(status_code=400, detail="Signature de fichier JPEG invalide")
-        elif file_ext == ".png":
-            if not content[:4] == b'\x89PNG':
-                raise HTTPException(status_code=400, detail="Signature de fichier PNG invalide")
-        elif file_ext in [".tiff", ".tif"]:
-            if not (content[:2] == b'II' or content[:2] == b'MM'):
-                raise HTTPException(status_code=400, detail="Signature de fichier TIFF invalide")
-        elif file_ext == ".pdf":
-            if not content[:4] == b'%PDF':
-                raise HTTPException(status_code=400, detail="Signature de fichier PDF invalide")
-        
-        # Upload to S3
-        success, s3_key, error = await s3_storage.upload_file(
-            file_content=content,
-            filename=file.filename,
-            content_type=file.content_type or "application/octet-stream",
-            user_id=user.get("sub"),
-            parcel_id=parcel_id,
-            bucket_type="main"
+
+        # Claimed before completing so a double finalise (or the sweep) cannot interleave
+        claimed = await db[SESSIONS_COLLECTION].update_one(
+            {"_id": session["_id"], "status": "open"},
+            # updated_at lets the sweep fail a finalisation interrupted by a crash
+            {"$set": {"status": "completing", "updated_at": datetime.utcnow()}}
+        )
+        if claimed.modified_count == 0:
+            raise HTTPException(status_code=409, detail="Upload session already being finalised")
+
+        parts = [
+            {"PartNumber": number, "ETag": session["parts"][str(number)]["etag"]}
+            for number in range(1, session["total_chunks"] + 1)
+        ]
+        success, error = await s3_storage.complete_multipart(
+            session["s3_key"], session["s3_upload_id"], parts, bucket_type=session["s3_bucket"]
         )
-        
         if not success:
-            logger.error(f"S3 upload failed: {error}")
-            raise HTTPException(status_code=500, detail="Error uploading file to storage")
+            # Parts are still there: the client may retry the finalisation
+            await db[SESSIONS_COLLECTION].update_one({"_id": session["_id"]}, {"$set": {"status": "open"}})
+            raise HTTPException(status_code=502, detail="Error assembling the upload, retry it")
+
+        # Past the claim nothing may leave the session "completing": retries would get 409
+        # until the sweep's grace period ends, and the object would be held until then
+        blob_sha256 = None
+        scan_oid = None
+        try:
+            sha256, verdict = await _hash_object(session["s3_key"], session["s3_bucket"])
+            try:
+                await _enforce_verdict(
+                    verdict, session["s3_key"], session["s3_bucket"], user_id, session["parcel_id"], session["filename"]
+                )
+            except HTTPException as rejection:
+                await db[SESSIONS_COLLECTION].update_one(
+                    {"_id": session["_id"]},
+                    {"$set": {"status": "rejected", "reason": rejection.detail}, "$unset": {"parts": ""}}
+                )
+                raise
+            blob, deduplicated = await _store_blob(
+                sha256, session["s3_key"], session["s3_bucket"], session["file_size"], session["content_type"], user_id
+            )
+            blob_sha256 = sha256
+            inherited = await _inherited_results(sha256) if deduplicated else {}
+            scan = {
+                "filename": session["filename"],
+                "content_type": session["content_type"],
+                "s3_key": blob["s3_key"],
+                "s3_bucket": blob["s3_bucket"],
+                "sha256": sha256,
+                "file_size": session["file_size"],
+                "user_id": user_id,
+                "parcel_id": session["parcel_id"],
+                "uploaded_at": datetime.utcnow(),
+                **inherited
+            }
+            if verdict is not None:
+                scan["virus_scan"] = verdict.as_dict()
+            result = await db["scans"].insert_one(scan)
+            scan_oid = result.inserted_id
+            await db[SESSIONS_COLLECTION].update_one(
+                {"_id": session["_id"]},
+                {
+                    "$set": {
+                        "status": "completed",
+                        "scan_id": str(result.inserted_id),
+                        "sha256": sha256,
+                        "blob_s3_key": blob["s3_key"],
+                        "deduplicated": deduplicated,
+                        "completed_at": datetime.utcnow()
+                    },
+                    "$unset": {"parts": "", "expires_at": ""}
+                }
+            )
+        except HTTPException:
+            raise
+        except Exception as e:
+            await _fail_upload_session(session, e, blob_sha256, scan_oid)
+            raise
+
+        await log_audit_event(
+            user_id=user_id,
+            action="scan.upload",
+            outcome="success",
+            resource_type="scan",
+            resource_id=str(result.inserted_id),
+            details={
+                "parcel_id": session["parcel_id"],
+                "filename": session["filename"],
+                "resumable": True,
+                "chunks": session["total_chunks"],
+                "sha256": sha256,
+                "deduplicated": deduplicated
+            }
+        )
+        _schedule_processing(background_tasks, str(result.inserted_id), inherited)
+        return {
+            "message": "Scan uploaded",
+            "scan_id": str(result.inserted_id),
+            "s3_key": blob["s3_key"],
+            "sha256": sha256,
+            "deduplicated": deduplicated
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error completing upload session: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+async def _fail_upload_session(session: dict, error: Exception, blob_sha256: Optional[str], scan_oid: Optional[ObjectId]):
+    """Release what a failed finalisation left behind and mark the session failed"""
+    try:
+        if scan_oid is not None:
+            await db["scans"].delete_one({"_id": scan_oid})
+        if blob_sha256 is not None:
+            # The blob owns the object now (or a copy of it was dropped): only release our reference
+            await release_blob(blob_sha256)
+        else:
+            await s3_storage.delete_file(session["s3_key"], bucket_type=session["s3_bucket"])
+        await db[SESSIONS_COLLECTION].update_one(
+            {"_id": session["_id"]},
+            {
+                "$set": {"status": "failed", "reason": sanitize_error_message(error), "failed_at": datetime.utcnow()},
+                "$unset": {"parts": "", "expires_at": ""}
+            }
+        )
+    except Exception as cleanup_error:
+        logger.error(f"Cleanup of failed upload session {session['_id']} failed: {cleanup_error}")
 
-        # Save metadata to MongoDB (without file_data)
+@router.delete(
+    "/scans/upload-sessions/{session_id}",
+    summary="Abandonează o sesiune de încărcare",
+    status_code=204,
+    responses={
+        404: {"description": "Sesiune inexistentă"},
+        409: {"description": "Sesiune deja finalizată"}
+    }
+)
+async def abort_upload_session(
+    session_id: str,
+    user: dict = Depends(require_capability("scan:upload"))
+):
+    try:
+        session = await _get_session_or_404(session_id, user.get("sub"))
+        deleted = await db[SESSIONS_COLLECTION].delete_one({"_id": session["_id"], "status": "open"})
+        if deleted.deleted_count == 0:
+            raise HTTPException(status_code=409, detail=f"Upload session is {session['status']}")
+        await s3_storage.abort_multipart(session["s3_key"], session["s3_upload_id"], bucket_type=session["s3_bucket"])
+        return Response(status_code=204)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error aborting upload session: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+@router.post(
+    "/scans/{parcel_id}/link",
+    summary="Înregistrează o scanare deja încărcată (după hash SHA-256), fără reîncărcare",
+    response_model=ScanUploadResponse,
+    responses={
+        201: {"description": "Scanare înregistrată"},
+        400: {"description": "Hash sau fișier invalid"},
+        404: {"description": "Conținut necunoscut: fișierul trebuie încărcat"}
+    },
+    status_code=201
+)
+async def link_scan(
+    parcel_id: str,
+    data: ScanLinkRequest,
+    background_tasks: BackgroundTasks,
+    user: dict = Depends(require_capability("scan:upload"))
+):
+    try:
+        user_id = user.get("sub")
+        await _get_parcel_or_404(parcel_id, user_id)
+        sha256 = data.sha256.lower()
+        if not re.fullmatch(r"[0-9a-f]{64}", sha256):
+            raise HTTPException(status_code=400, detail="Hash SHA-256 invalide")
+
+        blob = await link_blob(sha256, user_id)
+        if not blob:
+            raise HTTPException(status_code=404, detail="Contenu inconnu : le fichier doit être envoyé")
+        try:
+            _validate_file_type(data.filename, blob["content_type"])
+        except HTTPException:
+            await release_blob(sha256)
+            raise
+
+        inherited = await _inherited_results(sha256)
         scan = {
-            "filename": file.filename,
-            "content_type": file.content_type or "application/octet-stream",
-            "s3_key": s3_key,  # Store S3 key instead of file data
-            "s3_bucket": "main",
-            "file_size": len(content),
-            "user_id": user.get("sub"),
+            "filename": data.filename,
+            "content_type": blob["content_type"],
+            "s3_key": blob["s3_key"],
+            "s3_bucket": blob["s3_bucket"],
+            "sha256": sha256,
+            "file_size": blob["size"],
+            "user_id": user_id,
             "parcel_id": parcel_id,
-            "uploaded_at": datetime.utcnow()
+            "uploaded_at": datetime.utcnow(),
+            **inherited
         }
-
         result = await db["scans"].insert_one(scan)
-        logger.info(f"Scan metadata saved for user {user.get('sub')}, file: {file.filename}")
 
         await log_audit_event(
-            user_id=user.get("sub"),
+            user_id=user_id,
             action="scan.upload",
             outcome="success",
             resource_type="scan",
             resource_id=str(result.inserted_id),
-            details={"parcel_id": parcel_id, "filename": file.filename}
+            details={"parcel_id": parcel_id, "filename": data.filename, "sha256": sha256, "deduplicated": True}
         )
-        
-        return {"message": "Scan uploaded", "scan_id": str(result.inserted_id), "s3_key": s3_key}
+        _schedule_processing(background_tasks, str(result.inserted_id), inherited)
+        return {
+            "message": "Scan uploaded",
+            "scan_id": str(result.inserted_id),
+            "s3_key": blob["s3_key"],
+            "sha256": sha256,
+            "deduplicated": True
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error linking scan: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
 
+@router.get(
+    "/scans/{scan_id}/download-url",
+    summary="URL pre-semnat pentru descărcare",
+    response_model=PresignedDownloadResponse,
+    responses={
+        307: {"description": "Redirecționare către S3"},
+        404: {"description": "Scanare inexistentă"}
+    }
+)
+async def get_presigned_download(
+    scan_id: str,
+    redirect: bool = True,
+    user: dict = Depends(require_capability("scan:view"))
+):
+    try:
+        scan_oid = validate_object_id(scan_id, "scan_id")
+        scan = await db["scans"].find_one(
+            {"_id": scan_oid, "user_id": user.get("sub")},
+            {"s3_key": 1, "s3_bucket": 1, "filename": 1}
+        )
+        if not scan:
+            raise HTTPException(status_code=404, detail="Scan not found or access denied")
+        if not scan.get("s3_key"):
+            # Legacy scans stored in MongoDB have no S3 object to sign
+            raise HTTPException(status_code=409, detail="Scan not stored in S3, use /scans/{scan_id}")
+
+        success, url, error = await s3_storage.presigned_download(
+            scan["s3_key"],
+            filename=scan["filename"],
+            expires_in=S3_PRESIGN_DOWNLOAD_EXPIRES,
+            bucket_type=scan.get("s3_bucket", "main")
+        )
+        if not success:
+            logger.error(f"S3 presign failed: {error}")
+            raise HTTPException(status_code=500, detail="Error preparing download")
+
+        if redirect:
+            return RedirectResponse(url, status_code=307)
+        return {"url": url, "expires_in": S3_PRESIGN_DOWNLOAD_EXPIRES}
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error uploading scan: {str(e)}")
+        logger.error(f"Error preparing presigned download: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+@router.get(
+    "/scans/search",
+    summary="Caută scanări după data capturii, senzor și intersecția cu o parcelă",
+    response_model=List[ScanSearchItem],
+    responses={
+        400: {"description": "Filtre invalide"},
+        404: {"description": "Parcelă inexistentă"},
+        409: {"description": "Parcelă fără geometrie"}
+    }
+)
+async def search_scans(
+    captured_from: Optional[datetime] = None,
+    captured_to: Optional[datetime] = None,
+    sensor: Optional[str] = None,
+    intersects_parcel_id: Optional[str] = None,
+    min_bands: Optional[int] = None,
+    limit: int = 100,
+    offset: int = 0,
+    user: dict = Depends(require_capability("scan:view"))
+):
+    try:
+        user_id = user.get("sub")
+        limit = max(1, min(limit, 200))
+        offset = max(0, offset)
+        if captured_from and captured_to and captured_from > captured_to:
+            raise HTTPException(status_code=400, detail="captured_from doit précéder captured_to")
+
+        # Metadata only: every filter is served by an index on scans, S3 is never read
+        query: dict = {"user_id": user_id}
+        if captured_from or captured_to:
+            query["captured_at"] = {}
+            if captured_from:
+                query["captured_at"]["$gte"] = captured_from
+            if captured_to:
+                query["captured_at"]["$lte"] = captured_to
+        if sensor:
+            query["sensor"] = sensor
+        if min_bands is not None:
+            query["metadata.band_count"] = {"$gte": min_bands}
+        if intersects_parcel_id:
+            parcel = await _get_parcel_or_404(intersects_parcel_id, user_id)
+            if not parcel.get("coordinates"):
+                raise HTTPException(status_code=409, detail="Parcel has no geometry")
+            geometry = mapping(parcel_geometry(parcel["coordinates"]))
+            # Rasters by footprint, photos by GPS position
+            query["$or"] = [
+                {"footprint": {"$geoIntersects": {"$geometry": geometry}}},
+                {"footprint": {"$exists": False}, "location": {"$geoWithin": {"$geometry": geometry}}}
+            ]
+
+        cursor = db["scans"].find(
+            query,
+            {
+                "filename": 1, "parcel_id": 1, "uploaded_at": 1, "captured_at": 1, "sensor": 1,
+                "location": 1, "footprint": 1, "metadata.band_count": 1, "metadata.crs": 1
+            }
+        ).sort([("captured_at", -1), ("_id", -1)]).skip(offset).limit(limit)
+        results = []
+        async for scan in cursor:
+            metadata = scan.get("metadata") or {}
+            results.append({
+                "scan_id": str(scan["_id"]),
+                "filename": scan["filename"],
+                "parcel_id": scan["parcel_id"],
+                "uploaded_at": scan.get("uploaded_at"),
+                "captured_at": scan.get("captured_at"),
+                "sensor": scan.get("sensor"),
+                "band_count": metadata.get("band_count"),
+                "crs": metadata.get("crs"),
+                "location": scan.get("location"),
+                "footprint": scan.get("footprint")
+            })
+        return results
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error searching scans: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+MANIFEST_FIELDS = [
+    "scan_id", "path", "filename", "parcel_id", "parcel_name", "uploaded_at",
+    "content_type", "file_size", "sha256", "status"
+]
+
+def _archive_path(folder: str, filename: str, taken: set) -> str:
+    # ZIP paths are '/'-separated: keep names flat and unique inside their folder
+    folder = re.sub(r'[\\/:*?"<>|]+', "_", folder).strip(" .") or "parcel"
+    stem, ext = os.path.splitext(re.sub(r'[\\/:*?"<>|]+', "_", filename).strip(" .") or "scan")
+    path = f"{folder}/{stem}{ext}"
+    counter = 1
+    while path in taken:
+        counter += 1
+        path = f"{folder}/{stem} ({counter}){ext}"
+    taken.add(path)
+    return path
+
+async def _bytes_chunks(data: bytes) -> AsyncIterator[bytes]:
+    for start in range(0, len(data), DOWNLOAD_CHUNK_SIZE):
+        yield data[start:start + DOWNLOAD_CHUNK_SIZE]
+
+async def _archive_members(scan_filter: dict, parcel_names: dict) -> AsyncIterator[ZipMember]:
+    taken = set()
+    manifest = io.StringIO()
+    writer = csv.DictWriter(manifest, fieldnames=MANIFEST_FIELDS)
+    writer.writeheader()
+    # file_data of legacy scans is only loaded when its turn comes
+    cursor = db["scans"].find(scan_filter, {"file_data": 0}).sort([("parcel_id", 1), ("uploaded_at", 1)])
+    async for scan in cursor:
+        parcel_name = parcel_names.get(scan["parcel_id"]) or scan["parcel_id"]
+        path = _archive_path(parcel_name, scan["filename"], taken)
+        row = {
+            "scan_id": str(scan["_id"]),
+            "path": path,
+            "filename": scan["filename"],
+            "parcel_id": scan["parcel_id"],
+            "parcel_name": parcel_names.get(scan["parcel_id"], ""),
+            "uploaded_at": scan["uploaded_at"].isoformat() if scan.get("uploaded_at") else "",
+            "content_type": scan.get("content_type", ""),
+            "file_size": scan.get("file_size", ""),
+            "sha256": scan.get("sha256", ""),
+            "status": "included"
+        }
+        modified = scan.get("uploaded_at") or datetime.utcnow()
+
+        if scan.get("s3_key"):
+            success, stream, error = await s3_storage.open_stream(
+                scan["s3_key"], chunk_size=DOWNLOAD_CHUNK_SIZE, bucket_type=scan.get("s3_bucket", "main")
+            )
+            if success:
+                yield ZipMember(path, modified, stream["body"], size=stream.get("content_length"))
+            else:
+                logger.error(f"Archive: scan {scan['_id']} skipped: {error}")
+                row["status"] = "missing"
+        else:
+            legacy = await db["scans"].find_one({"_id": scan["_id"]}, {"file_data": 1})
+            if legacy and legacy.get("file_data"):
+                data = bytes(legacy["file_data"])
+                yield ZipMember(path, modified, _bytes_chunks(data), size=len(data))
+            else:
+                row["status"] = "missing"
+        writer.writerow(row)
+
+    # Last, so it records the files that could not be included
+    yield ZipMember(
+        "manifest.csv",
+        datetime.utcnow(),
+        _bytes_chunks(manifest.getvalue().encode("utf-8")),
+        compress_type=zipfile.ZIP_DEFLATED
+    )
+
+@router.get(
+    "/scans/archive",
+    summary="Arhivă ZIP (în flux) cu scanările unei parcele sau ale unei exploatații",
+    responses={
+        200: {"description": "Arhivă ZIP cu manifest CSV", "content": {"application/zip": {}}},
+        400: {"description": "Parcelă sau exploatație lipsă"},
+        403: {"description": "Exploatație inaccesibilă"},
+        404: {"description": "Parcelă inexistentă sau fără scanări"}
+    }
+)
+async def download_scans_archive(
+    parcel_id: Optional[str] = None,
+    establishment_id: Optional[str] = None,
+    user: dict = Depends(require_capability("scan:view"))
+):
+    try:
+        user_id = user.get("sub")
+        if bool(parcel_id) == bool(establishment_id):
+            raise HTTPException(status_code=400, detail="Indiquez parcel_id ou establishment_id")
+
+        if parcel_id:
+            parcel = await _get_parcel_or_404(parcel_id, user_id)
+            parcel_names = {parcel_id: parcel.get("name")}
+            archive_name = f"scans-{parcel_id}"
+        else:
+            establishment_oid = validate_object_id(establishment_id, "establishment_id")
+            establishment = await db["establishments"].find_one({"_id": establishment_oid, "user_id": user_id})
+            if not establishment:
+                raise HTTPException(status_code=403, detail="Establishment not found or access denied")
+            parcels = await db["parcels"].find(
+                {"establishment_id": establishment_id, "user_id": user_id},
+                {"name": 1}
+            ).to_list(length=None)
+            parcel_names = {str(p["_id"]): p.get("name") for p in parcels}
+            archive_name = f"scans-{establishment_id}"
+
+        scan_filter = {"parcel_id": {"$in": list(parcel_names)}, "user_id": user_id}
+        count = await db["scans"].count_documents(scan_filter)
+        if count == 0:
+            raise HTTPException(status_code=404, detail="No scans to export")
+
+        await log_audit_event(
+            user_id=user_id,
+            action="scan.archive_export",
+            outcome="success",
+            resource_type="parcel" if parcel_id else "establishment",
+            resource_id=parcel_id or establishment_id,
+            details={"scans": count}
+        )
+        # Sent as it is built: no Content-Length, the first member starts right away
+        return StreamingResponse(
+            zip_stream(_archive_members(scan_filter, parcel_names)),
+            media_type="application/zip",
+            headers={
+                "Content-Disposition": f'attachment; filename="{archive_name}-{datetime.utcnow():%Y%m%d}.zip"'
+            }
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error exporting scans archive: {str(e)}")
         raise HTTPException(status_code=500, detail=sanitize_error_message(e))
 
 @router.get(
@@ -176,7 +1530,8 @@ async def get_scans_by_parcel(
             scans.append({
                 "scan_id": str(scan["_id"]),
                 "filename": scan["filename"],
-                "uploaded_at": scan["uploaded_at"]
+                "uploaded_at": scan["uploaded_at"],
+                "preview_status": (scan.get("derivatives") or {}).get("status")
             })
 
         return scans
@@ -187,17 +1542,262 @@ async def get_scans_by_parcel(
         logger.error(f"Error retrieving scans: {str(e)}")
         raise HTTPException(status_code=500, detail=sanitize_error_message(e))
 
+async def _get_scan_with_preview(scan_id: str, user_id: str) -> dict:
+    scan_oid = validate_object_id(scan_id, "scan_id")
+    scan = await db["scans"].find_one(
+        {"_id": scan_oid, "user_id": user_id},
+        {"s3_key": 1, "s3_bucket": 1, "derivatives": 1}
+    )
+    if not scan:
+        raise HTTPException(status_code=404, detail="Scan not found or access denied")
+    if (scan.get("derivatives") or {}).get("status") != "ready":
+        raise HTTPException(status_code=404, detail="Aperçu non disponible")
+    return scan
+
+async def _stream_derived(request: Request, scan: dict, s3_key: str, media_type: str = "image/jpeg"):
+    success, stream, error = await s3_storage.open_stream(
+        s3_key=s3_key,
+        if_none_match=request.headers.get("if-none-match"),
+        chunk_size=DOWNLOAD_CHUNK_SIZE,
+        bucket_type=scan.get("s3_bucket", "main")
+    )
+    if not success:
+        raise HTTPException(status_code=404, detail="Aperçu non disponible")
+
+    # Derived files never change for a given key
+    headers = {"Cache-Control": "private, max-age=86400, immutable"}
+    if stream.get("etag"):
+        headers["ETag"] = stream["etag"]
+    if stream["status"] == 304:
+        return Response(status_code=304, headers=headers)
+    if stream.get("content_length") is not None:
+        headers["Content-Length"] = str(stream["content_length"])
+    return StreamingResponse(stream["body"], media_type=media_type, headers=headers)
+
+@router.get(
+    "/scans/{scan_id}/pyramid",
+    summary="Metadate piramidă de tile-uri",
+    response_model=PyramidOut
+)
+async def get_scan_pyramid(
+    scan_id: str,
+    user: dict = Depends(require_capability("scan:view"))
+):
+    try:
+        scan_oid = validate_object_id(scan_id, "scan_id")
+        scan = await db["scans"].find_one({"_id": scan_oid, "user_id": user.get("sub")}, {"derivatives": 1})
+        if not scan:
+            raise HTTPException(status_code=404, detail="Scan not found or access denied")
+        derivatives = scan.get("derivatives") or {"status": "missing"}
+        return {key: derivatives.get(key) for key in PyramidOut.model_fields}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving scan pyramid: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+@router.get(
+    "/scans/{scan_id}/thumbnail",
+    summary="Miniatură scanare",
+    responses={
+        200: {"content": {"image/jpeg": {}}},
+        404: {"description": "Miniatură indisponibilă"}
+    }
+)
+async def get_scan_thumbnail(
+    scan_id: str,
+    request: Request,
+    user: dict = Depends(require_capability("scan:view"))
+):
+    try:
+        scan = await _get_scan_with_preview(scan_id, user.get("sub"))
+        return await _stream_derived(request, scan, thumbnail_s3_key(scan))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving scan thumbnail: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+@router.get(
+    "/scans/{scan_id}/tiles/{z}/{x}/{y}",
+    summary="Tile din piramida scanării",
+    responses={
+        200: {"content": {"image/jpeg": {}}},
+        404: {"description": "Tile inexistent"}
+    }
+)
+async def get_scan_tile(
+    scan_id: str,
+    z: int,
+    x: int,
+    y: int,
+    request: Request,
+    user: dict = Depends(require_capability("scan:view"))
+):
+    try:
+        scan = await _get_scan_with_preview(scan_id, user.get("sub"))
+        pyramid = scan["derivatives"]
+        if not 0 <= z <= pyramid["max_zoom"] or x < 0 or y < 0:
+            raise HTTPException(status_code=404, detail="Tile not found")
+        scale = 2 ** (pyramid["max_zoom"] - z)
+        level_width = -(-pyramid["width"] // scale)
+        level_height = -(-pyramid["height"] // scale)
+        if x * pyramid["tile_size"] >= level_width or y * pyramid["tile_size"] >= level_height:
+            raise HTTPException(status_code=404, detail="Tile not found")
+        return await _stream_derived(request, scan, tile_s3_key(scan, z, x, y))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving scan tile: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+@router.get(
+    "/scans/{scan_id}/indices",
+    summary="Indici de vegetație (NDVI/NDRE) ai scanării",
+    response_model=VegetationIndicesOut
+)
+async def get_scan_indices(
+    scan_id: str,
+    user: dict = Depends(require_capability("scan:view"))
+):
+    try:
+        scan_oid = validate_object_id(scan_id, "scan_id")
+        scan = await db["scans"].find_one({"_id": scan_oid, "user_id": user.get("sub")}, {"indices": 1})
+        if not scan:
+            raise HTTPException(status_code=404, detail="Scan not found or access denied")
+        indices = scan.get("indices") or {"status": "missing"}
+        result = {key: indices.get(key) for key in VegetationIndicesOut.model_fields if key != "layers"}
+        result["layers"] = indices.get("layers") or {}
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving scan indices: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+@router.get(
+    "/scans/{scan_id}/indices/{index}",
+    summary="Descarcă rasterul unui indice de vegetație (GeoTIFF)",
+    responses={
+        200: {"content": {"image/tiff": {}}},
+        404: {"description": "Indice indisponibil"}
+    }
+)
+async def download_scan_index(
+    scan_id: str,
+    index: str,
+    request: Request,
+    user: dict = Depends(require_capability("scan:view"))
+):
+    try:
+        scan_oid = validate_object_id(scan_id, "scan_id")
+        scan = await db["scans"].find_one(
+            {"_id": scan_oid, "user_id": user.get("sub")},
+            {"s3_key": 1, "s3_bucket": 1, "indices": 1}
+        )
+        if not scan:
+            raise HTTPException(status_code=404, detail="Scan not found or access denied")
+        indices = scan.get("indices") or {}
+        if indices.get("status") != "ready" or index not in (indices.get("layers") or {}):
+            raise HTTPException(status_code=404, detail="Indice non disponible")
+        response = await _stream_derived(request, scan, index_s3_key(scan, index), media_type="image/tiff")
+        response.headers["Content-Disposition"] = f'attachment; filename="{index}.tif"'
+        return response
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving scan index raster: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+@router.get(
+    "/scans/{scan_id}/stats",
+    summary="Statistici zonale ale indicelui de vegetație pe parcelă",
+    response_model=ZonalStatsOut,
+    responses={
+        404: {"description": "Scanare sau indice inexistent"},
+        409: {"description": "Indici încă în calcul sau parcelă fără geometrie"}
+    }
+)
+async def get_scan_stats(
+    scan_id: str,
+    index: str = "ndvi",
+    user: dict = Depends(require_capability("scan:view"))
+):
+    try:
+        user_id = user.get("sub")
+        scan_oid = validate_object_id(scan_id, "scan_id")
+        scan = await db["scans"].find_one(
+            {"_id": scan_oid, "user_id": user_id},
+            {"s3_key": 1, "s3_bucket": 1, "parcel_id": 1, "user_id": 1, "uploaded_at": 1, "captured_at": 1, "indices": 1}
+        )
+        if not scan:
+            raise HTTPException(status_code=404, detail="Scan not found or access denied")
+        indices = scan.get("indices") or {}
+        if indices.get("status") != "ready":
+            raise HTTPException(status_code=409, detail=f"Indices not available (status: {indices.get('status', 'missing')})")
+        if index not in (indices.get("layers") or {}):
+            raise HTTPException(status_code=404, detail="Indice non disponible")
+
+        parcel = await _get_parcel_or_404(scan["parcel_id"], user_id)
+        if not parcel.get("coordinates"):
+            raise HTTPException(status_code=409, detail="Parcel has no geometry")
+
+        # Keyed by parcel version: redrawing the parcel recomputes, nothing else does
+        cached = await db[ZONAL_COLLECTION].find_one({
+            "scan_id": scan_id,
+            "index": index,
+            "parcel_version": parcel_version(parcel["coordinates"])
+        })
+        if cached is None:
+            cached = await compute_scan_zonal_stats(scan, parcel, index)
+        return cached
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error computing scan statistics: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+async def _scan_etag(scan: dict) -> str | None:
+    # Objects are never overwritten, so one HEAD per scan is enough
+    if scan.get("etag"):
+        return scan["etag"]
+    success, head, error = await s3_storage.head_file(scan["s3_key"], bucket_type=scan.get("s3_bucket", "main"))
+    if not success:
+        return None
+    await db["scans"].update_one({"_id": scan["_id"]}, {"$set": {"etag": head["etag"]}})
+    return head["etag"]
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [value.strip().removeprefix("W/").strip('"') for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+def _single_byte_range(range_header: str | None) -> str | None:
+    # S3 serves one range per request; multi-range requests get the whole file (RFC 9110 allows it)
+    if not range_header:
+        return None
+    value = range_header.strip()
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", value)
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    return value
+
 @router.get(
     "/scans/{scan_id}",
     summary="Descarcă o scanare",
     response_model=ScanOut,
     responses={
         200: {"description": "Fișier descărcat"},
-        404: {"description": "Scanare inexistentă"}
+        206: {"description": "Interval parțial (Range)"},
+        304: {"description": "Nemodificat (ETag)"},
+        404: {"description": "Scanare inexistentă"},
+        416: {"description": "Interval invalid"}
     }
 )
 async def download_scan(
     scan_id: str,
+    request: Request,
     user: dict = Depends(require_capability("scan:view"))
 ):
     try:
@@ -222,22 +1822,102 @@ async def download_scan(
             else:
                 raise HTTPException(status_code=500, detail="Scan file location not found")
         
-        success, file_content, content_type, error = await s3_storage.download_file(
-            s3_key=s3_key,
-            bucket_type=s3_bucket_type
-        )
-        
-        if not success:
-            logger.error(f"S3 download failed: {error}")
-            raise HTTPException(status_code=500, detail="Error downloading file from storage")
+        byte_range = _single_byte_range(request.headers.get("range"))
+        etag = await _scan_etag(scan)
+        if etag and _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"Accept-Ranges": "bytes", "ETag": f'"{etag}"'})
+
+        # Hot scans are served from the local disk cache, S3 only on a miss
+        stream = await scan_cache.open_stream(
+            s3_key,
+            etag,
+            byte_range=byte_range,
+            chunk_size=DOWNLOAD_CHUNK_SIZE,
+            bucket_type=s3_bucket_type,
+            size=scan.get("file_size")
+        ) if etag else None
+        if stream is not None:
+            stream["content_type"] = scan.get("content_type") or "application/octet-stream"
+        else:
+            success, stream, error = await s3_storage.open_stream(
+                s3_key=s3_key,
+                byte_range=byte_range,
+                if_none_match=request.headers.get("if-none-match"),
+                chunk_size=DOWNLOAD_CHUNK_SIZE,
+                bucket_type=s3_bucket_type
+            )
+            if not success:
+                logger.error(f"S3 download failed: {error}")
+                raise HTTPException(status_code=500, detail="Error downloading file from storage")
+
+        headers = {"Accept-Ranges": "bytes"}
+        if stream.get("etag"):
+            headers["ETag"] = stream["etag"]
+        if stream["status"] == 304:
+            return Response(status_code=304, headers=headers)
+        if stream["status"] == 416:
+            if stream.get("total_size") is not None:
+                headers["Content-Range"] = f"bytes */{stream['total_size']}"
+            return Response(status_code=416, headers=headers)
 
-        return Response(
-            content=file_content,
-            media_type=content_type,
-            headers={"Content-Disposition": f'attachment; filename="{scan["filename"]}"'}
+        headers["Content-Disposition"] = f'attachment; filename="{scan["filename"]}"'
+        if stream.get("content_length") is not None:
+            headers["Content-Length"] = str(stream["content_length"])
+        if stream.get("content_range"):
+            headers["Content-Range"] = stream["content_range"]
+        return StreamingResponse(
+            stream["body"],
+            status_code=stream["status"],
+            media_type=stream["content_type"],
+            headers=headers
         )
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error downloading scan: {str(e)}")
         raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+@router.delete(
+    "/scans/{scan_id}",
+    summary="Șterge o scanare",
+    status_code=204,
+    responses={404: {"description": "Scanare inexistentă"}}
+)
+async def delete_scan(
+    scan_id: str,
+    user: dict = Depends(require_capability("scan:delete"))
+):
+    try:
+        user_id = user.get("sub")
+        scan_oid = validate_object_id(scan_id, "scan_id")
+        scan = await db["scans"].find_one_and_delete({"_id": scan_oid, "user_id": user_id})
+        if not scan:
+            raise HTTPException(status_code=404, detail="Scan not found or access denied")
+
+        # The row is gone: storage cleanup failures are logged, never turned into a 500
+        try:
+            await forget_scan(scan_id)
+            if scan.get("sha256"):
+                # Shared content: the object goes only with its last scan
+                await release_blob(scan["sha256"])
+            elif scan.get("s3_key"):
+                bucket_type = scan.get("s3_bucket", "main")
+                await s3_storage.delete_file(scan["s3_key"], bucket_type=bucket_type)
+                await s3_storage.delete_prefix(f"{scan['s3_key']}.derived/", bucket_type=bucket_type)
+        except Exception as e:
+            logger.error(f"Storage cleanup of deleted scan {scan_id} failed: {e}")
+
+        await log_audit_event(
+            user_id=user_id,
+            action="scan.delete",
+            outcome="success",
+            resource_type="scan",
+            resource_id=scan_id,
+            details={"parcel_id": scan.get("parcel_id"), "filename": scan.get("filename")}
+        )
+        return Response(status_code=204)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error deleting scan: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
@@ -0,0 +1,366 @@
+"""
+Establishment-wide treatment register endpoints
+Season compliance checks against E-Phy usage limits and IFT dashboard
+Bulk treatment entry for a sprayer pass over several parcels
+"""
+import asyncio
+from datetime import date, datetime
+from pathlib import Path
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+
+from app.core.config import EPHY_STORAGE_PATH
+from app.core.database import db
+from app.core.logger import logger
+from app.core.rbac import require_capability
+from app.core.tenancy import require_tenant
+from app.core.utils import validate_object_id, sanitize_error_message
+from app.ephy.index import EphyIndex
+from app.routes.audit import log_audit_event
+from app.routes.parcels import (
+    TreatmentCreate,
+    TreatmentOut,
+    _validate_treatment_input,
+    build_treatment_doc,
+    resolve_ephy_autofill,
+    treatment_out,
+)
+from app.treatments.compliance import evaluate_season, limits_from_usages, season_bounds
+from app.treatments.ift import SCOPE_ESTABLISHMENT, SCOPE_PARCEL, rollup_operations
+
+router = APIRouter(prefix="/treatments", tags=["Treatments"])
+
+ephy_index = EphyIndex(Path(EPHY_STORAGE_PATH))
+
+MAX_BULK_PARCELS = 500
+
+# Only the fields the compliance engine reads are pulled from MongoDB
+COMPLIANCE_PROJECTION = {
+    "parcel_id": 1,
+    "data_tratament": 1,
+    "produs_utilizat": 1,
+    "amm": 1,
+    "dar_jour": 1,
+    "max_applications": 1,
+    "intervalle_min": 1,
+}
+
+
+class UsageLimitsOut(BaseModel):
+    max_applications: Optional[int] = None
+    min_interval_days: Optional[int] = None
+    dar_days: Optional[int] = None
+
+
+class ProductSeasonOut(BaseModel):
+    product: str
+    amm: Optional[str] = None
+    applications: int
+    first_application: date
+    last_application: date
+    limits: UsageLimitsOut
+    harvest_safe_date: Optional[date] = None
+
+
+class ParcelComplianceOut(BaseModel):
+    parcel_id: str
+    harvest_safe_date: Optional[date] = None
+    products: List[ProductSeasonOut]
+
+
+class ViolationOut(BaseModel):
+    rule: str
+    parcel_id: str
+    product: str
+    amm: Optional[str] = None
+    treatment_id: str
+    treatment_date: date
+    limit: int
+    actual: int
+
+
+class ComplianceOut(BaseModel):
+    establishment_id: str
+    season: int
+    harvest_date: Optional[date] = None
+    treatments_count: int
+    compliant: bool
+    violations: List[ViolationOut]
+    parcels: List[ParcelComplianceOut]
+
+
+class ParcelIftOut(BaseModel):
+    parcel_id: str
+    name: Optional[str] = None
+    area_ha: Optional[float] = None
+    ift: float
+    treatments_count: int
+    by_type: dict = {}
+
+
+class SeasonIftOut(BaseModel):
+    season: int
+    ift: Optional[float] = None
+    treatments_count: int
+
+
+class IftDashboardOut(BaseModel):
+    establishment_id: str
+    season: int
+    total_area_ha: float
+    ift: Optional[float] = None
+    treatments_count: int
+    by_type: dict = {}
+    parcels: List[ParcelIftOut]
+    seasons: List[SeasonIftOut]
+
+
+class BulkTreatmentCreate(BaseModel):
+    parcel_ids: List[str] = Field(..., min_length=1, max_length=MAX_BULK_PARCELS)
+    treatment: TreatmentCreate
+
+
+class BulkTreatmentOut(BaseModel):
+    created: int
+    treatments: List[TreatmentOut]
+
+
+def _establishment_from_tenant(tenant_id: str) -> str:
+    return tenant_id.split(':')[1] if ':' in tenant_id else tenant_id
+
+
+async def _get_establishment_or_403(establishment_id: str, user_id: str) -> dict:
+    establishment_oid = validate_object_id(establishment_id, "establishment_id")
+    establishment = await db["establishments"].find_one({"_id": establishment_oid, "user_id": user_id})
+    if not establishment:
+        raise HTTPException(status_code=403, detail="Establishment not found or access denied")
+    return establishment
+
+
+async def _load_usage_limits(amms: set) -> dict:
+    if not amms:
+        return {}
+    try:
+        usages = await asyncio.to_thread(ephy_index.get_usages_for_amms, amms)
+    except Exception as e:
+        # Index not synced yet: fall back to the limits copied onto the treatments
+        logger.warning(f"E-Phy usage limits unavailable: {e}")
+        return {}
+    return limits_from_usages(usages)
+
+
+@router.get(
+    "/compliance",
+    summary="Conformitate tratamente pe sezon (DAR, nr. max aplicări, interval minim)",
+    response_model=ComplianceOut
+)
+async def get_treatment_compliance(
+    season: Optional[int] = None,
+    harvest_date: Optional[date] = None,
+    user: dict = Depends(require_capability("treatment:view")),
+    tenant_id: str = Depends(require_tenant)
+):
+    try:
+        user_id = user.get("sub")
+        establishment_id = _establishment_from_tenant(tenant_id)
+        await _get_establishment_or_403(establishment_id, user_id)
+
+        season = season or (harvest_date.year if harvest_date else datetime.utcnow().year)
+        start, end = season_bounds(season)
+
+        # One query for the whole season, served by the (establishment_id, data_tratament) index
+        treatments = await db["treatments"].find(
+            {
+                "establishment_id": establishment_id,
+                "user_id": user_id,
+                "data_tratament": {"$gte": start, "$lt": end}
+            },
+            COMPLIANCE_PROJECTION
+        ).to_list(length=None)
+
+        limits = await _load_usage_limits({t["amm"] for t in treatments if t.get("amm")})
+        report = evaluate_season(treatments, limits, season=season, harvest_date=harvest_date)
+
+        parcels = {}
+        for item in report.products:
+            parcels.setdefault(item.parcel_id, []).append({
+                "product": item.product,
+                "amm": item.amm,
+                "applications": item.applications,
+                "first_application": item.first_application,
+                "last_application": item.last_application,
+                "limits": vars(item.limits),
+                "harvest_safe_date": item.harvest_safe_date,
+            })
+        safe_dates = report.harvest_safe_dates()
+
+        return {
+            "establishment_id": establishment_id,
+            "season": season,
+            "harvest_date": harvest_date,
+            "treatments_count": report.treatments_count,
+            "compliant": report.compliant,
+            "violations": [vars(v) for v in report.violations],
+            "parcels": [
+                {"parcel_id": parcel_id, "harvest_safe_date": safe_dates.get(parcel_id), "products": products}
+                for parcel_id, products in parcels.items()
+            ],
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"Error computing treatment compliance: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+
+@router.get(
+    "/ift",
+    summary="Tablou de bord IFT (indice de frecvență a tratamentelor)",
+    response_model=IftDashboardOut
+)
+async def get_ift_dashboard(
+    season: Optional[int] = None,
+    user: dict = Depends(require_capability("treatment:view")),
+    tenant_id: str = Depends(require_tenant)
+):
+    try:
+        user_id = user.get("sub")
+        establishment_id = _establishment_from_tenant(tenant_id)
+        await _get_establishment_or_403(establishment_id, user_id)
+        season = season or datetime.utcnow().year
+
+        # Rollups are kept current by create_treatment: no pass over the register here
+        rollups = await db["ift_rollups"].find({
+            "establishment_id": establishment_id,
+            "user_id": user_id
+        }).to_list(length=None)
+        parcels = await db["parcels"].find(
+            {"establishment_id": establishment_id, "user_id": user_id},
+            {"name": 1, "area_ha": 1}
+        ).to_list(length=None)
+
+        total_area = sum(p.get("area_ha") or 0 for p in parcels)
+        parcels_by_id = {str(p["_id"]): p for p in parcels}
+
+        def per_area(value):
+            return round(value / total_area, 4) if total_area else None
+
+        seasons = []
+        current = None
+        parcel_rows = []
+        for rollup in rollups:
+            if rollup["scope"] == SCOPE_ESTABLISHMENT:
+                seasons.append({
+                    "season": rollup["season"],
+                    "ift": per_area(rollup.get("ift_area", 0)),
+                    "treatments_count": rollup.get("treatments_count", 0),
+                })
+                if rollup["season"] == season:
+                    current = rollup
+            elif rollup["scope"] == SCOPE_PARCEL and rollup["season"] == season:
+                parcel = parcels_by_id.get(rollup["scope_id"], {})
+                parcel_rows.append({
+                    "parcel_id": rollup["scope_id"],
+                    "name": parcel.get("name"),
+                    "area_ha": parcel.get("area_ha"),
+                    "ift": round(rollup.get("ift", 0), 4),
+                    "treatments_count": rollup.get("treatments_count", 0),
+                    "by_type": {k: round(v, 4) for k, v in (rollup.get("by_type") or {}).items()},
+                })
+
+        parcel_rows.sort(key=lambda row: row["ift"], reverse=True)
+        seasons.sort(key=lambda row: row["season"])
+
+        return {
+            "establishment_id": establishment_id,
+            "season": season,
+            "total_area_ha": total_area,
+            "ift": per_area(current.get("ift_area", 0)) if current else None,
+            "treatments_count": current.get("treatments_count", 0) if current else 0,
+            "by_type": {k: per_area(v) for k, v in ((current or {}).get("by_type") or {}).items()},
+            "parcels": parcel_rows,
+            "seasons": seasons,
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"Error building IFT dashboard: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
+
+
+@router.post(
+    "/bulk",
+    summary="Adaugă același tratament pe mai multe parcele",
+    response_model=BulkTreatmentOut,
+    responses={
+        201: {"description": "Tratamente create"},
+        400: {"description": "Date invalide"},
+        404: {"description": "Parcele inexistente sau acces interzis"}
+    },
+    status_code=201
+)
+async def create_treatments_bulk(
+    data: BulkTreatmentCreate,
+    user: dict = Depends(require_capability("treatment:create"))
+):
+    try:
+        user_id = user.get("sub")
+        _validate_treatment_input(data.treatment)
+
+        parcel_ids = list(dict.fromkeys(data.parcel_ids))
+        parcel_oids = [validate_object_id(parcel_id, "parcel_id") for parcel_id in parcel_ids]
+        parcels = await db["parcels"].find(
+            {"_id": {"$in": parcel_oids}, "user_id": user_id},
+            {"establishment_id": 1, "area_ha": 1}
+        ).to_list(length=None)
+        if len(parcels) != len(parcel_oids):
+            found = {p["_id"] for p in parcels}
+            missing = [str(oid) for oid in parcel_oids if oid not in found]
+            raise HTTPException(
+                status_code=404,
+                detail=f"Parcels not found or access denied: {', '.join(missing)}"
+            )
+
+        # One E-Phy lookup for the whole pass
+        ephy_data, reference = await asyncio.to_thread(resolve_ephy_autofill, data.treatment.amm)
+        treatments = [
+            build_treatment_doc(data.treatment, parcel, user_id, ephy_data, reference)
+            for parcel in parcels
+        ]
+
+        result = await db["treatments"].insert_many(treatments)
+
+        rollups = []
+        for treatment, parcel in zip(treatments, parcels):
+            rollups.extend(rollup_operations(treatment, treatment["ift"], parcel.get("area_ha")))
+        try:
+            # Ordered: every parcel of the pass upserts the same establishment rollup
+            await db["ift_rollups"].bulk_write(rollups)
+        except Exception as e:
+            logger.error(f"Failed to update IFT rollups for bulk treatment: {e}")
+
+        await log_audit_event(
+            user_id=user_id,
+            action="treatment.bulk_create",
+            outcome="success",
+            resource_type="treatment",
+            details={
+                "parcel_ids": [t["parcel_id"] for t in treatments],
+                "treatment_ids": [str(i) for i in result.inserted_ids],
+                "produs_utilizat": data.treatment.produs_utilizat,
+            }
+        )
+        return {
+            "created": len(treatments),
+            "treatments": [
+                treatment_out(treatment, treatment_id)
+                for treatment, treatment_id in zip(treatments, result.inserted_ids)
+            ],
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"Error creating bulk treatments: {str(e)}")
+        raise HTTPException(status_code=500, detail=sanitize_error_message(e))
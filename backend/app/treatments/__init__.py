@@ -0,0 +1 @@
+"""Treatment register analytics."""
@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from itertools import groupby
+from typing import Any, Iterable, Mapping, Optional
+
+RULE_MAX_APPLICATIONS = "max_applications"
+RULE_MIN_INTERVAL = "min_interval"
+RULE_DAR = "dar"
+
+
+@dataclass(frozen=True)
+class UsageLimits:
+    max_applications: Optional[int] = None
+    min_interval_days: Optional[int] = None
+    dar_days: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class Violation:
+    rule: str
+    parcel_id: str
+    product: str
+    amm: Optional[str]
+    treatment_id: str
+    treatment_date: date
+    limit: int
+    actual: int
+
+
+@dataclass
+class ProductSeason:
+    parcel_id: str
+    product: str
+    amm: Optional[str]
+    applications: int
+    first_application: date
+    last_application: date
+    limits: UsageLimits
+    harvest_safe_date: Optional[date] = None
+
+
+@dataclass
+class ComplianceReport:
+    season: int
+    harvest_date: Optional[date]
+    treatments_count: int
+    products: list[ProductSeason] = field(default_factory=list)
+    violations: list[Violation] = field(default_factory=list)
+
+    @property
+    def compliant(self) -> bool:
+        return not self.violations
+
+    def harvest_safe_dates(self) -> dict[str, Optional[date]]:
+        """Latest DAR-derived safe date per parcel (None when no DAR is known)."""
+        safe: dict[str, Optional[date]] = {}
+        for item in self.products:
+            current = safe.get(item.parcel_id)
+            if item.harvest_safe_date and (current is None or item.harvest_safe_date > current):
+                safe[item.parcel_id] = item.harvest_safe_date
+            else:
+                safe.setdefault(item.parcel_id, current)
+        return safe
+
+
+def season_bounds(season: int) -> tuple[datetime, datetime]:
+    return datetime(season, 1, 1), datetime(season + 1, 1, 1)
+
+
+def parse_int(value: Any) -> Optional[int]:
+    """E-Phy stores every figure as text ("21", "3.0", ""), treatments store ints."""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip().replace(",", ".")
+    if not text:
+        return None
+    try:
+        return int(float(text))
+    except ValueError:
+        return None
+
+
+def limits_from_usages(usages_by_amm: Mapping[str, Iterable[Mapping[str, Any]]]) -> dict[str, UsageLimits]:
+    """Collapse every vine usage of a product into its strictest limits.
+
+    A treatment does not say which usage (target pest) it was applied for, so the
+    register is checked against the tightest authorisation of the product.
+    """
+    limits: dict[str, UsageLimits] = {}
+    for amm, usages in usages_by_amm.items():
+        max_apps: list[int] = []
+        intervals: list[int] = []
+        dars: list[int] = []
+        for usage in usages:
+            value = parse_int(usage["max_apps"])
+            if value and value > 0:
+                max_apps.append(value)
+            value = parse_int(usage["intervalle_min"])
+            if value and value > 0:
+                intervals.append(value)
+            value = parse_int(usage["dar_jour"])
+            if value is not None and value >= 0:
+                dars.append(value)
+        limits[amm] = UsageLimits(
+            max_applications=min(max_apps) if max_apps else None,
+            min_interval_days=max(intervals) if intervals else None,
+            dar_days=max(dars) if dars else None,
+        )
+    return limits
+
+
+def product_key(treatment: Mapping[str, Any]) -> str:
+    amm = (treatment.get("amm") or "").strip()
+    if amm:
+        return f"amm:{amm}"
+    return f"name:{(treatment.get('produs_utilizat') or '').strip().lower()}"
+
+
+def _treatment_day(treatment: Mapping[str, Any]) -> date:
+    value = treatment["data_tratament"]
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _resolve_limits(group: list[Mapping[str, Any]], ephy: Optional[UsageLimits]) -> UsageLimits:
+    # Fall back to the figures copied onto the treatment rows for products that
+    # are not (or no longer) in the local E-Phy index.
+    def stored(field_name: str) -> Optional[int]:
+        for treatment in reversed(group):
+            value = parse_int(treatment.get(field_name))
+            if value is not None:
+                return value
+        return None
+
+    ephy = ephy or UsageLimits()
+    return UsageLimits(
+        max_applications=ephy.max_applications if ephy.max_applications is not None else stored("max_applications"),
+        min_interval_days=ephy.min_interval_days if ephy.min_interval_days is not None else stored("intervalle_min"),
+        dar_days=ephy.dar_days if ephy.dar_days is not None else stored("dar_jour"),
+    )
+
+
+def evaluate_season(
+    treatments: Iterable[Mapping[str, Any]],
+    limits_by_amm: Mapping[str, UsageLimits],
+    season: int,
+    harvest_date: Optional[date] = None,
+) -> ComplianceReport:
+    """Check a season of treatments in one sorted pass grouped by parcel × product."""
+    rows = [
+        (t["parcel_id"], product_key(t), _treatment_day(t), t)
+        for t in treatments
+        if t.get("data_tratament") and t.get("parcel_id")
+    ]
+    rows.sort(key=lambda row: row[:3])
+    report = ComplianceReport(season=season, harvest_date=harvest_date, treatments_count=len(rows))
+
+    for (parcel_id, key), grouped in groupby(rows, key=lambda row: row[:2]):
+        entries = list(grouped)
+        group = [entry[3] for entry in entries]
+        days = [entry[2] for entry in entries]
+        amm = key[4:] if key.startswith("amm:") else None
+        product = group[-1].get("produs_utilizat") or amm or ""
+        limits = _resolve_limits(group, limits_by_amm.get(amm) if amm else None)
+
+        def violation(rule: str, index: int, limit: int, actual: int) -> Violation:
+            return Violation(
+                rule=rule,
+                parcel_id=parcel_id,
+                product=product,
+                amm=amm,
+                treatment_id=str(group[index].get("_id", "")),
+                treatment_date=days[index],
+                limit=limit,
+                actual=actual,
+            )
+
+        if limits.max_applications:
+            for index in range(limits.max_applications, len(group)):
+                report.violations.append(
+                    violation(RULE_MAX_APPLICATIONS, index, limits.max_applications, index + 1)
+                )
+
+        if limits.min_interval_days:
+            for index in range(1, len(days)):
+                gap = (days[index] - days[index - 1]).days
+                if gap < limits.min_interval_days:
+                    report.violations.append(violation(RULE_MIN_INTERVAL, index, limits.min_interval_days, gap))
+
+        harvest_safe = None
+        if limits.dar_days is not None:
+            harvest_safe = days[-1] + timedelta(days=limits.dar_days)
+            # Only the last application on or before harvest can be too close to it:
+            # earlier ones are further away and later ones are post-harvest work
+            last = bisect_right(days, harvest_date) - 1 if harvest_date else -1
+            if last >= 0:
+                before_harvest = (harvest_date - days[last]).days
+                if before_harvest < limits.dar_days:
+                    report.violations.append(violation(RULE_DAR, last, limits.dar_days, before_harvest))
+
+        report.products.append(
+            ProductSeason(
+                parcel_id=parcel_id,
+                product=product,
+                amm=amm,
+                applications=len(group),
+                first_application=days[0],
+                last_application=days[-1],
+                limits=limits,
+                harvest_safe_date=harvest_safe,
+            )
+        )
+
+    report.violations.sort(key=lambda v: (v.treatment_date, v.parcel_id, v.rule))
+    return report
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, Iterable, Mapping, Optional
+
+from pymongo import UpdateOne
+
+SCOPE_PARCEL = "parcel"
+SCOPE_ESTABLISHMENT = "establishment"
+
+
+@dataclass(frozen=True)
+class ReferenceDose:
+    dose: float
+    unit: str
+
+
+def parse_float(value: Any) -> Optional[float]:
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().replace(",", ".")
+    if not text:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def reference_doses(usages_by_amm: Mapping[str, Iterable[Mapping[str, Any]]]) -> dict[str, ReferenceDose]:
+    """Lowest per-hectare authorised vine dose of each product.
+
+    Doses expressed per hectolitre or per plant cannot be compared with the
+    per-hectare dose of the register; products with only such usages get no
+    reference and count as one full dose.
+    """
+    references: dict[str, ReferenceDose] = {}
+    for amm, usages in usages_by_amm.items():
+        best: Optional[ReferenceDose] = None
+        for usage in usages:
+            dose = parse_float(usage["dose"])
+            unit = (usage["dose_unite"] or "").strip()
+            if not dose or dose <= 0 or not unit.lower().endswith("/ha"):
+                continue
+            if best is None or dose < best.dose:
+                best = ReferenceDose(dose=dose, unit=unit)
+        if best:
+            references[amm] = best
+    return references
+
+
+def treatment_ift(
+    applied_dose: float,
+    treated_area_ha: Optional[float],
+    parcel_area_ha: Optional[float],
+    reference: Optional[ReferenceDose],
+) -> float:
+    """IFT of one application: (applied dose / reference dose) x (treated area / parcel area)."""
+    dose_ratio = applied_dose / reference.dose if reference else 1.0
+    area_ratio = 1.0
+    if parcel_area_ha and parcel_area_ha > 0 and treated_area_ha:
+        area_ratio = min(treated_area_ha / parcel_area_ha, 1.0)
+    return round(dose_ratio * area_ratio, 4)
+
+
+def season_of(day: date | datetime) -> int:
+    return day.year
+
+
+def _type_key(tip_tratament: Optional[str]) -> str:
+    # Field names end up in a Mongo document: no dots, no "$"
+    return re.sub(r"[^a-z0-9]+", "_", (tip_tratament or "autre").strip().lower()).strip("_") or "autre"
+
+
+def rollup_operations(
+    treatment: Mapping[str, Any],
+    ift: float,
+    parcel_area_ha: Optional[float],
+    sign: int = 1,
+) -> list[UpdateOne]:
+    """Upserts that fold one treatment into its parcel and establishment season rollups.
+
+    Parcel rollups hold the plain IFT sum; establishment rollups hold the
+    area-weighted sum and are divided by the farmed area when read. Both depend
+    on the parcel area the treatment was folded in with (the IFT itself does,
+    through the treated area ratio): deleting or resizing a parcel takes its
+    treatments back out with `sign=-1`, using the same IFT and area, before
+    folding them in again at the new area.
+    """
+    season = season_of(treatment["data_tratament"])
+    type_key = f"by_type.{_type_key(treatment.get('tip_tratament'))}"
+    ift = ift * sign
+    weighted = ift * (parcel_area_ha or 0.0)
+    now = datetime.utcnow()
+    common = {
+        "establishment_id": treatment.get("establishment_id"),
+        "user_id": treatment.get("user_id"),
+        "updated_at": now,
+    }
+    return [
+        UpdateOne(
+            {"scope": SCOPE_PARCEL, "scope_id": treatment["parcel_id"], "season": season},
+            {
+                "$inc": {"ift": ift, "ift_area": weighted, "treatments_count": sign, type_key: ift},
+                "$set": common,
+            },
+            upsert=sign > 0,
+        ),
+        UpdateOne(
+            {"scope": SCOPE_ESTABLISHMENT, "scope_id": treatment.get("establishment_id"), "season": season},
+            {
+                "$inc": {"ift_area": weighted, "treatments_count": sign, type_key: weighted},
+                "$set": common,
+            },
+            upsert=sign > 0,
+        ),
+    ]
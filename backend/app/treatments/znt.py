@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterable, Mapping, Optional
+
+import numpy as np
+import shapely
+from shapely.geometry import mapping, shape
+from shapely.strtree import STRtree
+
+from app.treatments.compliance import parse_int
+
+EARTH_RADIUS_M = 6_371_008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+
+@dataclass(frozen=True)
+class ZntDistances:
+    aquatique: int = 0
+    plantes: int = 0
+    arthropodes: int = 0
+
+    @property
+    def hedge(self) -> int:
+        # Hedges shelter both non-target plants and arthropods: the wider zone wins
+        return max(self.plantes, self.arthropodes)
+
+
+def distances_from_usages(usages: Iterable[Mapping[str, Any]]) -> ZntDistances:
+    """Widest ZNT of each type over every vine usage of a product.
+
+    As for the register limits, the usage a treatment is applied for is not
+    known, so the strictest authorisation applies.
+    """
+    widest = {"aquatique": 0, "plantes": 0, "arthropodes": 0}
+    for usage in usages:
+        for name in widest:
+            value = parse_int(usage[f"znt_{name}"])
+            if value and value > widest[name]:
+                widest[name] = value
+    return ZntDistances(**widest)
+
+
+@dataclass(frozen=True)
+class ZntResult:
+    parcel_area_ha: float
+    treatable_area_ha: float
+    excluded_area_ha: float
+    excluded_hydro_ha: float
+    excluded_hedge_ha: float
+    hydro_features: int
+    hedge_features: int
+    excluded_geometry: Optional[dict]
+
+
+class LocalProjection:
+    """Equirectangular projection to metres around a parcel.
+
+    Parcels span a few hundred metres, so the distortion is far below the
+    precision of the ZNT distances (5 m steps) and no CRS library is needed.
+    """
+
+    def __init__(self, lon0: float, lat0: float) -> None:
+        self.lon0 = lon0
+        self.lat0 = lat0
+        self.kx = METERS_PER_DEGREE * math.cos(math.radians(lat0))
+        self.ky = METERS_PER_DEGREE
+
+    def forward(self, geom):
+        origin = np.array([self.lon0, self.lat0])
+        scale = np.array([self.kx, self.ky])
+        return shapely.transform(geom, lambda coords: (coords - origin) * scale)
+
+    def inverse(self, geom):
+        origin = np.array([self.lon0, self.lat0])
+        scale = np.array([self.kx, self.ky])
+        return shapely.transform(geom, lambda coords: coords / scale + origin)
+
+    def degrees(self, meters: float) -> float:
+        """Search radius in degrees that covers `meters` in every direction."""
+        return meters / min(self.kx, self.ky)
+
+
+class FeatureLayer:
+    """GeoJSON layer (WGS84) indexed with an STRtree, reloaded when the file changes."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self._geoms: list = []
+        self._tree: Optional[STRtree] = None
+
+    @property
+    def version(self) -> Optional[float]:
+        return self._mtime
+
+    def refresh(self) -> None:
+        try:
+            mtime = self.path.stat().st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime and (self._tree is not None or mtime is None):
+            return
+        with self._lock:
+            if mtime == self._mtime and (self._tree is not None or mtime is None):
+                return
+            geoms = []
+            if mtime is not None:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                features = data.get("features", []) if data.get("type") == "FeatureCollection" else [data]
+                for feature in features:
+                    geometry = feature.get("geometry") if feature.get("type") == "Feature" else feature
+                    if geometry:
+                        geoms.append(shape(geometry))
+            self._geoms = geoms
+            self._tree = STRtree(geoms) if geoms else None
+            self._mtime = mtime
+
+    def near(self, geom, distance_deg: float) -> list:
+        self.refresh()
+        if self._tree is None:
+            return []
+        hits = self._tree.query(geom, predicate="dwithin", distance=distance_deg)
+        return [self._geoms[i] for i in hits]
+
+
+def parcel_geometry(coordinates: Mapping[str, Any] | list) -> Any:
+    if isinstance(coordinates, list):
+        coordinates = {"type": "Polygon", "coordinates": coordinates}
+    geom = shape(coordinates)
+    return geom if geom.is_valid else geom.buffer(0)
+
+
+def parcel_version(coordinates: Any) -> str:
+    payload = json.dumps(coordinates, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _exclusion(parcel_m, features_deg: list, distance_m: int, projection: LocalProjection):
+    """Part of the parcel lying within `distance_m` of any feature.
+
+    Equivalent to buffering the parcel edge inward by the ZNT distance, but
+    only along the stretches that actually face water or a hedge.
+    """
+    if not features_deg or distance_m <= 0:
+        return None
+    buffered = shapely.union_all([projection.forward(f).buffer(distance_m) for f in features_deg])
+    zone = parcel_m.intersection(buffered)
+    return None if zone.is_empty else zone
+
+
+def compute_znt(
+    parcel_deg,
+    distances: ZntDistances,
+    hydro: FeatureLayer,
+    hedge: FeatureLayer,
+) -> ZntResult:
+    centroid = parcel_deg.centroid
+    projection = LocalProjection(centroid.x, centroid.y)
+    parcel_m = projection.forward(parcel_deg)
+
+    hydro_features = (
+        hydro.near(parcel_deg, projection.degrees(distances.aquatique)) if distances.aquatique > 0 else []
+    )
+    hedge_features = hedge.near(parcel_deg, projection.degrees(distances.hedge)) if distances.hedge > 0 else []
+
+    hydro_zone = _exclusion(parcel_m, hydro_features, distances.aquatique, projection)
+    hedge_zone = _exclusion(parcel_m, hedge_features, distances.hedge, projection)
+    zones = [zone for zone in (hydro_zone, hedge_zone) if zone is not None]
+    excluded = shapely.union_all(zones) if zones else None
+
+    parcel_area = parcel_m.area
+    excluded_area = excluded.area if excluded is not None else 0.0
+    return ZntResult(
+        parcel_area_ha=round(parcel_area / 10_000, 4),
+        treatable_area_ha=round(max(parcel_area - excluded_area, 0.0) / 10_000, 4),
+        excluded_area_ha=round(excluded_area / 10_000, 4),
+        excluded_hydro_ha=round(hydro_zone.area / 10_000, 4) if hydro_zone is not None else 0.0,
+        excluded_hedge_ha=round(hedge_zone.area / 10_000, 4) if hedge_zone is not None else 0.0,
+        hydro_features=len(hydro_features),
+        hedge_features=len(hedge_features),
+        excluded_geometry=mapping(projection.inverse(excluded)) if excluded is not None else None,
+    )
+
+
+class ZntEngine:
+    """ZNT computation with a bounded LRU of results.
+
+    Entries are keyed by parcel geometry version, distances and layer file
+    versions, so editing a parcel or replacing a layer never serves stale areas.
+    """
+
+    def __init__(self, hydro_path: Path, hedge_path: Path, cache_size: int = 512) -> None:
+        self.hydro = FeatureLayer(hydro_path)
+        self.hedge = FeatureLayer(hedge_path)
+        self.cache_size = cache_size
+        self._cache: OrderedDict[tuple, ZntResult] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compute(self, coordinates: Any, distances: ZntDistances) -> ZntResult:
+        # Refresh layers first so the key carries their current version
+        self.hydro.refresh()
+        self.hedge.refresh()
+        key = (parcel_version(coordinates), distances, self.hydro.version, self.hedge.version)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+
+        result = compute_znt(parcel_geometry(coordinates), distances, self.hydro, self.hedge)
+
+        with self._lock:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
@@ -0,0 +1,78 @@
+"""
+Benchmark for the NDVI/NDRE engine on a synthetic multispectral GeoTIFF
+Usage:
+    python benchmark_vegetation_indices.py                 # 10000 x 10000, 5 bands
+    python benchmark_vegetation_indices.py 4000            # smaller raster
+    python benchmark_vegetation_indices.py 10000 2048      # raster size, window size
+
+The source raster is written window by window, so generating it does not
+inflate the peak memory measured for the computation.
+"""
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+from app.imaging.indices import BandMap, compute_indices, iter_windows
+
+BANDS = 5
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def write_synthetic(path: Path, size: int) -> None:
+    profile = {
+        "driver": "GTiff",
+        "width": size,
+        "height": size,
+        "count": BANDS,
+        "dtype": "uint16",
+        "crs": "EPSG:2154",
+        "transform": from_origin(700000, 6600000, 0.05, 0.05),
+        "nodata": 0,
+        "tiled": True,
+        "blockxsize": 512,
+        "blockysize": 512,
+        "BIGTIFF": "YES",
+    }
+    rng = np.random.default_rng(42)
+    with rasterio.open(path, "w", **profile) as dst:
+        for window in iter_windows(size, size, 2048):
+            shape = (BANDS, int(window.height), int(window.width))
+            dst.write(rng.integers(1, 65535, size=shape, dtype=np.uint16), window=window)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    block_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+
+    with tempfile.TemporaryDirectory(prefix="bench-indices-") as workdir:
+        source = Path(workdir) / "source.tif"
+        print(f"Writing synthetic {size}x{size}x{BANDS} uint16 raster...")
+        started = time.perf_counter()
+        write_synthetic(source, size)
+        print(f"  {time.perf_counter() - started:.1f}s, {source.stat().st_size / 1024 ** 2:.0f} MB on disk")
+
+        baseline = peak_rss_mb()
+        print(f"Computing NDVI/NDRE with {block_size}px windows...")
+        started = time.perf_counter()
+        result = compute_indices(source, workdir, BandMap(), block_size=block_size)
+        elapsed = time.perf_counter() - started
+
+        megapixels = size * size / 1e6
+        print(f"  {elapsed:.1f}s ({megapixels / elapsed:.1f} Mpx/s)")
+        print(f"  peak RSS {peak_rss_mb():.0f} MB (before: {baseline:.0f} MB)")
+        for name, stats in result.stats.items():
+            print(f"  {name}: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -28,7 +28,7 @@ def test_phone_validation():
         is_valid = is_valid_phone(normalized)
         print(f"  {phone} -> {normalized} -> {'✅ Valid' if is_valid else '❌ Invalid'}")
 
-def test_verification_codes():
+async def test_verification_codes():
     """Test verification code generation and storage"""
     print("\n🧪 Testing verification codes...")
 
@@ -40,8 +40,8 @@ def test_verification_codes():
     phone = "+40700123456"
     code = "123456"
 
-    store_verification_code(phone, code)
-    retrieved = get_verification_code(phone)
+    await store_verification_code(phone, code)
+    retrieved = await get_verification_code(phone)
 
     if retrieved and retrieved['code'] == code:
         print("  ✅ Code storage and retrieval works")
@@ -50,7 +50,7 @@ def test_verification_codes():
 
     # Test non-existent phone
     fake_phone = "+40700999999"
-    fake_retrieved = get_verification_code(fake_phone)
+    fake_retrieved = await get_verification_code(fake_phone)
     if fake_retrieved is None:
         print("  ✅ Non-existent code returns None")
     else:
@@ -60,6 +60,6 @@ if __name__ == "__main__":
     print("🚀 Testing Phone Verification System\n")
 
     test_phone_validation()
-    test_verification_codes()
+    asyncio.run(test_verification_codes())
 
     print("\n✅ All tests completed!")
\ No newline at end of file
@@ -34,8 +34,14 @@ import app.routes.admin_global as admin_global_routes
 import app.routes.billing as billing_routes
 import app.routes.ephy as ephy_routes
 import app.routes.onboarding as onboarding_routes
+import app.routes.treatments as treatments_routes
+import app.imaging.pipeline as imaging_pipeline
+import app.core.scan_blobs as scan_blobs
+import app.core.upload_sessions as upload_sessions
+import app.core.virus_scan as virus_scan
 import app.core.authz_decorators as authz_decorators
 import app.core.capability_tokens as capability_tokens
+import app.core.rate_limiting as rate_limiting
 
 @pytest.fixture(autouse=True)
 async def patch_test_db():
@@ -58,8 +64,14 @@ async def patch_test_db():
         billing_routes,
         ephy_routes,
         onboarding_routes,
+        treatments_routes,
+        imaging_pipeline,
+        scan_blobs,
+        upload_sessions,
+        virus_scan,
         authz_decorators,
         capability_tokens,
+        rate_limiting,
     ]:
         module.db = database_module.db
 
@@ -1,8 +1,20 @@
 """
 Tests for authentication endpoints
 """
+import asyncio
+import threading
+import time
+
+import bcrypt
 import pytest
-from httpx import AsyncClient
+from fastapi import Depends, FastAPI, HTTPException
+from httpx import ASGITransport, AsyncClient
+from jose import jwt
+
+import app.routes.auth as auth_routes
+from app.core import config, security
+from app.core.password_hashing import PasswordHasher, password_hasher
+from app.core.tenancy import tenant_middleware
 
 @pytest.mark.asyncio
 async def test_register_user(client: AsyncClient, test_user):
@@ -68,3 +80,105 @@ async def test_get_current_user_invalid_token(client: AsyncClient):
     """Test get current user with invalid token"""
     response = await client.get("/me", headers={"Authorization": "Bearer invalid_token"})
     assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_login_upgrades_legacy_hash(client: AsyncClient, monkeypatch):
+    """A hash with an old scheme/cost is replaced on the first successful login"""
+    monkeypatch.setattr(password_hasher, "rounds", 5)
+    legacy = bcrypt.hashpw(b"Password123", bcrypt.gensalt(rounds=4, prefix=b"2a")).decode()
+    await auth_routes.db["users"].insert_one({"username": "legacy@vitiscan.com", "password": legacy, "role": "user"})
+
+    response = await client.post("/login", json={"username": "legacy@vitiscan.com", "password": "Password123"})
+    assert response.status_code == 200
+
+    user = await auth_routes.db["users"].find_one({"username": "legacy@vitiscan.com"})
+    assert user["password"].startswith("$2b$05$")
+    assert bcrypt.checkpw(b"Password123", user["password"].encode())
+    assert not password_hasher.needs_rehash(user["password"])
+
+
+@pytest.mark.asyncio
+async def test_password_hasher_rejects_beyond_admission_limit():
+    """Calls past max_pending fail fast with a 503 instead of queueing"""
+    hasher = PasswordHasher(rounds=4, workers=1, max_pending=2)
+    release = threading.Event()
+    blocked = [asyncio.create_task(hasher._submit(release.wait, 5)) for _ in range(2)]
+    await asyncio.sleep(0.05)
+    assert hasher.stats()["in_flight"] == 1 and hasher.stats()["queued"] == 1
+
+    with pytest.raises(HTTPException) as rejected:
+        await hasher.hash("Password123")
+    assert rejected.value.status_code == 503 and rejected.value.headers["Retry-After"] == "1"
+
+    release.set()
+    await asyncio.gather(*blocked)
+    hashed = await hasher.hash("Password123")
+    assert await hasher.verify("Password123", hashed)
+    assert not await hasher.verify("Password123", "not-a-hash")
+    assert hasher.stats()["rejected"] == 1 and hasher.stats()["completed"] == 4
+    hasher.shutdown()
+
+
+def _counting_decode(monkeypatch) -> list:
+    calls = []
+    decode = security.jwt.decode
+
+    def counted(*args, **kwargs):
+        calls.append(args[0])
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(security.jwt, "decode", counted)
+    return calls
+
+
+def _tenant_app() -> FastAPI:
+    app = FastAPI()
+    app.middleware("http")(tenant_middleware)
+
+    @app.get("/me")
+    async def me(user: dict = Depends(security.get_current_user)):
+        return {"sub": user["sub"], "tenant_id": user.get("tenant_id")}
+
+    return app
+
+
+def _token(exp: float, **claims) -> str:
+    return jwt.encode({"sub": "u1", "exp": int(exp), **claims}, config.JWT_SECRET_KEY, algorithm=config.JWT_ALGORITHM)
+
+
+@pytest.mark.asyncio
+async def test_token_verified_once_across_tenancy_and_auth(monkeypatch):
+    """Middleware and dependency share one verification; later requests hit the cache"""
+    monkeypatch.setattr(security, "claims_cache", security.ClaimsCache(max_entries=0))
+    calls = _counting_decode(monkeypatch)
+    token = _token(time.time() + 600, tenant_id="est:1")
+
+    async with AsyncClient(transport=ASGITransport(app=_tenant_app()), base_url="http://test") as client:
+        response = await client.get("/me", headers={"Authorization": f"Bearer {token}"})
+        assert response.json() == {"sub": "u1", "tenant_id": "est:1"}
+        assert len(calls) == 1
+
+        monkeypatch.setattr(security, "claims_cache", security.ClaimsCache(max_entries=2))
+        for _ in range(3):
+            assert (await client.get("/me", headers={"Authorization": f"Bearer {token}"})).status_code == 200
+        assert len(calls) == 2 and security.claims_cache.stats()["hits"] == 2
+
+        expired = _token(time.time() - 1)
+        assert (await client.get("/me", headers={"Authorization": f"Bearer {expired}"})).status_code == 401
+
+
+def test_claims_cache_expires_with_token_and_stays_bounded(monkeypatch):
+    cache = security.ClaimsCache(max_entries=2)
+    now = time.time()
+    cache.put("a", {"sub": "a", "exp": now + 60})
+    cache.put("b", {"sub": "b", "exp": now + 60})
+    assert cache.get("a")["sub"] == "a"
+    cache.put("c", {"sub": "c", "exp": now + 60})
+    # "b" was least recently used
+    assert cache.get("b") is None and cache.get("a") is not None
+
+    monkeypatch.setattr(security.time, "time", lambda: now + 61)
+    assert cache.get("a") is None and cache.stats()["entries"] == 1
+    cache.put("no-exp", {"sub": "x"})
+    assert cache.get("no-exp") is None
@@ -0,0 +1,404 @@
+"""
+Tests for scan previews: tile pyramid rendering, vegetation indices, zonal
+statistics, metadata extraction and the post-upload pipeline
+"""
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import rasterio
+from PIL import Image
+from rasterio.transform import from_origin
+
+import app.imaging.pipeline as imaging_pipeline
+from app.imaging.indices import NDRE, NDVI, BandMap, compute_indices
+from app.imaging.metadata import extract_metadata
+from app.imaging.pyramid import THUMBNAIL_NAME, max_zoom_for, render_derivatives, tile_key
+from app.imaging.zonal import zonal_stats
+
+
+def _image_bytes(image: Image.Image, fmt: str) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def test_render_derivatives_builds_full_pyramid(tmp_path):
+    source = tmp_path / "source.png"
+    Image.new("RGB", (600, 300), (40, 120, 40)).save(source)
+
+    info, outputs = render_derivatives(str(source), str(tmp_path / "out"), tile_size=256, thumbnail_size=320)
+
+    assert info["max_zoom"] == max_zoom_for(600, 300, 256) == 2
+    # Level 2: 3x2 tiles, level 1: 2x1, level 0: 1x1
+    assert len(outputs) - 1 == 9
+    assert tile_key(2, 2, 1) in outputs
+    assert tile_key(0, 0, 0) in outputs
+
+    thumbnail = Image.open(tmp_path / "out" / THUMBNAIL_NAME)
+    assert max(thumbnail.size) <= 320
+    edge = Image.open(tmp_path / "out" / tile_key(2, 2, 1))
+    assert edge.size == (600 - 512, 300 - 256)
+
+
+def test_render_derivatives_stretches_16_bit_tiff(tmp_path):
+    image = Image.new("I;16", (64, 64))
+    image.putpixel((0, 0), 4000)
+    source = tmp_path / "source.tif"
+    image.save(source, format="TIFF")
+
+    info, outputs = render_derivatives(str(source), str(tmp_path / "out"), tile_size=256, thumbnail_size=32)
+
+    assert info["max_zoom"] == 0
+    assert Image.open(tmp_path / "out" / tile_key(0, 0, 0)).mode == "RGB"
+
+
+@pytest.mark.asyncio
+async def test_generate_scan_derivatives_stores_tiles(monkeypatch):
+    content = _image_bytes(Image.new("RGB", (300, 200), (200, 10, 10)), "JPEG")
+    stored = {}
+
+    async def fake_download(s3_key, path, bucket_type="main"):
+        with open(path, "wb") as dst:
+            dst.write(content)
+        return True, None
+
+    async def fake_upload(s3_key, path, content_type, cache_control=None, bucket_type="main"):
+        with open(path, "rb") as src:
+            stored[s3_key] = src.read()
+        return True, None
+
+    monkeypatch.setattr(imaging_pipeline.s3_storage, "download_to_path", fake_download)
+    monkeypatch.setattr(imaging_pipeline.s3_storage, "upload_path", fake_upload)
+    # Pillow in a thread: the spawn pool is exercised in production only
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(imaging_pipeline, "_get_pool", lambda: executor)
+
+    result = await imaging_pipeline.db["scans"].insert_one({
+        "s3_key": "scans/u/p/a.jpg",
+        "s3_bucket": "main",
+        "content_type": "image/jpeg",
+    })
+    await imaging_pipeline.generate_scan_derivatives(str(result.inserted_id))
+    executor.shutdown()
+
+    scan = await imaging_pipeline.db["scans"].find_one({"_id": result.inserted_id})
+    derivatives = scan["derivatives"]
+    assert derivatives["status"] == "ready"
+    assert derivatives["prefix"] == "scans/u/p/a.jpg.derived/"
+    assert derivatives["max_zoom"] == 1
+    assert derivatives["tiles"] == 3
+    assert stored["scans/u/p/a.jpg.derived/thumbnail.jpg"].startswith(b"\xff\xd8")
+    assert imaging_pipeline.tile_s3_key(scan, 1, 1, 0) in stored
+
+
+@pytest.mark.asyncio
+async def test_generate_scan_derivatives_skips_pdf():
+    result = await imaging_pipeline.db["scans"].insert_one({
+        "s3_key": "scans/u/p/a.pdf",
+        "content_type": "application/pdf",
+    })
+    await imaging_pipeline.generate_scan_derivatives(str(result.inserted_id))
+
+    scan = await imaging_pipeline.db["scans"].find_one({"_id": result.inserted_id})
+    assert scan["derivatives"]["status"] == "skipped"
+
+
+def _write_multispectral(path, width=300, height=200, bands=5):
+    data = np.zeros((bands, height, width), dtype=np.uint16)
+    data[:] = 500
+    data[2] = 1000  # red
+    if bands >= 4:
+        data[3] = 3000  # nir
+    if bands >= 5:
+        data[4] = 2000  # red edge
+    data[:, :10, :10] = 0  # nodata corner
+    with rasterio.open(
+        path, "w", driver="GTiff", width=width, height=height, count=bands, dtype="uint16",
+        crs="EPSG:2154", transform=from_origin(700000, 6600000, 0.1, 0.1), nodata=0
+    ) as dst:
+        dst.write(data)
+
+
+def test_compute_indices_windowed(tmp_path):
+    source = tmp_path / "scan.tif"
+    _write_multispectral(source)
+
+    # 128 px windows: the raster spans several windows in both directions
+    result = compute_indices(source, tmp_path, BandMap(red=3, nir=4, red_edge=5), block_size=128, tile_size=128)
+
+    assert set(result.outputs) == {NDVI, NDRE}
+    assert result.stats[NDVI]["valid_pixels"] == 300 * 200 - 100
+    assert result.stats[NDVI]["mean"] == pytest.approx(0.5)
+    assert result.stats[NDRE]["mean"] == pytest.approx(0.2)
+
+    with rasterio.open(result.outputs[NDVI]) as ndvi:
+        assert ndvi.profile["tiled"]
+        assert ndvi.block_shapes[0] == (128, 128)
+        assert ndvi.crs.to_string() == "EPSG:2154"
+        values = ndvi.read(1)
+    assert np.isnan(values[0, 0])
+    assert values[150, 250] == pytest.approx(0.5)
+
+
+def test_compute_indices_skips_missing_bands(tmp_path):
+    source = tmp_path / "scan.tif"
+    _write_multispectral(source, bands=4)
+
+    result = compute_indices(source, tmp_path, BandMap(red=3, nir=4, red_edge=5))
+
+    assert set(result.outputs) == {NDVI}
+    rgb = tmp_path / "rgb.tif"
+    _write_multispectral(rgb, bands=3)
+    assert compute_indices(rgb, tmp_path, BandMap()).outputs == {}
+
+
+@pytest.mark.asyncio
+async def test_generate_scan_indices_stores_layers(tmp_path, monkeypatch):
+    original = tmp_path / "original.tif"
+    _write_multispectral(original)
+    uploaded = {}
+
+    async def fake_download(s3_key, path, bucket_type="main"):
+        with open(original, "rb") as src, open(path, "wb") as dst:
+            dst.write(src.read())
+        return True, None
+
+    async def fake_upload(s3_key, path, content_type, cache_control=None, bucket_type="main"):
+        with rasterio.open(path) as raster:
+            uploaded[s3_key] = raster.count
+        return True, None
+
+    monkeypatch.setattr(imaging_pipeline.s3_storage, "download_to_path", fake_download)
+    monkeypatch.setattr(imaging_pipeline.s3_storage, "upload_path", fake_upload)
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(imaging_pipeline, "_get_pool", lambda: executor)
+
+    result = await imaging_pipeline.db["scans"].insert_one({
+        "s3_key": "scans/u/p/field.tif",
+        "s3_bucket": "main",
+        "content_type": "image/tiff",
+    })
+    await imaging_pipeline.generate_scan_indices(str(result.inserted_id))
+    executor.shutdown()
+
+    scan = await imaging_pipeline.db["scans"].find_one({"_id": result.inserted_id})
+    indices = scan["indices"]
+    assert indices["status"] == "ready"
+    assert indices["band_count"] == 5
+    assert indices["layers"]["ndvi"]["mean"] == pytest.approx(0.5)
+    assert set(uploaded) == {"scans/u/p/field.tif.derived/ndvi.tif", "scans/u/p/field.tif.derived/ndre.tif"}
+
+
+PARCEL_GEOMETRY = {
+    "type": "Polygon",
+    "coordinates": [[[24.5, 45.58], [24.515, 45.58], [24.515, 45.6], [24.5, 45.6], [24.5, 45.58]]],
+}
+
+
+def _write_index_raster(path):
+    # 300 x 200 px of 0.0001 deg; the parcel covers the left half
+    values = np.full((200, 300), 0.9, dtype=np.float32)
+    values[:100, :150] = 0.7
+    values[100:, :150] = 0.1
+    values[0, 0] = np.nan
+    with rasterio.open(
+        path, "w", driver="GTiff", width=300, height=200, count=1, dtype="float32",
+        crs="EPSG:4326", transform=from_origin(24.5, 45.6, 0.0001, 0.0001), nodata=float("nan")
+    ) as dst:
+        dst.write(values, 1)
+
+
+def test_zonal_stats_inside_parcel_only(tmp_path):
+    raster = tmp_path / "ndvi.tif"
+    _write_index_raster(raster)
+
+    stats = zonal_stats(raster, PARCEL_GEOMETRY, NDVI, block_size=64)
+
+    assert stats.pixel_count == 150 * 200 - 1
+    assert stats.max == pytest.approx(0.7)
+    assert stats.mean == pytest.approx(0.4, abs=1e-3)
+    assert stats.percentiles["p10"] == pytest.approx(0.1, abs=0.005)
+    assert stats.percentiles["p90"] == pytest.approx(0.7, abs=0.005)
+    classes = {item["label"]: item for item in stats.vigour_classes}
+    assert classes["tres_faible"]["pixels"] == 150 * 100
+    assert classes["forte"]["pixels"] == 150 * 100 - 1
+    assert classes["tres_forte"]["pixels"] == 0
+    assert sum(item["count"] for item in stats.histogram) == stats.pixel_count
+    # 0.0001 deg ~ 11.1 m x 7.8 m at 45.6 N
+    assert stats.area_ha == pytest.approx(260, rel=0.05)
+
+
+def test_zonal_stats_parcel_outside_raster(tmp_path):
+    raster = tmp_path / "ndvi.tif"
+    _write_index_raster(raster)
+    elsewhere = {
+        "type": "Polygon",
+        "coordinates": [[[2.0, 48.0], [2.01, 48.0], [2.01, 48.01], [2.0, 48.0]]],
+    }
+
+    stats = zonal_stats(raster, elsewhere, NDVI)
+
+    assert stats.pixel_count == 0
+    assert stats.mean is None
+
+
+@pytest.mark.asyncio
+async def test_compute_scan_zonal_stats_is_cached_per_parcel_version(tmp_path, monkeypatch):
+    raster = tmp_path / "source-ndvi.tif"
+    _write_index_raster(raster)
+
+    async def fake_download(s3_key, path, bucket_type="main"):
+        with open(raster, "rb") as src, open(path, "wb") as dst:
+            dst.write(src.read())
+        return True, None
+
+    monkeypatch.setattr(imaging_pipeline.s3_storage, "download_to_path", fake_download)
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(imaging_pipeline, "_get_pool", lambda: executor)
+
+    parcel = {"_id": "p1", "coordinates": PARCEL_GEOMETRY["coordinates"]}
+    scan = {"_id": "s1", "s3_key": "scans/u/p/field.tif", "user_id": "u"}
+    doc = await imaging_pipeline.compute_scan_zonal_stats(scan, parcel, NDVI)
+    await imaging_pipeline.compute_scan_zonal_stats(scan, parcel, NDVI)
+    executor.shutdown()
+
+    stored = await imaging_pipeline.db["scan_zonal_stats"].find({"scan_id": "s1"}).to_list(length=None)
+    assert len(stored) == 1
+    assert stored[0]["parcel_version"] == doc["parcel_version"]
+    assert stored[0]["mean"] == pytest.approx(0.4, abs=1e-3)
+
+
+@pytest.mark.asyncio
+async def test_vigour_series_keeps_last_two_points_and_delta():
+    from datetime import datetime
+
+    parcel = {"_id": "p1", "establishment_id": "e1", "coordinates": PARCEL_GEOMETRY["coordinates"]}
+
+    async def record(scan_id, day, mean):
+        scan = {"_id": scan_id, "user_id": "u", "uploaded_at": datetime(2026, 6, day)}
+        stats = {"mean": mean, "median": mean, "percentiles": {"p10": mean - 0.1, "p90": mean + 0.1},
+                 "pixel_count": 100, "vigour_classes": [{"label": "faible", "fraction": 0.25}]}
+        await imaging_pipeline._store_zonal_stats(scan, parcel, NDVI, stats)
+
+    await record("s2", 20, 0.55)
+    await record("s1", 5, 0.7)
+    # Recomputing a scan (parcel redrawn) replaces its point
+    await record("s2", 20, 0.5)
+
+    series = await imaging_pipeline.db["vigour_series"].find_one({"parcel_id": "p1", "season": 2026, "index": NDVI})
+    assert [point["scan_id"] for point in series["points"]] == ["s1", "s2"]
+    assert series["last"]["scan_id"] == "s2"
+    assert series["previous"]["scan_id"] == "s1"
+    assert series["delta"] == pytest.approx(-0.2)
+    assert series["points"][0]["low_vigour_fraction"] == 0.25
+
+
+def _drone_jpeg() -> bytes:
+    image = Image.new("RGB", (64, 48), (90, 140, 60))
+    exif = image.getexif()
+    exif[0x010F] = "DJI"
+    exif[0x0110] = "FC6360"
+    exif.get_ifd(0x8769)[0x9003] = "2025:06:14 10:32:05"
+    exif.get_ifd(0x8825).update({1: "N", 2: (45.0, 33.0, 36.0), 3: "E", 4: (24.0, 30.0, 0.0), 5: b"\x00", 6: 120.5})
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", exif=exif)
+    return buffer.getvalue()
+
+
+def test_extract_metadata_from_exif(tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(_drone_jpeg())
+
+    metadata = extract_metadata(str(path), "image/jpeg")
+
+    assert metadata.sensor == "DJI FC6360"
+    assert metadata.captured_at.isoformat() == "2025-06-14T10:32:05"
+    assert metadata.location == {"type": "Point", "coordinates": [24.5, 45.56]}
+    assert metadata.altitude_m == 120.5
+    assert (metadata.width, metadata.height, metadata.band_count) == (64, 48, 3)
+    assert metadata.footprint is None
+
+
+def test_extract_metadata_from_geotiff(tmp_path):
+    path = tmp_path / "field.tif"
+    _write_multispectral(path)
+
+    metadata = extract_metadata(str(path), "image/tiff")
+
+    assert metadata.band_count == 5 and metadata.crs == "EPSG:2154"
+    ring = metadata.footprint["coordinates"][0]
+    assert ring[0] == ring[-1] and len(ring) == 5
+    # 30 m x 20 m in Lambert-93, reprojected to longitude/latitude in France
+    longitudes = [x for x, _ in ring]
+    assert 0 < min(longitudes) < max(longitudes) < 10
+    assert metadata.location["type"] == "Point"
+
+
+def _ranged_reads(monkeypatch, content: bytes) -> list:
+    reads = []
+
+    async def fake_read_range(s3_key, start, end, bucket_type="main"):
+        reads.append((start, end))
+        return True, content[start:end + 1], None
+
+    monkeypatch.setattr(imaging_pipeline.s3_storage, "read_range", fake_read_range)
+    return reads
+
+
+@pytest.mark.asyncio
+async def test_extract_scan_metadata_stores_indexed_fields(tmp_path, monkeypatch):
+    content = _drone_jpeg()
+    reads = _ranged_reads(monkeypatch, content)
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(imaging_pipeline, "_get_pool", lambda: executor)
+
+    result = await imaging_pipeline.db["scans"].insert_one({
+        "s3_key": "scans/u/p/photo.jpg",
+        "s3_bucket": "main",
+        "content_type": "image/jpeg",
+        "file_size": len(content),
+    })
+    await imaging_pipeline.extract_scan_metadata(str(result.inserted_id))
+    executor.shutdown()
+
+    assert reads == [(0, len(content) - 1)]
+    scan = await imaging_pipeline.db["scans"].find_one({"_id": result.inserted_id})
+    assert scan["sensor"] == "DJI FC6360"
+    assert scan["location"]["coordinates"] == [24.5, 45.56]
+    assert scan["metadata"]["status"] == "ready" and scan["metadata"]["band_count"] == 3
+    # No footprint for a plain photo: the field is absent, not null
+    assert "footprint" not in scan and "footprint" not in scan["metadata"]
+
+
+@pytest.mark.asyncio
+async def test_extract_scan_metadata_reads_only_the_tiff_headers(tmp_path, monkeypatch):
+    path = tmp_path / "field.tif"
+    _write_multispectral(path)
+    # Rewriting the georeferencing moves the IFD to the end of the file
+    with rasterio.open(path, "r+") as raster:
+        raster.crs = "EPSG:32635"
+    content = path.read_bytes()
+
+    reads = _ranged_reads(monkeypatch, content)
+    monkeypatch.setattr(imaging_pipeline.config, "IMAGING_HEADER_BYTES", 4096)
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(imaging_pipeline, "_get_pool", lambda: executor)
+
+    result = await imaging_pipeline.db["scans"].insert_one({
+        "s3_key": "scans/u/p/field.tif",
+        "s3_bucket": "main",
+        "content_type": "image/tiff",
+        "file_size": len(content),
+    })
+    await imaging_pipeline.extract_scan_metadata(str(result.inserted_id))
+    executor.shutdown()
+
+    # The leading bytes, then one read grown to the IFD near the end
+    assert len(reads) == 2 and reads[0] == (0, 4095) and reads[1][0] > len(content) // 2
+    assert sum(end - start + 1 for start, end in reads) <= 2 * 4096
+    scan = await imaging_pipeline.db["scans"].find_one({"_id": result.inserted_id})
+    assert scan["metadata"]["status"] == "ready"
+    assert scan["metadata"]["crs"] == "EPSG:32635" and scan["metadata"]["band_count"] == 5
+    assert scan["footprint"]["type"] == "Polygon"
@@ -131,3 +131,35 @@ async def test_delete_parcel(client: AsyncClient, auth_headers):
     get_response = await client.get(f"/parcels/by-establishment/{est_id}", headers=tenant_headers)
     assert get_response.status_code == 200
     assert all(p["id"] != parcel_id for p in get_response.json())
+
+
+@pytest.mark.asyncio
+async def test_parcel_overview(client: AsyncClient, auth_headers):
+    establishment = {"name": "Farm", "siret": "123456", "address": "Location", "surface_ha": 5}
+    est_response = await client.post("/establishments", json=establishment, headers=auth_headers)
+    est_id = est_response.json()["id"]
+    tenant_headers = _tenant_headers(auth_headers, est_id)
+
+    parcel = {
+        "name": "Overview",
+        "establishment_id": est_id,
+        "area_ha": 1.5,
+        "crop_type": "ViÈ›Äƒ de vie",
+        "coordinates": _coords(),
+    }
+    create_response = await client.post("/parcels", json=parcel, headers=tenant_headers)
+    parcel_id = create_response.json()["id"]
+
+    for day in ("2025-05-01", "2025-05-15", "2025-06-01"):
+        treatment = {"data_tratament": day, "tip_tratament": "Fungicid", "produs_utilizat": "Sulf", "doza_aplicata": 2}
+        await client.post(f"/parcels/{parcel_id}/treatments", json=treatment, headers=tenant_headers)
+
+    response = await client.get(
+        f"/parcels/{parcel_id}/overview", params={"treatments_limit": 2}, headers=tenant_headers
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["parcel"]["id"] == parcel_id
+    assert data["counts"]["treatments"] == 3
+    assert [t["data_tratament"] for t in data["treatments"]] == ["2025-06-01", "2025-05-15"]
+    assert data["scans"] == []
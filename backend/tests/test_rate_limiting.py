@@ -0,0 +1,168 @@
+"""
+Tests for the sliding window rate limiter and the per-plan policies
+"""
+import asyncio
+import copy
+import os
+import time
+
+import pytest
+from bson import ObjectId
+from httpx import AsyncClient
+from jose import jwt
+
+from app.core import config, rate_limiting
+from app.core.rate_limiting import (
+    QuotaManager, RateLimiter, RedisSlidingWindowLimiter, SlidingWindowLimiter, classify_route
+)
+from app.core.ttl_store import MemoryTTLStore
+
+# Point at a disposable Redis to run the shared limiter test against it too
+REDIS_URL = os.getenv("RATE_LIMIT_TEST_REDIS_URL")
+
+
+def test_sliding_window_weights_previous_window():
+    limiter = SlidingWindowLimiter()
+    # 10 requests at the end of window [0, 60)
+    for _ in range(10):
+        assert limiter.hit_now("ip", 10, 60, now=59).allowed
+    denied = limiter.hit_now("ip", 10, 60, now=59.5)
+    assert not denied.allowed and denied.remaining == 0
+    # 0.5 s to the boundary, then 6 s of the next window for 1/10 of the old count to slide out
+    assert denied.retry_after == pytest.approx(6.5)
+
+    # 45 s into the next window a quarter of the previous one still counts: 2.5 -> 7 free slots
+    assert [limiter.hit_now("ip", 10, 60, now=105).allowed for _ in range(8)] == [True] * 7 + [False]
+    # Two windows later nothing is left
+    assert limiter.hit_now("ip", 10, 60, now=300).remaining == 9
+
+
+def test_limiter_state_is_constant_and_idle_keys_are_evicted():
+    limiter = SlidingWindowLimiter(max_keys=1000)
+    for i in range(10_000):
+        limiter.hit_now("busy", 1_000_000, 60, now=i / 100)
+    assert len(limiter) == 1 and len(limiter._state["busy"]) == 4
+
+    for i in range(50):
+        limiter.hit_now(f"ip-{i}", 100, 60, now=100)
+    assert len(limiter) == 51
+    # Idle for two windows: dropped as soon as another key is hit
+    limiter.hit_now("busy", 1_000_000, 60, now=221)
+    assert len(limiter) == 1
+
+    for i in range(1500):
+        limiter.hit_now(f"scan-{i}", 100, 60, now=300)
+    assert len(limiter) == 1000 and "scan-1499" in limiter._state
+
+
+def test_rate_limiter_helpers(monkeypatch):
+    monkeypatch.setattr(rate_limiting, "_local_limiter", SlidingWindowLimiter())
+    assert all(RateLimiter.check_rate_limit("k", max_requests=3, window_seconds=60) for _ in range(3))
+    assert not RateLimiter.check_rate_limit("k", max_requests=3, window_seconds=60)
+    assert RateLimiter.get_remaining("k", max_requests=3, window_seconds=60) == 0
+    assert RateLimiter.get_remaining("other", max_requests=3, window_seconds=60) == 3
+
+
+@pytest.mark.asyncio
+async def test_redis_limiter_is_atomic_across_clients():
+    if not REDIS_URL:
+        pytest.skip("RATE_LIMIT_TEST_REDIS_URL not set")
+    workers = [RedisSlidingWindowLimiter(REDIS_URL, prefix=f"vitiscan-test:{os.getpid()}:") for _ in range(4)]
+    results = await asyncio.gather(*(workers[i % 4].hit("ip", 25, 60) for i in range(100)))
+    assert sum(result.allowed for result in results) == 25
+    for worker in workers:
+        await worker.close()
+
+
+def test_classify_route():
+    assert classify_route("POST", "/login") == "auth"
+    assert classify_route("POST", "/password-reset/confirm") == "auth"
+    assert classify_route("GET", "/scans/by-parcel/p1") == "read"
+    assert classify_route("GET", "/scans/search") == "read"
+    assert classify_route("GET", "/scans/s1/tiles/3/1/2") == "read"
+    assert classify_route("GET", "/scans/s1") == "download"
+    assert classify_route("GET", "/scans/s1/download-url") == "download"
+    assert classify_route("GET", "/scans/s1/indices/ndvi") == "download"
+    assert classify_route("GET", "/scans/s1/indices") == "read"
+    assert classify_route("GET", "/scans/archive") == "export"
+    assert classify_route("GET", "/parcels/p1/export") == "export"
+    assert classify_route("POST", "/scans/p1/upload-batch") == "upload"
+    assert classify_route("PUT", "/scans/upload-sessions/u1/chunks/3") == "upload"
+    assert classify_route("DELETE", "/scans/s1") == "write"
+    assert classify_route("GET", "/health/metrics") is None
+    assert classify_route("OPTIONS", "/parcels") is None
+
+
+@pytest.fixture
+def policies(monkeypatch):
+    """Tiny limits and fresh state, with rate limiting switched back on"""
+    plans = copy.deepcopy(QuotaManager.PLANS)
+    plans["free"]["rate_limits"].update(read=3, download=5, export=1)
+    plans["pro"]["rate_limits"].update(read=5)
+    monkeypatch.setattr(QuotaManager, "PLANS", plans)
+    monkeypatch.setattr(rate_limiting, "rate_limiter", SlidingWindowLimiter())
+    monkeypatch.setattr(rate_limiting, "_subjects", MemoryTTLStore())
+    monkeypatch.setattr(rate_limiting.limiter, "enabled", True)
+
+
+def _bearer(user_id: str) -> dict:
+    token = jwt.encode(
+        {"sub": user_id, "role": "user", "exp": int(time.time()) + 600},
+        config.JWT_SECRET_KEY,
+        algorithm=config.JWT_ALGORITHM
+    )
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.mark.asyncio
+async def test_anonymous_reads_are_limited_by_ip(client: AsyncClient, policies):
+    for remaining in (2, 1, 0):
+        response = await client.get("/parcels")
+        assert response.headers["RateLimit-Limit"] == "3"
+        assert response.headers["RateLimit-Remaining"] == str(remaining)
+    response = await client.get("/parcels")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert response.headers["RateLimit-Policy"] == '3;w=60;comment="read"'
+    # Exempt and separately budgeted routes are unaffected
+    assert (await client.get("/health/metrics")).status_code != 429
+    assert (await client.get("/scans/archive")).status_code != 429
+
+
+@pytest.mark.asyncio
+async def test_establishment_members_share_the_plan_budget(client: AsyncClient, policies):
+    db = rate_limiting.db
+    owner, member, outsider = (str(ObjectId()) for _ in range(3))
+    await db["users"].insert_many([
+        {"_id": ObjectId(owner), "plan": "pro"},
+        {"_id": ObjectId(member)},
+        {"_id": ObjectId(outsider)},
+    ])
+    establishment = await db["establishments"].insert_one({"name": "Domaine", "user_id": owner})
+    establishment_id = str(establishment.inserted_id)
+    await db["establishment_members"].insert_one(
+        {"establishment_id": establishment_id, "user_id": member, "is_active": True}
+    )
+    tenant = {"X-Tenant-Id": f"est:{establishment_id}"}
+
+    # Owner and member draw on the establishment's pro budget together
+    statuses = [
+        (await client.get("/parcels", headers={**_bearer(user), **tenant})).status_code
+        for user in (owner, member, owner, member, owner, member)
+    ]
+    assert statuses.count(429) == 1 and statuses[-1] == 429
+
+    # Claiming someone else's establishment only gets the caller's own free budget
+    response = await client.get("/parcels", headers={**_bearer(outsider), **tenant})
+    assert response.headers["RateLimit-Limit"] == "3" and response.headers["RateLimit-Remaining"] == "2"
+
+
+@pytest.mark.asyncio
+async def test_ranged_downloads_do_not_use_the_export_budget(client: AsyncClient, policies):
+    headers = {**_bearer(str(ObjectId())), "Range": "bytes=0-1023"}
+    responses = [await client.get("/scans/s1", headers=headers) for _ in range(4)]
+    assert all(response.status_code != 429 for response in responses)
+    assert responses[-1].headers["RateLimit-Policy"] == '5;w=60;comment="download"'
+    assert responses[-1].headers["RateLimit-Remaining"] == "1"
+    # The archive export keeps its own, smaller budget
+    assert (await client.get("/scans/archive", headers=headers)).headers["RateLimit-Limit"] == "1"
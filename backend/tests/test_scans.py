@@ -1,10 +1,16 @@
 """
 Tests for scan upload endpoint
 """
+import asyncio
+import io
+import time
+
 import pytest
 from httpx import AsyncClient
 from app.core.database import db
+import app.core.s3_storage as s3_storage_module
 import app.routes.scans as scans_routes
+from app.core.scan_cache import ScanCache
 
 
 def _tenant_headers(auth_headers: dict, establishment_id: str) -> dict:
@@ -39,10 +45,13 @@ async def _create_establishment_and_parcel(client: AsyncClient, auth_headers: di
 
 @pytest.mark.asyncio
 async def test_upload_scan_success(client: AsyncClient, auth_headers, monkeypatch):
-    async def fake_upload_file(*args, **kwargs):
-        return True, "scans/test/key.jpg", None
+    async def fake_upload_stream(chunks, *args, **kwargs):
+        size = 0
+        async for chunk in chunks:
+            size += len(chunk)
+        return True, "scans/test/key.jpg", size, None
 
-    monkeypatch.setattr(scans_routes.s3_storage, "upload_file", fake_upload_file)
+    monkeypatch.setattr(scans_routes.s3_storage, "upload_stream", fake_upload_stream)
 
     parcel_id, tenant_headers = await _create_establishment_and_parcel(client, auth_headers)
 
@@ -68,3 +77,623 @@ async def test_upload_scan_invalid_file(client: AsyncClient, auth_headers):
 
     response = await client.post(f"/scans/{parcel_id}/upload", files=files, headers=tenant_headers)
     assert response.status_code == 400
+
+
+class _FakeS3Client:
+    def __init__(self, fail_on_part: int | None = None):
+        self.fail_on_part = fail_on_part
+        self.parts = []
+        self.completed = None
+        self.aborted = False
+
+    def create_multipart_upload(self, **kwargs):
+        return {"UploadId": "upload-1"}
+
+    def upload_part(self, PartNumber, Body, **kwargs):
+        if PartNumber == self.fail_on_part:
+            raise s3_storage_module.ClientError(
+                {"Error": {"Code": "InternalError", "Message": "boom"}}, "UploadPart"
+            )
+        self.parts.append(len(Body))
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, MultipartUpload, **kwargs):
+        self.completed = MultipartUpload["Parts"]
+
+    def abort_multipart_upload(self, **kwargs):
+        self.aborted = True
+
+
+async def _chunks(count: int, size: int):
+    for _ in range(count):
+        yield b"x" * size
+
+
+@pytest.mark.asyncio
+async def test_upload_stream_sends_bounded_parts(monkeypatch):
+    storage = scans_routes.s3_storage
+    fake = _FakeS3Client()
+    monkeypatch.setattr(storage, "s3_v3", fake)
+    monkeypatch.setattr(s3_storage_module.config, "S3_MULTIPART_PART_SIZE", 5 * 1024 * 1024)
+
+    success, s3_key, size, error = await storage.upload_stream(
+        _chunks(12, 1024 * 1024), "big.tif", "image/tiff", "u1", "p1"
+    )
+
+    assert success and error is None
+    assert size == 12 * 1024 * 1024
+    assert fake.parts == [5 * 1024 * 1024, 5 * 1024 * 1024, 2 * 1024 * 1024]
+    assert [p["PartNumber"] for p in fake.completed] == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_upload_stream_aborts_on_failure(monkeypatch):
+    storage = scans_routes.s3_storage
+    fake = _FakeS3Client(fail_on_part=2)
+    monkeypatch.setattr(storage, "s3_v3", fake)
+
+    success, s3_key, _, error = await storage.upload_stream(
+        _chunks(12, 1024 * 1024), "big.tif", "image/tiff", "u1", "p1"
+    )
+    assert not success and s3_key is None and error
+    assert fake.aborted and fake.completed is None
+
+    async def too_large():
+        yield b"x" * 10
+        raise ValueError("too large")
+
+    fake = _FakeS3Client()
+    monkeypatch.setattr(storage, "s3_v3", fake)
+    with pytest.raises(ValueError):
+        await storage.upload_stream(too_large(), "a.tif", "image/tiff", "u1", "p1")
+    assert fake.aborted
+
+
+class _SlowS3Client:
+    def put_object(self, **kwargs):
+        time.sleep(0.3)
+
+    def get_object(self, **kwargs):
+        time.sleep(0.3)
+        return {"Body": io.BytesIO(b"data"), "ContentType": "image/tiff"}
+
+
+@pytest.mark.asyncio
+async def test_s3_transfers_do_not_block_other_requests(client: AsyncClient, monkeypatch):
+    storage = scans_routes.s3_storage
+    monkeypatch.setattr(storage, "s3_v3", _SlowS3Client())
+
+    async def probe_latencies():
+        latencies = []
+        for _ in range(10):
+            started = time.perf_counter()
+            response = await client.get("/")
+            assert response.status_code == 200
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(0.02)
+        return latencies
+
+    transfers = [storage.upload_file(b"x", "a.tif", "image/tiff", "u1", "p1") for _ in range(4)]
+    transfers += [storage.download_file("scans/u1/p1/a.tif") for _ in range(4)]
+    results = await asyncio.gather(probe_latencies(), *transfers)
+
+    # Eight 300 ms blocking calls would stall the loop for 2.4 s without the pool
+    assert max(results[0]) < 0.2
+    assert all(result[0] for result in results[1:])
+
+
+@pytest.mark.asyncio
+async def test_presigned_upload_policy_pins_type_and_size(monkeypatch):
+    captured = {}
+
+    class _PresignClient:
+        def generate_presigned_post(self, **kwargs):
+            captured.update(kwargs)
+            return {"url": "https://s3.example", "fields": {"key": kwargs["Key"], **kwargs["Fields"]}}
+
+    storage = scans_routes.s3_storage
+    monkeypatch.setattr(storage, "s3_v3", _PresignClient())
+
+    success, presigned, error = await storage.presigned_upload(
+        "scans/u1/p1/a.tif", "image/tiff", max_size=1024, expires_in=60, metadata={"user_id": "u1"}
+    )
+
+    assert success and error is None
+    assert presigned["fields"]["Content-Type"] == "image/tiff"
+    assert ["content-length-range", 1, 1024] in captured["Conditions"]
+    assert {"x-amz-meta-user_id": "u1"} in captured["Conditions"]
+    assert captured["ExpiresIn"] == 60
+
+
+@pytest.mark.asyncio
+async def test_presigned_upload_with_checksum_is_confirmed_without_reading_it(monkeypatch):
+    import base64
+    import hashlib
+    from fastapi import BackgroundTasks
+
+    content = b"\xff\xd8\xff" + b"j" * 4096
+    sha = hashlib.sha256(content).hexdigest()
+    captured = {}
+
+    class _ChecksumS3Client:
+        def generate_presigned_post(self, **kwargs):
+            captured.update(kwargs)
+            return {"url": "https://s3.example", "fields": {"key": kwargs["Key"], **kwargs["Fields"]}}
+
+        def head_object(self, Bucket, Key, ChecksumMode=None):
+            checksum = base64.b64encode(bytes.fromhex(sha)).decode() if ChecksumMode == "ENABLED" else None
+            return {"ContentLength": len(content), "ContentType": "image/jpeg", "ETag": '"v1"', "ChecksumSHA256": checksum}
+
+        def get_object(self, Bucket, Key, Range=None, **kwargs):
+            # Only the signature check may read, and only the first bytes
+            assert Range == "bytes=0-15"
+            return {"Body": io.BytesIO(content[:16]), "ContentLength": 16, "ETag": '"v1"'}
+
+    monkeypatch.setattr(scans_routes.s3_storage, "s3_v3", _ChecksumS3Client())
+    parcel = await scans_routes.db["parcels"].insert_one({"name": "P", "user_id": "u-direct"})
+    user = {"sub": "u-direct"}
+
+    created = await scans_routes.create_presigned_upload(
+        str(parcel.inserted_id),
+        scans_routes.PresignedUploadRequest(filename="a.jpg", content_type="image/jpeg", sha256=sha.upper()),
+        user=user,
+    )
+    checksum = base64.b64encode(bytes.fromhex(sha)).decode()
+    assert created["fields"]["x-amz-checksum-sha256"] == checksum
+    assert {"x-amz-checksum-sha256": checksum} in captured["Conditions"]
+
+    confirmed = await scans_routes.confirm_presigned_upload(created["upload_id"], BackgroundTasks(), user=user)
+    assert confirmed["sha256"] == sha and not confirmed["deduplicated"]
+    scan = await scans_routes.db["scans"].find_one({"sha256": sha})
+    assert scan["file_size"] == len(content) and scan["etag"] == "v1"
+
+
+class _RangeS3Client:
+    def __init__(self, content: bytes):
+        self.content = content
+
+    def get_object(self, Bucket, Key, Range=None, IfNoneMatch=None):
+        if IfNoneMatch == '"v1"':
+            raise s3_storage_module.ClientError(
+                {"Error": {"Code": "304"}, "ResponseMetadata": {"HTTPHeaders": {"etag": '"v1"'}}}, "GetObject"
+            )
+        total = len(self.content)
+        if not Range:
+            return {"Body": io.BytesIO(self.content), "ContentLength": total, "ETag": '"v1"'}
+        start, end = Range[len("bytes="):].split("-")
+        start, end = int(start), min(int(end or total - 1), total - 1)
+        if start >= total:
+            raise s3_storage_module.ClientError({"Error": {"Code": "InvalidRange"}}, "GetObject")
+        return {
+            "Body": io.BytesIO(self.content[start:end + 1]),
+            "ContentLength": end - start + 1,
+            "ContentRange": f"bytes {start}-{end}/{total}",
+            "ETag": '"v1"',
+        }
+
+    def head_object(self, Bucket, Key, **kwargs):
+        return {"ContentLength": len(self.content)}
+
+
+@pytest.mark.asyncio
+async def test_open_stream_ranges_and_etag(monkeypatch):
+    storage = scans_routes.s3_storage
+    monkeypatch.setattr(storage, "s3_v3", _RangeS3Client(bytes(range(256)) * 40))
+
+    success, stream, _ = await storage.open_stream("k", byte_range="bytes=100-4195", chunk_size=1000)
+    chunks = [chunk async for chunk in stream["body"]]
+    assert success and stream["status"] == 206
+    assert stream["content_range"] == "bytes 100-4195/10240" and stream["total_size"] == 10240
+    assert [len(c) for c in chunks] == [1000, 1000, 1000, 1000, 96]
+    assert b"".join(chunks) == (bytes(range(256)) * 40)[100:4196]
+
+    _, stream, _ = await storage.open_stream("k", if_none_match='"v1"')
+    assert stream["status"] == 304 and stream["body"] is None
+
+    _, stream, _ = await storage.open_stream("k", byte_range="bytes=20000-")
+    assert stream["status"] == 416 and stream["total_size"] == 10240
+    assert scans_routes._single_byte_range("bytes=0-1,5-6") is None
+
+
+class _BlobS3Client:
+    def __init__(self):
+        self.objects = {"scans/a.jpg", "scans/a.jpg.derived/thumbnail.jpg", "scans/b.jpg"}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.discard(Key)
+
+    def list_objects_v2(self, Bucket, Prefix, **kwargs):
+        return {"Contents": [{"Key": key} for key in sorted(self.objects) if key.startswith(Prefix)]}
+
+    def delete_objects(self, Bucket, Delete):
+        for item in Delete["Objects"]:
+            self.objects.discard(item["Key"])
+
+
+@pytest.mark.asyncio
+async def test_duplicate_content_shares_one_refcounted_blob(monkeypatch):
+    fake = _BlobS3Client()
+    monkeypatch.setattr(scans_routes.s3_storage, "s3_v3", fake)
+    sha = "a" * 64
+
+    blob, deduplicated = await scans_routes._store_blob(sha, "scans/a.jpg", "main", 10, "image/jpeg", "u1")
+    assert not deduplicated and blob["ref_count"] == 1
+    # Same bytes uploaded again: the new object is dropped, the first one is referenced twice
+    blob, deduplicated = await scans_routes._store_blob(sha, "scans/b.jpg", "main", 10, "image/jpeg", "u1")
+    assert deduplicated and blob["s3_key"] == "scans/a.jpg" and blob["ref_count"] == 2
+    assert "scans/b.jpg" not in fake.objects
+
+    # Linking by hash is limited to content the user uploaded
+    assert await scans_routes.link_blob(sha, "u2") is None
+    assert (await scans_routes.link_blob(sha, "u1"))["ref_count"] == 3
+
+    assert not await scans_routes.release_blob(sha)
+    assert not await scans_routes.release_blob(sha)
+    assert "scans/a.jpg" in fake.objects
+    assert await scans_routes.release_blob(sha)
+    assert fake.objects == set()
+    assert await scans_routes.db["scan_blobs"].find_one({"_id": sha}) is None
+
+
+@pytest.mark.asyncio
+async def test_delete_scan_survives_legacy_rows_and_storage_errors(monkeypatch):
+    class _FailingS3Client:
+        def delete_object(self, Bucket, Key):
+            raise s3_storage_module.ClientError({"Error": {"Code": "InternalError"}}, "DeleteObject")
+
+        def list_objects_v2(self, **kwargs):
+            raise s3_storage_module.ClientError({"Error": {"Code": "InternalError"}}, "ListObjectsV2")
+
+    monkeypatch.setattr(scans_routes.s3_storage, "s3_v3", _FailingS3Client())
+    user = {"sub": "u-del"}
+    legacy = await scans_routes.db["scans"].insert_one({"user_id": "u-del", "file_data": b"old", "filename": "a.jpg"})
+    stored = await scans_routes.db["scans"].insert_one({"user_id": "u-del", "s3_key": "scans/u-del/b.jpg"})
+
+    for scan_id in (legacy.inserted_id, stored.inserted_id):
+        response = await scans_routes.delete_scan(str(scan_id), user=user)
+        assert response.status_code == 204
+    assert await scans_routes.db["scans"].count_documents({"user_id": "u-del"}) == 0
+    assert await scans_routes.db["audit_logs"].count_documents({"action": "scan.delete", "user_id": "u-del"}) == 2
+
+
+@pytest.mark.asyncio
+async def test_duplicate_inherits_only_ready_results():
+    from fastapi import BackgroundTasks
+
+    sha = "b" * 64
+    await scans_routes.db["scans"].insert_many([
+        {
+            "sha256": sha, "etag": "e1",
+            "derivatives": {"status": "ready", "levels": 3},
+            "indices": {"status": "pending"},
+            "metadata": {"status": "failed"}, "sensor": "stale",
+        },
+        {"sha256": sha, "metadata": {"status": "ready"}, "sensor": "DJI FC6360"},
+    ])
+
+    inherited = await scans_routes._inherited_results(sha)
+    assert inherited == {
+        "derivatives": {"status": "ready", "levels": 3}, "etag": "e1",
+        "metadata": {"status": "ready"}, "sensor": "DJI FC6360",
+    }
+    tasks = BackgroundTasks()
+    scans_routes._schedule_processing(tasks, "s1", inherited)
+    assert [task.func for task in tasks.tasks] == [scans_routes.generate_scan_indices]
+
+
+@pytest.mark.asyncio
+async def test_iter_upload_hashes_while_streaming():
+    import hashlib
+
+    class _File:
+        def __init__(self, data):
+            self.stream = io.BytesIO(data)
+
+        async def read(self, size):
+            return self.stream.read(size)
+
+    data = b"\xff\xd8\xff" + b"x" * 5000
+    digest = hashlib.sha256()
+    source = _File(data[10:])
+    chunks = [chunk async for chunk in scans_routes._iter_upload(source, data[:10], digest)]
+
+    assert b"".join(chunks) == data
+    assert digest.hexdigest() == hashlib.sha256(data).hexdigest()
+
+
+class _CountingStorage:
+    def __init__(self, objects: dict):
+        self.objects = objects
+        self.downloads = 0
+
+    async def download_to_path(self, s3_key, path, bucket_type="main"):
+        self.downloads += 1
+        await asyncio.sleep(0.05)
+        with open(path, "wb") as handle:
+            handle.write(self.objects[s3_key])
+        return True, None
+
+
+@pytest.mark.asyncio
+async def test_scan_cache_fills_in_background_lru_and_ranges(tmp_path):
+    content = bytes(range(256)) * 2
+    storage = _CountingStorage({"a": b"a" * 400, "b": b"b" * 400, "c": content})
+    cache = ScanCache(tmp_path, max_bytes=1000, storage=storage)
+
+    # Ten concurrent misses: none waits for the download (they stream from S3), one fill runs
+    started = time.perf_counter()
+    assert [cache.fetch("a", "v1") for _ in range(10)] == [None] * 10
+    assert time.perf_counter() - started < 0.05
+    await cache.fill("a", "v1")
+    assert storage.downloads == 1
+    handle = cache.fetch("a", "v1")
+    assert handle.read() == b"a" * 400
+    handle.close()
+    # A new ETag is a different entry
+    assert cache.fetch("a", "v2") is None
+    await cache.fill("a", "v2")
+    assert storage.downloads == 2
+
+    assert await cache.open_stream("c", "v1", byte_range="bytes=100-299") is None
+    await cache.fill("c", "v1")
+    stream = await cache.open_stream("c", "v1", byte_range="bytes=100-299", chunk_size=64)
+    assert stream["status"] == 206 and stream["content_range"] == "bytes 100-299/512"
+    # Evicted while the response is pending: the open handle still serves it
+    await cache.fill("b", "v1")
+    await cache.fill("a", "v1")
+    assert cache.cache_key("c", "v1") not in cache._entries
+    chunks = [chunk async for chunk in stream["body"]]
+    assert b"".join(chunks) == content[100:300]
+
+    await cache.fill("c", "v1")
+    stream = await cache.open_stream("c", "v1", byte_range="bytes=-12")
+    assert stream["content_range"] == "bytes 500-511/512"
+    assert b"".join([chunk async for chunk in stream["body"]]) == content[500:]
+    assert (await cache.open_stream("c", "v1", byte_range="bytes=600-"))["status"] == 416
+
+    stats = cache.stats()
+    assert stats["size_bytes"] <= 1000 and stats["evictions"] >= 2
+    assert stats["misses"] == 3 and stats["coalesced"] == 9 and stats["filling"] == 0
+    assert len(list(tmp_path.glob("*.bin"))) == stats["entries"]
+    # Objects larger than the cache are never stored
+    assert cache.fetch("b", "v1", size=5000) is None
+
+
+class _BatchS3Client(_FakeS3Client):
+    def __init__(self):
+        super().__init__()
+        self.concurrent = 0
+        self.peak = 0
+        self.deleted = []
+
+    def create_multipart_upload(self, **kwargs):
+        self.concurrent += 1
+        self.peak = max(self.peak, self.concurrent)
+        time.sleep(0.02)
+        return super().create_multipart_upload(**kwargs)
+
+    def complete_multipart_upload(self, MultipartUpload, **kwargs):
+        self.concurrent -= 1
+
+    def delete_object(self, Bucket, Key):
+        self.deleted.append(Key)
+
+
+@pytest.mark.asyncio
+async def test_upload_batch_reports_per_file_and_audits_once(monkeypatch):
+    from fastapi import BackgroundTasks, UploadFile
+    from starlette.datastructures import Headers
+
+    fake = _BatchS3Client()
+    monkeypatch.setattr(scans_routes.s3_storage, "s3_v3", fake)
+    monkeypatch.setattr(scans_routes, "SCAN_BATCH_CONCURRENCY", 3)
+    parcel = await scans_routes.db["parcels"].insert_one({"name": "P", "user_id": "u-batch"})
+
+    def upload(name, data, content_type="image/jpeg"):
+        return UploadFile(
+            io.BytesIO(data), size=len(data), filename=name, headers=Headers({"content-type": content_type})
+        )
+
+    files = [upload(f"img{i}.jpg", b"\xff\xd8\xff" + bytes([i]) * 64) for i in range(8)]
+    files.append(upload("copy.jpg", b"\xff\xd8\xff" + bytes([0]) * 64))
+    files.append(upload("bad.jpg", b"GIF89a"))
+    tasks = BackgroundTasks()
+
+    response = await scans_routes.upload_scan_batch(
+        str(parcel.inserted_id), tasks, files=files, user={"sub": "u-batch"}
+    )
+
+    assert response["uploaded"] == 9 and response["failed"] == 1
+    assert [item["status"] for item in response["results"]][-1] == "rejected"
+    assert response["results"][-1]["status_code"] == 400
+    assert response["results"][8]["deduplicated"] and len(fake.deleted) == 1
+    assert fake.peak <= 3
+    assert await scans_routes.db["scans"].count_documents({"user_id": "u-batch"}) == 9
+    audits = await scans_routes.db["audit_logs"].find({"action": {"$regex": "^scan\\."}, "user_id": "u-batch"}).to_list(None)
+    assert len(audits) == 1 and audits[0]["outcome"] == "partial"
+
+
+@pytest.mark.asyncio
+async def test_failed_scan_insert_gives_the_blob_back(monkeypatch):
+    from fastapi import BackgroundTasks, HTTPException, UploadFile
+    from starlette.datastructures import Headers
+
+    fake = _BatchS3Client()
+    monkeypatch.setattr(scans_routes.s3_storage, "s3_v3", fake)
+    parcel_id = str((await scans_routes.db["parcels"].insert_one({"name": "P", "user_id": "u-leak"})).inserted_id)
+    # Any insert of a taken filename fails after the blob reference was claimed
+    await scans_routes.db["scans"].create_index("filename", unique=True)
+    await scans_routes.db["scans"].insert_one({"filename": "taken.jpg", "user_id": "other"})
+
+    def upload(name, data):
+        return UploadFile(
+            io.BytesIO(data), size=len(data), filename=name, headers=Headers({"content-type": "image/jpeg"})
+        )
+
+    with pytest.raises(HTTPException) as failed:
+        await scans_routes.upload_scan(
+            parcel_id, BackgroundTasks(), file=upload("taken.jpg", b"\xff\xd8\xff" + b"1" * 64), user={"sub": "u-leak"}
+        )
+    assert failed.value.status_code == 500
+    assert await scans_routes.db["scan_blobs"].count_documents({}) == 0
+    assert len(fake.deleted) == 1
+
+    files = [upload("fresh.jpg", b"\xff\xd8\xff" + b"2" * 64), upload("taken.jpg", b"\xff\xd8\xff" + b"3" * 64)]
+    response = await scans_routes.upload_scan_batch(parcel_id, BackgroundTasks(), files=files, user={"sub": "u-leak"})
+
+    assert response["uploaded"] == 1 and response["failed"] == 1
+    assert [item["status"] for item in response["results"]] == ["uploaded", "failed"]
+    blobs = await scans_routes.db["scan_blobs"].find().to_list(None)
+    assert [blob["ref_count"] for blob in blobs] == [1]
+    assert blobs[0]["_id"] == (await scans_routes.db["scans"].find_one({"filename": "fresh.jpg"}))["sha256"]
+
+
+@pytest.mark.asyncio
+async def test_upload_session_progress_and_expiry(monkeypatch):
+    from datetime import datetime, timedelta
+    from app.core import upload_sessions
+
+    session = {"file_size": 25, "chunk_size": 10, "total_chunks": upload_sessions.chunk_count(25, 10), "parts": {}}
+    assert session["total_chunks"] == 3
+    assert [upload_sessions.expected_chunk_size(session, n) for n in (0, 1, 3, 4)] == [None, 10, 5, None]
+    # Chunks 1 and 3 in: a sequential client resumes at byte 10, chunk 2 is missing
+    session["parts"] = {"1": {"size": 10}, "3": {"size": 5}}
+    progress = upload_sessions.session_progress(session)
+    assert progress["offset"] == 10 and progress["missing_chunks"] == [2] and progress["received_bytes"] == 15
+
+    aborted = []
+    deleted = []
+
+    class _AbortS3Client:
+        def abort_multipart_upload(self, Bucket, Key, UploadId):
+            aborted.append(UploadId)
+
+        def delete_object(self, Bucket, Key):
+            deleted.append(Key)
+
+    monkeypatch.setattr(scans_routes.s3_storage, "s3_v3", _AbortS3Client())
+    now = datetime.utcnow()
+    sessions = upload_sessions.db[upload_sessions.SESSIONS_COLLECTION]
+    await sessions.insert_many([
+        {"status": "open", "s3_key": "k1", "s3_upload_id": "stale", "expires_at": now - timedelta(hours=1)},
+        {"status": "open", "s3_key": "k2", "s3_upload_id": "active", "expires_at": now + timedelta(hours=1)},
+        {"status": "completing", "s3_key": "k3", "s3_upload_id": "finalising", "updated_at": now,
+         "expires_at": now - timedelta(hours=1)},
+        # Interrupted finalisations: one whose object a blob already owns
+        {"status": "completing", "s3_key": "k4", "s3_upload_id": "crashed", "updated_at": now - timedelta(hours=2)},
+        {"status": "completing", "s3_key": "k5", "s3_upload_id": "crashed-owned", "updated_at": now - timedelta(hours=2)},
+    ])
+    await scans_routes.db["scan_blobs"].insert_one({"_id": "f" * 64, "s3_key": "k5", "ref_count": 1})
+
+    assert await upload_sessions.expire_sessions() == 3
+    assert sorted(aborted) == ["crashed", "crashed-owned", "stale"]
+    assert deleted == ["k4"]
+    remaining = {s["s3_upload_id"]: s["status"] for s in await sessions.find().to_list(None)}
+    assert remaining == {"active": "open", "finalising": "completing", "crashed": "failed", "crashed-owned": "failed"}
+
+
+@pytest.mark.asyncio
+async def test_expired_presigned_uploads_lose_their_object(monkeypatch):
+    from datetime import datetime, timedelta
+    from app.core import upload_sessions
+
+    class _DeleteS3Client:
+        def __init__(self):
+            self.deleted = []
+            self.unavailable = True
+
+        def delete_object(self, Bucket, Key):
+            if Key == "k3" and self.unavailable:
+                raise RuntimeError("S3 unavailable")
+            self.deleted.append(Key)
+
+    fake = _DeleteS3Client()
+    monkeypatch.setattr(scans_routes.s3_storage, "s3_v3", fake)
+    now = datetime.utcnow()
+    uploads = upload_sessions.db[upload_sessions.PRESIGNED_COLLECTION]
+    await uploads.insert_many([
+        {"status": "pending", "s3_key": "k1", "s3_bucket": "main", "expires_at": now - timedelta(hours=1)},
+        {"status": "pending", "s3_key": "k2", "s3_bucket": "main", "expires_at": now + timedelta(hours=1)},
+        {"status": "pending", "s3_key": "k3", "s3_bucket": "main", "expires_at": now - timedelta(hours=1)},
+        {"status": "confirmed", "s3_key": "k4", "s3_bucket": "main"},
+    ])
+
+    assert await upload_sessions.expire_presigned_uploads() == 1
+    assert fake.deleted == ["k1"]
+    # The failed delete keeps its record, claimed so a late confirm is refused, and is retried
+    assert (await uploads.find_one({"s3_key": "k3"}))["status"] == "expired"
+    fake.unavailable = False
+    assert await upload_sessions.expire_presigned_uploads() == 1
+    assert fake.deleted == ["k1", "k3"]
+    assert {u["s3_key"] for u in await uploads.find().to_list(None)} == {"k2", "k4"}
+
+
+@pytest.mark.asyncio
+async def test_failed_session_finalisation_releases_the_object(monkeypatch):
+    from fastapi import BackgroundTasks, HTTPException
+
+    class _AssembledS3Client:
+        def __init__(self):
+            self.deleted = []
+
+        def complete_multipart_upload(self, **kwargs):
+            pass
+
+        def get_object(self, **kwargs):
+            return {"Body": io.BytesIO(b"x" * 10), "ContentLength": 10, "ContentType": "image/jpeg", "ETag": '"e"'}
+
+        def delete_object(self, Bucket, Key):
+            self.deleted.append(Key)
+
+    async def broken_store_blob(*args, **kwargs):
+        raise RuntimeError("blob index unavailable")
+
+    fake = _AssembledS3Client()
+    monkeypatch.setattr(scans_routes.s3_storage, "s3_v3", fake)
+    monkeypatch.setattr(scans_routes, "_store_blob", broken_store_blob)
+    sessions = scans_routes.db[scans_routes.SESSIONS_COLLECTION]
+    session = await sessions.insert_one({
+        "user_id": "u-fail", "parcel_id": "p1", "filename": "a.jpg", "content_type": "image/jpeg",
+        "file_size": 10, "chunk_size": 10, "total_chunks": 1, "s3_key": "scans/u-fail/a.jpg",
+        "s3_bucket": "main", "s3_upload_id": "up-1", "parts": {"1": {"etag": "e1", "size": 10}}, "status": "open"
+    })
+    session_id = str(session.inserted_id)
+
+    with pytest.raises(HTTPException) as failed:
+        await scans_routes.complete_upload_session(session_id, BackgroundTasks(), user={"sub": "u-fail"})
+    assert failed.value.status_code == 500
+    assert fake.deleted == ["scans/u-fail/a.jpg"]
+    stored = await sessions.find_one({"_id": session.inserted_id})
+    assert stored["status"] == "failed" and "parts" not in stored
+    assert await scans_routes.db["scans"].count_documents({"user_id": "u-fail"}) == 0
+
+
+@pytest.mark.asyncio
+async def test_zip_stream_yields_members_as_they_are_read():
+    import zipfile
+    from datetime import datetime
+    from app.core.zip_stream import ZipMember, zip_stream
+
+    read = []
+
+    async def chunks(name, data):
+        for start in range(0, len(data), 1000):
+            read.append(name)
+            yield data[start:start + 1000]
+
+    async def members():
+        yield ZipMember("p/a.jpg", datetime(2025, 6, 1), chunks("a", b"a" * 5000), size=5000)
+        yield ZipMember("p/b.tif", datetime(2025, 6, 1), chunks("b", b"b" * 3000))
+        yield ZipMember("manifest.csv", datetime(2025, 6, 1), chunks("m", b"x,y\n"), compress_type=zipfile.ZIP_DEFLATED)
+
+    stream = zip_stream(members())
+    first = await stream.__anext__()
+    # Bytes of the first member leave before the rest of it is read
+    assert first.startswith(b"PK") and read == ["a"]
+    archive = first + b"".join([chunk async for chunk in stream])
+
+    with zipfile.ZipFile(io.BytesIO(archive)) as result:
+        assert result.testzip() is None
+        assert result.namelist() == ["p/a.jpg", "p/b.tif", "manifest.csv"]
+        assert result.read("p/b.tif") == b"b" * 3000
+    assert scans_routes._archive_path("Sud/Est", "a.jpg", {"Sud_Est/a.jpg"}) == "Sud_Est/a (2).jpg"
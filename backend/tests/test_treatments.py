@@ -0,0 +1,354 @@
+"""
+Tests for the treatment register analytics
+"""
+from datetime import date, datetime
+from pathlib import Path
+
+import json
+import pytest
+from bson import ObjectId
+from httpx import AsyncClient
+
+import app.routes.parcels as parcels_routes
+
+from app.ephy.index import EphyIndex, EphyProduct, EphyUsage
+from app.treatments.compliance import (
+    RULE_DAR,
+    RULE_MAX_APPLICATIONS,
+    RULE_MIN_INTERVAL,
+    UsageLimits,
+    evaluate_season,
+    limits_from_usages,
+)
+from app.treatments.ift import ReferenceDose, reference_doses, rollup_operations, treatment_ift
+from app.treatments.znt import LocalProjection, ZntDistances, ZntEngine
+
+
+def _usage(amm: str, max_apps: str = "", intervalle: str = "", dar: str = "",
+           dose: str = "2.5", dose_unite: str = "kg/ha") -> EphyUsage:
+    return EphyUsage(
+        amm=amm,
+        identifiant_usage="Vigne*Trt Part.Aer.*Mildiou(s)",
+        etat_usage="AUTORISE",
+        dose=dose,
+        dose_unite=dose_unite,
+        dar_jour=dar,
+        dar_bbch="",
+        max_apps=max_apps,
+        intervalle_min=intervalle,
+        date_decision="2025-01-01",
+        date_fin_distribution="",
+        date_fin_utilisation="",
+        condition_emploi="",
+        znt_aquatique="20",
+        znt_arthropodes="5",
+        znt_plantes="",
+        mentions="",
+    )
+
+
+def _treatment(parcel_id: str, day: date, **extra) -> dict:
+    return {
+        "_id": f"{parcel_id}-{day.isoformat()}",
+        "parcel_id": parcel_id,
+        "data_tratament": datetime.combine(day, datetime.min.time()),
+        "produs_utilizat": extra.pop("produs_utilizat", "Produit Vigne"),
+        **extra,
+    }
+
+
+@pytest.mark.asyncio
+async def test_usage_limits_keep_strictest_usage(tmp_path: Path):
+    index = EphyIndex(tmp_path / "ephy.sqlite")
+    index.init_schema()
+    index.bulk_insert_usages([
+        _usage("123456", max_apps="3", intervalle="7", dar="21"),
+        _usage("123456", max_apps="2", intervalle="10", dar="28"),
+        _usage("999999", max_apps="", intervalle="", dar="0"),
+    ])
+
+    usages = index.get_usages_for_amms({"123456", "999999", "000000"})
+    assert len(usages["123456"]) == 2
+    assert usages["000000"] == []
+
+    limits = limits_from_usages(usages)
+    assert limits["123456"] == UsageLimits(max_applications=2, min_interval_days=10, dar_days=28)
+    assert limits["999999"] == UsageLimits(max_applications=None, min_interval_days=None, dar_days=0)
+
+
+@pytest.mark.asyncio
+async def test_evaluate_season_flags_each_rule():
+    limits = {"123456": UsageLimits(max_applications=2, min_interval_days=10, dar_days=21)}
+    treatments = [
+        _treatment("p1", date(2026, 5, 1), amm="123456"),
+        _treatment("p1", date(2026, 5, 6), amm="123456"),
+        _treatment("p1", date(2026, 8, 25), amm="123456"),
+        _treatment("p2", date(2026, 6, 1), amm="123456"),
+    ]
+
+    report = evaluate_season(treatments, limits, season=2026, harvest_date=date(2026, 9, 5))
+
+    assert report.treatments_count == 4
+    assert not report.compliant
+    rules = [(v.parcel_id, v.rule, v.treatment_date) for v in report.violations]
+    assert ("p1", RULE_MIN_INTERVAL, date(2026, 5, 6)) in rules
+    assert ("p1", RULE_MAX_APPLICATIONS, date(2026, 8, 25)) in rules
+    assert ("p1", RULE_DAR, date(2026, 8, 25)) in rules
+    assert all(v.parcel_id == "p1" for v in report.violations)
+
+    safe_dates = report.harvest_safe_dates()
+    assert safe_dates["p1"] == date(2026, 9, 15)
+    assert safe_dates["p2"] == date(2026, 6, 22)
+
+
+@pytest.mark.asyncio
+async def test_dar_ignores_post_harvest_applications():
+    limits = {"123456": UsageLimits(dar_days=21)}
+    treatments = [
+        _treatment("p1", date(2026, 7, 1), amm="123456"),
+        _treatment("p1", date(2026, 8, 20), amm="123456"),
+        # Post-harvest copper on the wood: nothing left to contaminate
+        _treatment("p1", date(2026, 9, 20), amm="123456"),
+        _treatment("p2", date(2026, 9, 10), amm="123456"),
+    ]
+
+    report = evaluate_season(treatments, limits, season=2026, harvest_date=date(2026, 9, 5))
+
+    assert [(v.parcel_id, v.treatment_date, v.actual) for v in report.violations] == [
+        ("p1", date(2026, 8, 20), 16)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_evaluate_season_falls_back_to_stored_limits():
+    treatments = [
+        _treatment("p1", date(2026, 5, 1), produs_utilizat="Sulf", dar_jour=5, max_applications=1),
+        _treatment("p1", date(2026, 5, 20), produs_utilizat="sulf ", dar_jour=5, max_applications=1),
+        _treatment("p1", date(2026, 5, 20), produs_utilizat="Cupru"),
+    ]
+
+    report = evaluate_season(treatments, {}, season=2026)
+
+    assert [v.rule for v in report.violations] == [RULE_MAX_APPLICATIONS]
+    products = {p.product.strip().lower(): p for p in report.products}
+    assert products["sulf"].applications == 2
+    assert products["sulf"].harvest_safe_date == date(2026, 5, 25)
+    assert products["cupru"].harvest_safe_date is None
+
+
+@pytest.mark.asyncio
+async def test_reference_dose_and_treatment_ift():
+    usages = {
+        "123456": [
+            vars(_usage("123456", dose="3,0", dose_unite="kg/ha")),
+            vars(_usage("123456", dose="2", dose_unite="L/ha")),
+            vars(_usage("123456", dose="0.1", dose_unite="kg/hL")),
+        ],
+        "999999": [vars(_usage("999999", dose="0.2", dose_unite="kg/hL"))],
+    }
+
+    references = reference_doses(usages)
+    assert references == {"123456": ReferenceDose(dose=2.0, unit="L/ha")}
+
+    # Half dose on half of the parcel
+    assert treatment_ift(1.0, 2.5, 5.0, references["123456"]) == 0.25
+    # Unknown reference counts as a full dose, treated area capped at the parcel
+    assert treatment_ift(7.0, 8.0, 5.0, None) == 1.0
+
+
+@pytest.mark.asyncio
+async def test_rollup_operations_weight_establishment_by_area():
+    treatment = _treatment("p1", date(2026, 6, 1), tip_tratament="Fungicid", establishment_id="e1", user_id="u1")
+
+    parcel_op, establishment_op = rollup_operations(treatment, 0.5, 4.0)
+
+    assert parcel_op._filter == {"scope": "parcel", "scope_id": "p1", "season": 2026}
+    assert parcel_op._doc["$inc"] == {"ift": 0.5, "ift_area": 2.0, "treatments_count": 1, "by_type.fungicid": 0.5}
+    assert establishment_op._filter == {"scope": "establishment", "scope_id": "e1", "season": 2026}
+    assert establishment_op._doc["$inc"] == {"ift_area": 2.0, "treatments_count": 1, "by_type.fungicid": 2.0}
+
+
+@pytest.mark.asyncio
+async def test_parcel_resize_and_delete_keep_ift_rollups_exact():
+    db = parcels_routes.db
+    user = {"sub": "u1"}
+    resized = await db["parcels"].insert_one({"name": "A", "user_id": "u1", "establishment_id": "e1", "area_ha": 2.0})
+    other = await db["parcels"].insert_one({"name": "B", "user_id": "u1", "establishment_id": "e1", "area_ha": 1.0})
+    resized_id, other_id = str(resized.inserted_id), str(other.inserted_id)
+    treatments = [
+        # Half dose on 1 ha of 2: IFT 0.25
+        _treatment(resized_id, date(2026, 5, 1), doza_aplicata=1.0, suprafata_tratata=1.0,
+                   ift_reference_dose=2.0, ift=0.25),
+        _treatment(resized_id, date(2026, 6, 1), doza_aplicata=3.0, ift=1.0),
+        _treatment(other_id, date(2026, 6, 1), doza_aplicata=3.0, ift=1.0),
+    ]
+    for treatment in treatments:
+        treatment.update(establishment_id="e1", user_id="u1")
+        area = 2.0 if treatment["parcel_id"] == resized_id else 1.0
+        await db["treatments"].insert_one(treatment)
+        await db["ift_rollups"].bulk_write(rollup_operations(treatment, treatment["ift"], area))
+
+    async def rollup(scope, scope_id):
+        return await db["ift_rollups"].find_one({"scope": scope, "scope_id": scope_id, "season": 2026})
+
+    await parcels_routes.update_parcel(
+        resized_id,
+        parcels_routes.ParcelCreate(name="A", crop_type="vigne", area_ha=4.0, establishment_id="e1"),
+        user=user,
+    )
+    # The 1 ha treated is now a quarter of the parcel; the untreated-area one stays a full IFT
+    assert (await rollup("parcel", resized_id))["ift"] == pytest.approx(1.125)
+    establishment = await rollup("establishment", "e1")
+    assert establishment["ift_area"] == pytest.approx(0.5 + 4.0 + 1.0)
+    assert establishment["treatments_count"] == 3
+
+    await parcels_routes.delete_parcel(resized_id, user=user)
+    assert await rollup("parcel", resized_id) is None
+    establishment = await rollup("establishment", "e1")
+    assert establishment["ift_area"] == pytest.approx(1.0) and establishment["treatments_count"] == 1
+    assert establishment["by_type"]["autre"] == pytest.approx(1.0)
+
+
+@pytest.mark.asyncio
+async def test_parcel_moved_to_another_establishment_takes_its_treatments():
+    from fastapi import HTTPException
+
+    db = parcels_routes.db
+    user = {"sub": "u1"}
+    source, target, foreign = ObjectId(), ObjectId(), ObjectId()
+    await db["establishments"].insert_many([
+        {"_id": source, "user_id": "u1"}, {"_id": target, "user_id": "u1"}, {"_id": foreign, "user_id": "u2"},
+    ])
+    parcel = await db["parcels"].insert_one({"name": "A", "user_id": "u1", "establishment_id": str(source), "area_ha": 2.0})
+    parcel_id = str(parcel.inserted_id)
+    dated = _treatment(parcel_id, date(2026, 6, 1), doza_aplicata=3.0, ift=1.0, establishment_id=str(source), user_id="u1")
+    await db["treatments"].insert_one(dated)
+    await db["ift_rollups"].bulk_write(rollup_operations(dated, 1.0, 2.0))
+    await db["treatments"].insert_one({"_id": "undated", "parcel_id": parcel_id, "establishment_id": str(source)})
+
+    def moved_to(establishment_id):
+        return parcels_routes.ParcelCreate(name="A", crop_type="vigne", area_ha=2.0, establishment_id=str(establishment_id))
+
+    with pytest.raises(HTTPException) as denied:
+        await parcels_routes.update_parcel(parcel_id, moved_to(foreign), user=user)
+    assert denied.value.status_code == 403
+
+    await parcels_routes.update_parcel(parcel_id, moved_to(target), user=user)
+
+    treatments = await db["treatments"].find({"parcel_id": parcel_id}).to_list(None)
+    assert {t["establishment_id"] for t in treatments} == {str(target)}
+
+    async def rollup(scope, scope_id):
+        return await db["ift_rollups"].find_one({"scope": scope, "scope_id": scope_id, "season": 2026})
+
+    old = await rollup("establishment", str(source))
+    assert old["ift_area"] == pytest.approx(0.0) and old["treatments_count"] == 0
+    new = await rollup("establishment", str(target))
+    assert new["ift_area"] == pytest.approx(2.0) and new["treatments_count"] == 1
+    parcel_rollup = await rollup("parcel", parcel_id)
+    assert parcel_rollup["ift"] == pytest.approx(1.0) and parcel_rollup["establishment_id"] == str(target)
+
+
+@pytest.mark.asyncio
+async def test_ephy_autofill_takes_the_widest_znt_of_all_usages(tmp_path: Path, monkeypatch):
+    from dataclasses import replace
+
+    index = EphyIndex(tmp_path / "ephy.sqlite")
+    index.init_schema()
+    index.bulk_insert_usages([
+        _usage("123456", max_apps="3", dar="21"),
+        replace(_usage("123456", max_apps="2", dar="28"), identifiant_usage="Vigne*Trt Part.Aer.*Oidium(s)",
+                znt_aquatique="5", znt_arthropodes="", znt_plantes="5"),
+        replace(_usage("123456"), identifiant_usage="Vigne*Trt Part.Aer.*Botrytis", znt_aquatique="50"),
+    ])
+    index.bulk_insert_products(
+        [EphyProduct(amm="123456", name="Produit Vigne", titulaire="", fonctions="Fongicide", etat="AUTORISE",
+                     type_produit="PPP", type_commercial="", gamme_usage="", mentions="", restrictions="",
+                     substances="", formulations="", ref_amm="", ref_name="")],
+        {"123456"},
+    )
+    monkeypatch.setattr(parcels_routes, "EPHY_STORAGE_PATH", str(tmp_path / "ephy.sqlite"))
+
+    ephy_data, _ = parcels_routes.resolve_ephy_autofill("123456")
+
+    assert (ephy_data["znt_aquatique"], ephy_data["znt_arthropodes"], ephy_data["znt_plantes"]) == (50, 5, 5)
+    assert (ephy_data["dar_jour"], ephy_data["max_applications"]) == (28, 2)
+
+
+def _square(lon0: float, lat0: float, side_m: float) -> list:
+    projection = LocalProjection(lon0, lat0)
+    dlon, dlat = side_m / projection.kx, side_m / projection.ky
+    return [[[lon0, lat0], [lon0 + dlon, lat0], [lon0 + dlon, lat0 + dlat], [lon0, lat0 + dlat], [lon0, lat0]]]
+
+
+@pytest.mark.asyncio
+async def test_znt_excludes_strip_along_water_and_caches(tmp_path: Path):
+    lon0, lat0 = 4.80, 44.10
+    parcel = {"type": "Polygon", "coordinates": _square(lon0, lat0, 100)}
+    west_edge = [[lon0, lat0 - 0.01], [lon0, lat0 + 0.01]]
+    far_hedge = [[lon0 + 0.05, lat0], [lon0 + 0.05, lat0 + 0.01]]
+    (tmp_path / "hydro.geojson").write_text(json.dumps({
+        "type": "FeatureCollection",
+        "features": [{"type": "Feature", "properties": {}, "geometry": {"type": "LineString", "coordinates": west_edge}}],
+    }))
+    (tmp_path / "hedges.geojson").write_text(json.dumps({
+        "type": "FeatureCollection",
+        "features": [{"type": "Feature", "properties": {}, "geometry": {"type": "LineString", "coordinates": far_hedge}}],
+    }))
+    engine = ZntEngine(tmp_path / "hydro.geojson", tmp_path / "hedges.geojson", cache_size=2)
+
+    result = engine.compute(parcel, ZntDistances(aquatique=20, plantes=5))
+
+    assert result.parcel_area_ha == pytest.approx(1.0, rel=1e-3)
+    assert result.excluded_hydro_ha == pytest.approx(0.2, rel=1e-3)
+    assert result.excluded_hedge_ha == 0.0
+    assert result.hydro_features == 1 and result.hedge_features == 0
+    assert result.treatable_area_ha == pytest.approx(0.8, rel=1e-3)
+    assert engine.compute(parcel, ZntDistances(aquatique=20, plantes=5)) is result
+
+    # No layer file: the whole parcel stays treatable
+    bare = ZntEngine(tmp_path / "missing.geojson", tmp_path / "missing.geojson")
+    assert bare.compute(parcel, ZntDistances(aquatique=50)).excluded_area_ha == 0.0
+
+@pytest.mark.asyncio
+async def test_bulk_treatment_creates_one_row_per_parcel(client: AsyncClient, auth_headers):
+    est_response = await client.post(
+        "/establishments",
+        json={"name": "Test Farm", "siret": "123456", "address": "Test Location", "surface_ha": 10.5},
+        headers=auth_headers,
+    )
+    est_id = est_response.json()["id"]
+    tenant_headers = {**auth_headers, "X-Tenant-Id": f"est:{est_id}"}
+
+    parcel_ids = []
+    for name in ("Bloc A", "Bloc B"):
+        response = await client.post(
+            "/parcels",
+            json={"name": name, "establishment_id": est_id, "area_ha": 2.0, "crop_type": "vigne",
+                  "coordinates": [[[24.5, 45.5], [24.6, 45.5], [24.6, 45.6], [24.5, 45.5]]]},
+            headers=tenant_headers,
+        )
+        parcel_ids.append(response.json()["id"])
+
+    treatment = {
+        "data_tratament": "2025-05-01",
+        "tip_tratament": "Fungicid",
+        "produs_utilizat": "Sulf",
+        "doza_aplicata": 2,
+    }
+    response = await client.post(
+        "/treatments/bulk",
+        json={"parcel_ids": parcel_ids + [parcel_ids[0]], "treatment": treatment},
+        headers=tenant_headers,
+    )
+    assert response.status_code == 201
+    data = response.json()
+    assert data["created"] == 2
+    assert {t["parcel_id"] for t in data["treatments"]} == set(parcel_ids)
+
+    response = await client.post(
+        "/treatments/bulk",
+        json={"parcel_ids": [parcel_ids[0], str(ObjectId())], "treatment": treatment},
+        headers=tenant_headers,
+    )
+    assert response.status_code == 404
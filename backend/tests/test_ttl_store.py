@@ -0,0 +1,117 @@
+"""
+Tests for the TTL store behind phone verification codes
+"""
+import asyncio
+import os
+
+import pytest
+from httpx import AsyncClient
+
+import app.core.ttl_store as ttl_store
+import app.routes.auth as auth_routes
+from app.core.ttl_store import MemoryTTLStore, RedisTTLStore
+
+# Point at a disposable Redis to run the shared-store tests against it too
+REDIS_URL = os.getenv("TTL_STORE_TEST_REDIS_URL")
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = _Clock()
+    monkeypatch.setattr(ttl_store.time, "monotonic", fake)
+    return fake
+
+
+@pytest.fixture(params=["memory", "redis"])
+async def store(request):
+    if request.param == "memory":
+        yield MemoryTTLStore()
+        return
+    if not REDIS_URL:
+        pytest.skip("TTL_STORE_TEST_REDIS_URL not set")
+    redis_store = RedisTTLStore(REDIS_URL, prefix=f"vitiscan-test:{os.getpid()}:")
+    yield redis_store
+    await redis_store.close()
+
+
+@pytest.mark.asyncio
+async def test_store_counters_and_single_consumer(store):
+    await store.set("+40700123456", {"code": "123456", "attempts": 0}, 60)
+    assert await store.get("+40700123456") == {"code": "123456", "attempts": "0"}
+
+    # Concurrent attempts are all counted
+    counts = await asyncio.gather(*(store.incr("+40700123456", "attempts") for _ in range(5)))
+    assert sorted(counts) == [1, 2, 3, 4, 5]
+    assert await store.incr("missing", "attempts") is None
+    assert await store.get("missing") is None
+
+    consumed = await asyncio.gather(*(store.delete("+40700123456") for _ in range(3)))
+    assert consumed.count(True) == 1
+    assert await store.get("+40700123456") is None
+
+
+@pytest.mark.asyncio
+async def test_memory_store_expires_without_reads_and_stays_bounded(clock):
+    store = MemoryTTLStore(max_entries=3)
+    await store.set("a", {"code": "1"}, 10)
+    await store.set("b", {"code": "2"}, 20)
+    await store.set("a", {"code": "3"}, 30)
+    clock.now += 15
+    # "a" was re-set: its first expiry no longer applies
+    assert store._purge(clock.now) == 0
+    assert await store.get("a") == {"code": "3"} and await store.incr("a", "attempts") == 1
+
+    clock.now += 10
+    assert store._purge(clock.now) == 1 and len(store) == 1
+
+    for key in ("c", "d", "e"):
+        await store.set(key, {"code": key}, 100)
+    # Full: the record closest to expiry ("a") made room
+    assert len(store) == 3 and await store.get("a") is None
+
+    clock.now += 200
+    sweeper = asyncio.create_task(store.run_sweeper(60))
+    await asyncio.sleep(0)
+    sweeper.cancel()
+    assert len(store) == 0
+
+
+def test_backend_missing_an_operation_cannot_be_built():
+    class _NoIncr(ttl_store.TTLStore):
+        async def set(self, key, fields, ttl_seconds):
+            pass
+
+        async def get(self, key):
+            return None
+
+        async def delete(self, key):
+            return False
+
+    with pytest.raises(TypeError):
+        _NoIncr()
+
+
+@pytest.mark.asyncio
+async def test_phone_code_verified_once(client: AsyncClient, monkeypatch):
+    monkeypatch.setattr(auth_routes, "verification_store", MemoryTTLStore())
+    phone = "+40700123456"
+    response = await client.post("/send-verification-code", json={"phone": phone})
+    assert response.status_code == 200
+    assert (await client.post("/send-verification-code", json={"phone": phone})).status_code == 429
+
+    code = (await client.get("/dev/verification-code", params={"phone": phone})).json()["code"]
+    wrong = "000000" if code != "000000" else "111111"
+    assert (await client.post("/verify-phone-code", json={"phone": phone, "code": wrong})).status_code == 400
+
+    response = await client.post("/verify-phone-code", json={"phone": phone, "code": code})
+    assert response.status_code == 200 and response.json()["verified"] is True
+    # Consumed: the code cannot be replayed
+    assert (await client.post("/verify-phone-code", json={"phone": phone, "code": code})).status_code == 400
@@ -0,0 +1,172 @@
+"""
+Tests for the clamd INSTREAM scanning stage, against a local stub daemon
+"""
+import asyncio
+import io
+import struct
+
+import pytest
+from fastapi import HTTPException, UploadFile
+from starlette.datastructures import Headers
+
+import app.routes.scans as scans_routes
+from app.core import virus_scan
+from app.core.virus_scan import StreamScan, VirusScanner, parse_reply
+
+# Part of the EICAR test string: enough for the stub, harmless to real scanners
+MARKER = b"EICAR-STANDARD-ANTIVIRUS-TEST-FILE"
+
+
+class StubClamd:
+    """clamd speaking INSTREAM only: flags MARKER and enforces StreamMaxLength"""
+
+    def __init__(self, max_length: int = 1024 * 1024):
+        self.max_length = max_length
+        self.received = []
+        self.server = None
+
+    async def handle(self, reader, writer):
+        command = await reader.readuntil(b"\0")
+        assert command == b"zINSTREAM\0"
+        data = bytearray()
+        while True:
+            size = struct.unpack("!I", await reader.readexactly(4))[0]
+            if size == 0:
+                break
+            data += await reader.readexactly(size)
+            if len(data) > self.max_length:
+                writer.write(b"INSTREAM size limit exceeded. ERROR\0")
+                await writer.drain()
+                writer.close()
+                return
+        self.received.append(bytes(data))
+        writer.write(b"stream: Eicar-Test-Signature FOUND\0" if MARKER in data else b"stream: OK\0")
+        await writer.drain()
+        writer.close()
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+
+@pytest.fixture
+async def clamd():
+    stub = StubClamd()
+    stub.port = await stub.start()
+    yield stub
+    stub.server.close()
+    await stub.server.wait_closed()
+
+
+async def _scan(port: int, chunks) -> virus_scan.ScanVerdict:
+    session = StreamScan("127.0.0.1", port, timeout=5, queue_chunks=2)
+    for chunk in chunks:
+        await session.feed(chunk)
+    return await session.result()
+
+
+def test_parse_reply():
+    assert parse_reply(b"stream: OK\0").status == "clean"
+    verdict = parse_reply(b"stream: Win.Test.EICAR_HDB-1 FOUND\0")
+    assert verdict.infected and verdict.signature == "Win.Test.EICAR_HDB-1"
+    assert parse_reply(b"INSTREAM size limit exceeded. ERROR\0").status == "error"
+
+
+@pytest.mark.asyncio
+async def test_stream_scan_verdicts(clamd):
+    assert (await _scan(clamd.port, [b"a" * 1000] * 10)).status == "clean"
+    assert clamd.received[-1] == b"a" * 10000
+
+    verdict = await _scan(clamd.port, [b"header", MARKER, b"tail"])
+    assert verdict.infected and verdict.signature == "Eicar-Test-Signature"
+
+    clamd.max_length = 5000
+    assert (await _scan(clamd.port, [b"x" * 1000] * 20)).status == "error"
+
+
+@pytest.mark.asyncio
+async def test_stream_scan_without_daemon_never_blocks_the_upload():
+    server = await asyncio.start_server(lambda r, w: None, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    server.close()
+    await server.wait_closed()
+
+    # More chunks than the queue holds: feeding must not hang once the session failed
+    verdict = await asyncio.wait_for(_scan(port, [b"x" * 100] * 50), 5)
+    assert verdict.status == "error"
+    assert not VirusScanner(True, "127.0.0.1", port).rejects(verdict)
+    assert VirusScanner(True, "127.0.0.1", port, fail_closed=True).rejects(verdict)
+
+
+@pytest.mark.asyncio
+async def test_stream_scan_with_stalled_daemon_never_blocks_the_upload():
+    connections = []
+
+    async def accept_and_never_read(reader, writer):
+        connections.append(writer)
+
+    server = await asyncio.start_server(accept_and_never_read, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    # Far more than the socket buffers hold: clamd's side stops the writes early on
+    session = StreamScan("127.0.0.1", port, timeout=0.5, queue_chunks=2)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    for _ in range(64):
+        await asyncio.wait_for(session.feed(b"x" * 1024 * 1024), 2)
+    verdict = await asyncio.wait_for(session.result(), 2)
+    assert verdict.status == "error"
+    assert loop.time() - started < 3
+
+    for writer in connections:
+        writer.close()
+    server.close()
+    await server.wait_closed()
+
+
+class _QuarantineS3Client:
+    def __init__(self):
+        self.objects = {}
+        self.parts = {}
+
+    def create_multipart_upload(self, Key, **kwargs):
+        return {"UploadId": Key}
+
+    def upload_part(self, UploadId, PartNumber, Body, **kwargs):
+        self.parts.setdefault(UploadId, []).append(Body)
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Key, UploadId, **kwargs):
+        self.objects[Key] = b"".join(self.parts.pop(UploadId))
+
+    def copy_object(self, Bucket, Key, CopySource):
+        self.objects[Key] = self.objects[CopySource["Key"]]
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+
+@pytest.mark.asyncio
+async def test_infected_upload_is_quarantined(clamd, monkeypatch):
+    fake = _QuarantineS3Client()
+    monkeypatch.setattr(scans_routes.s3_storage, "s3_v3", fake)
+    monkeypatch.setattr(scans_routes, "virus_scanner", VirusScanner(True, "127.0.0.1", clamd.port, timeout=5))
+
+    def upload(data: bytes) -> UploadFile:
+        return UploadFile(
+            io.BytesIO(data), size=len(data), filename="a.jpg", headers=Headers({"content-type": "image/jpeg"})
+        )
+
+    scan, _, _ = await scans_routes._store_upload(upload(b"\xff\xd8\xff" + b"0" * 5000), "u1", "p1")
+    assert scan["virus_scan"]["status"] == "clean"
+    assert clamd.received[-1] == fake.objects[scan["s3_key"]]
+
+    with pytest.raises(HTTPException) as rejected:
+        await scans_routes._store_upload(upload(b"\xff\xd8\xff" + MARKER), "u1", "p1")
+    assert rejected.value.status_code == 422
+
+    quarantined = await virus_scan.db[virus_scan.QUARANTINE_COLLECTION].find_one({"user_id": "u1"})
+    assert quarantined["signature"] == "Eicar-Test-Signature"
+    assert quarantined["s3_key"] not in fake.objects
+    assert fake.objects[quarantined["quarantine_key"]].endswith(MARKER)
+    assert await scans_routes.db["scan_blobs"].count_documents({}) == 1